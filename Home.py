@@ -1,4 +1,5 @@
 import streamlit as st
+from utils.session import init_session
 
 # ページ設定
 st.set_page_config(
@@ -7,6 +8,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# セッション初期化
+init_session()
+
 # タイトル
 st.title("🔎 パワハラ認識傾向チェック")
 st.info("パワーハラスメントに対する「あなたの認識」を法的・社会的基準と比較分析します。")
@@ -0,0 +1,96 @@
+"""
+Home / 診断ページ（Page 1）の import 時間の予算チェック
+
+    python -m benchmarks.bench_import_time [--repeat 5] [--verbose]
+
+各ページの先頭の import 文だけを新しいインタープリタで `python -X importtime` 付きで実行し、
+Streamlit（と Supabase クライアント）を読み込んだ後に、アプリ側の import で増えた時間を測ります。
+- 中央値が BUDGETS_MS を超えた場合
+- 初回表示に不要な重いモジュール（HEAVY_MODULES）が読み込まれた場合
+は終了コード 1 を返すので、CI などで回帰チェックに使えます。
+--verbose では、アプリ側で時間のかかったモジュールの上位を表示します。
+"""
+import argparse
+import ast
+import glob
+import statistics
+import subprocess
+import sys
+
+# ページごとの予算（ミリ秒、アプリ側の import のみ）
+BUDGETS_MS = {
+    "Home.py": 50,
+    "pages/1_*.py": 200,
+}
+# Home と Page 1 の初回表示では読み込まないモジュール（集計・グラフ・表の装飾用）
+HEAVY_MODULES = ("numpy", "pandas", "plotly.express", "matplotlib", "utils.population", "utils.charts")
+# ここまでは計測の前に読み込む（どのページでも必要なフレームワーク部分）
+BASELINE = (
+    "import streamlit, streamlit.components.v1\n"
+    "try:\n    import supabase\nexcept ImportError:\n    pass\n"
+)
+MARKER = "-- app imports --"
+
+
+def page_imports(path):
+    """ページのトップレベルの import 文だけを取り出す"""
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return "\n".join(
+        ast.get_source_segment(source, node)
+        for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def measure(imports):
+    """
+    Returns:
+        tuple: (アプリ側の import の合計 ms, [(自身の ms, モジュール名)], 読み込まれた重いモジュール)
+    """
+    code = (
+        f"{BASELINE}import sys as _sys\n_sys.stderr.write({MARKER!r} + '\\n'); _sys.stderr.flush()\n{imports}\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in _sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True,
+    )
+    modules, started = [], False
+    for line in result.stderr.splitlines():
+        # BASELINE の後に出力した目印以降がアプリ側
+        if line == MARKER:
+            started = True
+        if not started or not line.startswith("import time:"):
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            modules.append((int(self_us) / 1e3, name))
+    heavy = [m for m in result.stdout.strip().split(",") if m]
+    return sum(ms for ms, _ in modules), modules, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    failed = False
+    for pattern, budget in BUDGETS_MS.items():
+        path = glob.glob(pattern)[0]
+        imports = page_imports(path)
+        runs = [measure(imports) for _ in range(args.repeat)]
+        median = statistics.median(total for total, _, _ in runs)
+        heavy = sorted({m for _, _, found in runs for m in found})
+        ok = median <= budget and not heavy
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {pattern:14s}: {median:6.1f}ms (budget {budget}ms)"
+              + (f"  heavy modules: {', '.join(heavy)}" if heavy else ""))
+        if args.verbose:
+            for ms, name in sorted(runs[-1][1], reverse=True)[:10]:
+                print(f"       {ms:6.1f}ms  {name.strip()}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
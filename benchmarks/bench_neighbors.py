@@ -0,0 +1,59 @@
+"""
+「あなたに近い回答者」近傍探索のベンチマーク
+
+    python -m benchmarks.bench_neighbors [--users 1000000] [--n 50]
+
+厳密探索と IVF 近似探索の応答時間、および近似探索の再現率 (recall@n) と
+近傍までの平均距離の比（近似 / 厳密、1.0 に近いほど良い）を計測します。
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_profiles import make_synthetic_ratings
+from utils.neighbors import NeighborIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--n", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    X = make_synthetic_ratings(args.users)
+    ids = np.arange(args.users)
+    queries = make_synthetic_ratings(args.queries, seed=1)
+
+    for approximate in (False, True):
+        t0 = time.perf_counter()
+        index = NeighborIndex(X, ids, approximate=approximate)
+        build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        results = [index.query(q, n=args.n) for q in queries]
+        per_query = (time.perf_counter() - t0) / args.queries * 1e3
+        label = "approximate" if approximate else "exact"
+        print(f"{label:<12}: build {build:.2f}s, query {per_query:.2f}ms")
+
+        if approximate:
+            # 評価値が離散のため距離の同点が多い。再現率は「厳密解の n 番目の距離以下か」で判定する
+            recall, ratio = [], []
+            for q, (_, d_approx) in zip(queries, results):
+                _, d_exact = exact.query(q, n=args.n)
+                recall.append(np.mean(d_approx <= d_exact[-1] + 1e-4))
+                ratio.append(np.sqrt(d_approx).mean() / max(np.sqrt(d_exact).mean(), 1e-9))
+            print(f"recall@{args.n}    : {np.mean(recall):.3f}")
+            print(f"distance ratio: {np.mean(ratio):.3f}")
+        else:
+            exact = index
+
+    t0 = time.perf_counter()
+    for i, q in enumerate(queries):
+        index.add(q, args.users + i)
+    print(f"add (1 user)  : {(time.perf_counter() - t0) / args.queries * 1e3:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
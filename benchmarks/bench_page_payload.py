@@ -0,0 +1,59 @@
+"""
+ページ 1 回の実行で送信される要素のバイト数の計測
+
+    python -m benchmarks.bench_page_payload [--users 1000] [--page 2]
+
+合成データ（benchmarks.synthetic_backend）でページを実行し、ブラウザへ送られる
+要素（protobuf）のシリアライズ後のサイズを要素の種類ごとに合計します。
+ページ 2 は「回答詳細」を全件表示にした状態も計測します。
+"""
+import argparse
+import glob
+import os
+import warnings
+from collections import Counter
+
+from benchmarks import synthetic_backend
+
+
+def payload_bytes(node, sizes):
+    """要素ツリーをたどり、要素の種類ごとのシリアライズ後サイズを sizes に加算する"""
+    proto = getattr(node, "proto", None)
+    if proto is not None and not getattr(node, "children", None):
+        sizes[node.type] += proto.ByteSize()
+    for child in getattr(node, "children", {}).values():
+        payload_bytes(child, sizes)
+    return sizes
+
+
+def _report(label, at):
+    sizes = payload_bytes(at._tree, Counter())
+    top = ", ".join(f"{k} {v / 1024:.0f}KB" for k, v in sizes.most_common(3))
+    print(f"{label:<14}: {sum(sizes.values()) / 1024:8.1f}KB  ({top})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--page", default="2")
+    args = parser.parse_args()
+
+    from streamlit.logger import set_log_level
+    from streamlit.testing.v1 import AppTest
+
+    set_log_level("error")
+    warnings.simplefilter("ignore", FutureWarning)
+    synthetic_backend.install(args.users)
+
+    at = AppTest.from_file(os.path.abspath(glob.glob(f"pages/{args.page}_*.py")[0]), default_timeout=600)
+    at.session_state["user_id"] = 1
+    at.run()
+    _report("initial", at)
+    if args.page == "2":
+        at.checkbox(key="show_all_details").check()
+        at.run()
+        _report("show all", at)
+
+
+if __name__ == "__main__":
+    main()
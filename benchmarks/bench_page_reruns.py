@@ -0,0 +1,63 @@
+"""
+ページ操作ごとの再実行時間の計測
+
+    python -m benchmarks.bench_page_reruns [--users 1000]
+
+合成データ（benchmarks.synthetic_backend）でページを実行し、操作ごとに
+- full    : ページ全体の再実行時間（フラグメント化前はどの操作でもこの時間がかかっていた）
+- fragment: 操作したフラグメントだけの処理時間（utils.timing の記録。フラグメント化後の再実行時間）
+を表示します。
+"""
+import argparse
+import glob
+import os
+import time
+import warnings
+
+from benchmarks import synthetic_backend
+from utils.timing import TIMINGS_KEY
+
+# (ページ番号, 操作名, フラグメントの計測名, 操作)
+INTERACTIONS = [
+    ("3", "判断傾向マップの指標", "page3.judgement_map", lambda at: at.radio(key="map_y_metric").set_value("entropy")),
+    ("3", "属性間ギャップの比較軸", "page3.gap_comparison", lambda at: _by_label(at.selectbox, "① 比較する軸 (切り口)").set_value("industry")),
+    ("3", "プロファイル構成の比較軸", "page3.profile_composition", lambda at: at.selectbox(key="profile_axis").set_value("industry")),
+    ("2", "回答詳細の全件表示", "page2.detail_list", lambda at: at.checkbox(key="show_all_details").check()),
+]
+
+
+def _by_label(widgets, label):
+    return next(w for w in widgets if w.label == label)
+
+
+def _page(number):
+    return os.path.abspath(glob.glob(f"pages/{number}_*.py")[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    from streamlit.logger import set_log_level
+    from streamlit.testing.v1 import AppTest
+
+    set_log_level("error")
+    warnings.simplefilter("ignore", FutureWarning)
+    synthetic_backend.install(args.users)
+    print(f"{args.users:,} users")
+    for page, label, section, interact in INTERACTIONS:
+        at = AppTest.from_file(_page(page), default_timeout=600)
+        at.session_state["user_id"] = 1
+        at.run()
+        interact(at)
+        t0 = time.perf_counter()
+        at.run()
+        full = (time.perf_counter() - t0) * 1e3
+        fragment = at.session_state[TIMINGS_KEY].get(section, float("nan"))
+        errors = [e.value for e in at.exception]
+        print(f"page {page} {label:<16}: full {full:8.1f}ms -> fragment {fragment:7.1f}ms" + (f"  {errors}" if errors else ""))
+
+
+if __name__ == "__main__":
+    main()
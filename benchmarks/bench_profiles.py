@@ -0,0 +1,56 @@
+"""
+認識プロファイル（ミニバッチ k-means）のベンチマーク
+
+    python -m benchmarks.bench_profiles [--users 1000000]
+
+合成データ（ユーザー × 30 シナリオ）で学習・全件割り当て・1 人分の割り当て・逐次更新の時間を計測します。
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.clustering import N_PROFILES, fit_profiles
+
+
+def make_synthetic_ratings(n_users, n_scenarios=30, seed=0):
+    """潜在的な厳しさ + シナリオ類型ごとの平均から 1〜6 の評価行列を生成する"""
+    rng = np.random.default_rng(seed)
+    base = np.tile([5.0, 2.5, 3.5], n_scenarios // 3 + 1)[:n_scenarios]  # Black / White / Gray
+    strictness = rng.normal(0.0, 0.8, size=(n_users, 1))
+    noise = rng.normal(0.0, 0.9, size=(n_users, n_scenarios))
+    return np.clip(np.rint(base[None, :] + strictness + noise), 1, 6).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--scenarios", type=int, default=30)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    X = make_synthetic_ratings(args.users, args.scenarios)
+    print(f"synthetic data : {args.users:,} users x {args.scenarios} scenarios ({time.perf_counter() - t0:.2f}s)")
+
+    t0 = time.perf_counter()
+    model = fit_profiles(X, k=N_PROFILES)
+    print(f"fit            : {time.perf_counter() - t0:.2f}s")
+
+    t0 = time.perf_counter()
+    labels = model.predict(X)
+    print(f"predict (all)  : {time.perf_counter() - t0:.2f}s  sizes={np.bincount(labels, minlength=model.k).tolist()}")
+
+    n_assign = 10_000
+    t0 = time.perf_counter()
+    for i in range(n_assign):
+        model.assign(X[i])
+    print(f"assign (1 user): {(time.perf_counter() - t0) / n_assign * 1e6:.1f}us")
+
+    t0 = time.perf_counter()
+    for i in range(n_assign):
+        model.partial_fit(X[i])
+    print(f"partial_fit    : {(time.perf_counter() - t0) / n_assign * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+診断ページ（Page 1）で回答を 1 つ選ぶたびのサーバー負荷の計測
+
+    python -m benchmarks.bench_questionnaire [--scenarios 30] [--page-size 5]
+
+合成シナリオ（benchmarks.synthetic_backend）で設問画面を表示し、ラジオボタンを 1 つ選んだときの
+- CPU   : ページ全体の再実行の CPU 時間と、操作した設問のフラグメントだけの処理時間（utils.timing の記録）
+- bytes : ページ全体で送られる要素のバイト数と、操作した設問のコンテナ内の要素のバイト数
+を表示します。AppTest はフラグメントもページ全体として再実行するため、フラグメント側の値は
+計測区間の記録と要素ツリーの部分木から求めています。
+--page-size を指定するとページ送り表示（[questionnaire] page_size）の初回表示のバイト数を比較します。
+"""
+import argparse
+import glob
+import os
+import time
+import warnings
+from collections import Counter
+
+from benchmarks import synthetic_backend
+from benchmarks.bench_page_payload import payload_bytes
+from utils.timing import TIMINGS_KEY
+
+ATTRIBUTES = dict(
+    age="30代", gender="女性", employment="正社員 (公務員含む)", service_years="3年〜10年 (中堅)",
+    position="一般社員", industry="IT・通信・インターネット", job="事務・管理系",
+)
+
+
+def _contains_key(node, key):
+    if getattr(node, "key", None) == key:
+        return True
+    return any(_contains_key(child, key) for child in getattr(node, "children", {}).values())
+
+
+def _smallest_block(node, key):
+    """key のウィジェットを含む最も内側のコンテナ（設問カード）"""
+    for child in getattr(node, "children", {}).values():
+        if getattr(child, "children", None) and _contains_key(child, key):
+            return _smallest_block(child, key)
+    return node
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", type=int, default=30)
+    parser.add_argument("--page-size", type=int, default=0)
+    args = parser.parse_args()
+
+    from streamlit.logger import set_log_level
+    from streamlit.testing.v1 import AppTest
+
+    set_log_level("error")
+    warnings.simplefilter("ignore", FutureWarning)
+    synthetic_backend.install(n_users=20, n_scenarios=args.scenarios)
+
+    at = AppTest.from_file(os.path.abspath(glob.glob("pages/1_*.py")[0]), default_timeout=600)
+    at.session_state["agreed_to_research"] = True
+    at.session_state["diagnosis_started"] = True
+    at.session_state["user_attributes_temp"] = ATTRIBUTES
+    at.run()
+    initial_bytes = sum(payload_bytes(at._tree, Counter()).values())
+
+    if args.page_size:
+        paged = AppTest.from_file(os.path.abspath(glob.glob("pages/1_*.py")[0]), default_timeout=600)
+        paged.secrets["questionnaire"] = {"page_size": args.page_size}
+        for name in ("agreed_to_research", "diagnosis_started", "user_attributes_temp"):
+            paged.session_state[name] = at.session_state[name]
+        paged.run()
+        paged_bytes = sum(payload_bytes(paged._tree, Counter()).values())
+        print(f"initial: all questions {initial_bytes / 1024:.1f}KB -> {args.page_size} per page {paged_bytes / 1024:.1f}KB")
+
+    key = f"q_{at.session_state['scenario_order'][0]}"
+    at.radio(key=key).set_value("かなり感じる")
+    t0 = time.process_time()
+    at.run()
+    full_cpu = (time.process_time() - t0) * 1e3
+    full_bytes = sum(payload_bytes(at._tree, Counter()).values())
+    fragment_ms = at.session_state[TIMINGS_KEY].get("page1.question", float("nan")) if TIMINGS_KEY in at.session_state else float("nan")
+    fragment_bytes = sum(payload_bytes(_smallest_block(at._tree, key), Counter()).values())
+
+    errors = [e.value for e in at.exception]
+    print(f"{args.scenarios} questions" + (f"  {errors}" if errors else ""))
+    print(f"cpu   : full {full_cpu:7.1f}ms -> fragment {fragment_ms:6.1f}ms")
+    print(f"bytes : full {full_bytes / 1024:7.1f}KB -> fragment {fragment_bytes / 1024:6.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+層別リザーバーサンプルのベンチマーク
+
+    python -m benchmarks.bench_reservoir [--sizes 1000 100000 1000000]
+
+回答者数を増やしたときの「属性別プロファイル構成比」の算出時間を、全件の割り当てと
+層別サンプル（各層最大 500 人）からの推定で比較し、推定の誤差（構成比の最大差, %pt）を示します。
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_profiles import make_synthetic_ratings
+from benchmarks.bench_sketches import make_synthetic_attrs
+from utils.clustering import fit_profiles
+from utils.sketches import StratifiedReservoir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    parser.add_argument("--axis", default="industry")
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        X = make_synthetic_ratings(n)
+        col = make_synthetic_attrs(n)[args.axis].to_numpy()
+        model = fit_profiles(X)
+        levels = np.unique(col)
+
+        t0 = time.perf_counter()
+        labels = model.predict(X)
+        exact = np.stack([np.bincount(labels[col == lv], minlength=model.k) / (col == lv).sum() for lv in levels])
+        t_exact = time.perf_counter() - t0
+
+        reservoir = StratifiedReservoir(X.shape[1])
+        t0 = time.perf_counter()
+        for lv in levels:
+            reservoir.add((args.axis, lv), X[col == lv])
+        t_build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        approx = np.stack([
+            np.bincount(model.predict(reservoir.sample((args.axis, lv))), minlength=model.k) / reservoir.filled[(args.axis, lv)]
+            for lv in levels
+        ])
+        t_approx = time.perf_counter() - t0
+
+        print(
+            f"{n:>9,} users: exact {t_exact * 1e3:7.1f}ms | sampled {t_approx * 1e3:5.1f}ms "
+            f"(build {t_build:.2f}s, max error {np.abs(exact - approx).max() * 100:.1f}pt)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+近似集計（スケッチ）のベンチマーク
+
+    python -m benchmarks.bench_sketches [--users 1000000]
+
+合成データで厳密集計とスケッチの答えを比較します。
+- 分析対象人数（セグメント別）: HyperLogLog の相対誤差
+- 回答者ごとの平均スコアの分位点: 固定ビンスケッチの絶対誤差（上限 0.01）
+- シナリオ × 評価ヒストグラム: 一致するか
+あわせて、状態のサイズと 1 人分の書き込み時更新の時間を計測します。
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_profiles import make_synthetic_ratings
+from utils.aggregates import build_cube
+from utils.sketches import OVERALL, SketchStore
+
+AXES = {
+    'age': ["20代", "30代", "40代", "50代", "60代以上"],
+    'position': ["一般社員", "主任・係長クラス", "課長クラス", "部長クラス", "経営層"],
+    'industry': ["メーカー・製造", "IT・通信", "金融", "小売・サービス", "医療・福祉", "公務員"],
+}
+
+
+def make_synthetic_attrs(n_users, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({axis: rng.choice(levels, size=n_users) for axis, levels in AXES.items()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    X = make_synthetic_ratings(args.users)
+    attrs = make_synthetic_attrs(args.users)
+    user_ids = np.arange(args.users)
+    scenario_ids = np.arange(1, X.shape[1] + 1)
+
+    t0 = time.perf_counter()
+    store = SketchStore(scenario_ids)
+    store.update_matrix(user_ids, attrs, X)
+    print(f"build        : {time.perf_counter() - t0:.2f}s")
+    data = store.to_bytes()
+    print(f"state size   : {len(data) / 1024:.0f}KB ({len(store.hll)} segments)")
+
+    # 分析対象人数
+    errors = [abs(store.users(OVERALL) - args.users) / args.users]
+    for axis in AXES:
+        exact = attrs[axis].value_counts()
+        errors += [abs(store.users((axis, lv)) - n) / n for lv, n in exact.items()]
+    print(f"distinct     : mean rel. error {np.mean(errors) * 100:.2f}%, max {np.max(errors) * 100:.2f}%")
+
+    # 平均スコアの分位点
+    user_means = X.mean(axis=1)
+    qs = (0.1, 0.25, 0.5, 0.75, 0.9)
+    q_err = [abs(store.quantiles[OVERALL].quantile(q) - np.quantile(user_means, q)) for q in qs]
+    for axis in AXES:
+        for lv in AXES[axis]:
+            sub = user_means[(attrs[axis] == lv).to_numpy()]
+            q_err += [abs(store.quantiles[(axis, lv)].quantile(q) - np.quantile(sub, q)) for q in qs]
+    print(f"quantiles    : max abs. error {np.max(q_err):.4f} (bound {store.quantiles[OVERALL].error_bound:.4f})")
+
+    # ヒストグラム
+    exact_cube = build_cube(X, attrs, ['industry'], scenario_ids)
+    same = all(np.array_equal(store.counts(('industry', lv)), exact_cube.counts[j]) for j, lv in enumerate(exact_cube.levels['industry']))
+    print(f"histograms   : {'exact match' if same else 'MISMATCH'}")
+
+    n_update = 1000
+    t0 = time.perf_counter()
+    for i in range(n_update):
+        responses = {int(s): int(r) for s, r in zip(scenario_ids, X[i])}
+        store.update(args.users + i, attrs.iloc[i].to_dict(), responses)
+    print(f"update (1 user): {(time.perf_counter() - t0) / n_update * 1e3:.2f}ms")
+
+    t0 = time.perf_counter()
+    SketchStore.from_bytes(data)
+    print(f"load         : {(time.perf_counter() - t0) * 1e3:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+ページ計測用の合成データバックエンド
+
+utils.db のデータ取得関数を合成データを返す関数に差し替え、Supabase なしで
+streamlit.testing の AppTest からページを実行できるようにします（ベンチマーク専用）。
+"""
+import numpy as np
+import pandas as pd
+
+import utils.db as db
+
+CATEGORIES = ["身体的な攻撃", "精神的な攻撃", "人間関係からの切り離し", "過大な要求", "過小な要求", "個の侵害"]
+TYPES = ["Black", "White", "Gray"]
+ATTRIBUTES = {
+    'age': ["20代", "30代", "40代", "50代", "60代以上"],
+    'gender': ["男性", "女性"],
+    'position': ["一般社員", "主任・係長クラス (現場リーダー)", "課長クラス (マネジメント層)", "部長クラス (上級管理職)"],
+    'industry': ["メーカー・製造", "IT・通信・インターネット", "金融・商社・コンサル", "小売・飲食・サービス", "医療・福祉・介護"],
+    'job_type': ["営業系", "事務・管理系", "技術・研究系", "サービス・販売・現場系"],
+    'service_years': ["3年未満 (新人・若手)", "3年〜10年 (中堅)", "10年以上 (ベテラン)"],
+    'employment_status': ["正社員 (公務員含む)", "契約・嘱託社員", "派遣社員"],
+}
+
+
+def make_scenarios(n_scenarios=30):
+    return [
+        dict(
+            scenario_id=i, title=f"シナリオ{i}", text="上司が部下に対して業務上の指導を行った場面。" * 4 + str(i),
+            category=CATEGORIES[i % len(CATEGORIES)], type=TYPES[i % len(TYPES)],
+            explanation="解説", advice="アドバイス", legal_ref="労働施策総合推進法",
+        )
+        for i in range(1, n_scenarios + 1)
+    ]
+
+
+def make_view(scenarios, n_users, seed=0):
+    """view_analysis_data と同じ形式の縦持ちレコード"""
+    rng = np.random.default_rng(seed)
+    base = np.array([{'Black': 5.0, 'White': 2.5, 'Gray': 3.5}[s['type']] for s in scenarios])
+    ratings = np.clip(np.rint(base + rng.normal(0, 0.8, (n_users, 1)) + rng.normal(0, 0.9, (n_users, len(scenarios)))), 1, 6).astype(int)
+    users = pd.DataFrame({axis: rng.choice(levels, size=n_users) for axis, levels in ATTRIBUTES.items()})
+    users['user_id'] = np.arange(1, n_users + 1)
+    meta = pd.DataFrame(scenarios)[['scenario_id', 'title', 'text', 'category', 'type']]
+    df = users.merge(meta, how='cross')
+    df['rating'] = ratings.reshape(-1)
+    return df.to_dict('records')
+
+
+def install(n_users=1000, n_scenarios=30):
+    """utils.db の取得関数を合成データに差し替える"""
+    scenarios = make_scenarios(n_scenarios)
+    view = make_view(scenarios, n_users)
+    by_id = {s['scenario_id']: s for s in scenarios}
+    stats = pd.DataFrame(view).groupby('scenario_id')['rating'].agg(avg_rating='mean', std_dev='std', count='count').reset_index()
+
+    db.get_all_scenarios = lambda: scenarios
+    db.get_global_analysis_data_view = lambda: view
+    db.get_global_averages_stats = lambda: stats.copy()
+    db.get_user_responses = lambda user_id: [
+        dict(rating=r['rating'], **by_id[r['scenario_id']]) for r in view if r['user_id'] == 1
+    ]
+    return scenarios
@@ -2,7 +2,9 @@ import streamlit as st
 import random
 import streamlit.components.v1 as components
 from utils.db import register_user, get_all_scenarios, save_responses_bulk, get_user_responses
-from utils.session import init_session
+from utils.session import init_session, persist_session
+from utils.drafts import get_draft_store
+from utils.timing import timed, section_timer
 
 # --- ページ設定 ---
 st.set_page_config(
@@ -11,6 +13,9 @@ st.set_page_config(
     layout="centered"
 )
 
+# セッション初期化（セッションストアがあれば、別のレプリカで保存した状態もここで復元される）
+session_id = init_session()
+
 # =========================================================
 #  同意状態の確認ロジック 
 # =========================================================
@@ -44,6 +49,52 @@ OPT_POS = ["一般社員", "主任・係長クラス (現場リーダー)", "課
 OPT_IND = ["メーカー・製造", "建設・不動産・物流", "IT・通信・インターネット", "金融・商社・コンサル", "小売・飲食・サービス", "医療・福祉・介護", "マスコミ・広告・エンタメ", "公務員・教職員・団体", "その他"]
 OPT_JOB = ["営業系", "事務・管理系", "企画・マーケティング系", "技術・研究系", "クリエイティブ系", "サービス・販売・現場系", "専門職系 (医師/教師等)", "その他"]
 OPT_YEARS = ["3年未満 (新人・若手)", "3年〜10年 (中堅)", "10年以上 (ベテラン)"]
+OPT_RATING = ["全く感じない", "あまり感じない", "どちらかと言えば感じない", "どちらかと言えば感じる", "かなり感じる", "強く感じる"]
+
+
+def _questionnaire_settings():
+    try:
+        return dict(st.secrets.get("questionnaire", {}))
+    except Exception:
+        return {}
+
+
+def questionnaire_page_size():
+    """
+    1 ページに表示する設問数。st.secrets の [questionnaire] page_size で指定する
+    0（既定）なら全問を 1 ページに並べ、回答のたびにその設問だけを再実行する
+    """
+    try:
+        return max(int(_questionnaire_settings().get("page_size", 0)), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def adaptive_settings():
+    """
+    適応型出題の設定。st.secrets の [questionnaire] mode = "adaptive" で有効になる
+    回答のたびに段階反応モデルで最も情報量の大きいシナリオを 1 問ずつ出し、
+    θ の事後標準偏差が se_target 以下（かつ min_items 問以上）か max_items 問で終了する
+    項目パラメータが校正済み（python -m utils.calibrate）でなければ全問出題になる。
+    適応型の回答者は回答に応じて選ばれた一部のシナリオにしか答えないため、Page 3 の
+    シナリオ別の集計はその分だけ偏る（Page 3 に回答の充足率とともに注記を表示する）
+
+    Returns:
+        dict | None: 無効なら None
+    """
+    settings = _questionnaire_settings()
+    if settings.get("mode") != "adaptive":
+        return None
+    from utils.irt import SE_TARGET, MIN_ITEMS, MAX_ITEMS
+
+    try:
+        return {
+            "se_target": float(settings.get("se_target", SE_TARGET)),
+            "min_items": int(settings.get("min_items", MIN_ITEMS)),
+            "max_items": int(settings.get("max_items", MAX_ITEMS)),
+        }
+    except (TypeError, ValueError):
+        return {"se_target": SE_TARGET, "min_items": MIN_ITEMS, "max_items": MAX_ITEMS}
 
 # --- カスタムCSS ---
 st.markdown("""
@@ -69,14 +120,48 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# セッション初期化
-session_id = init_session()
-
 # --- ステート管理 ---
 if "diagnosis_started" not in st.session_state: st.session_state.diagnosis_started = False
 if "user_attributes_temp" not in st.session_state: st.session_state.user_attributes_temp = {}
 if "show_completion_screen" not in st.session_state: st.session_state.show_completion_screen = False
 
+
+def save_draft():
+    """
+    回答途中の状態を下書きとして保存する（書き込みはバックグラウンドでまとめて行われる）
+    下書きはこのレプリカの SQLite にあるため、設問だけの再実行（フラグメント）でも
+    セッションストアへ保存し、別のレプリカに再接続しても回答を続けられるようにする。
+    どちらも保留バッファに置くだけで、書き込みはバックグラウンドのスレッドがまとめて行う。
+    """
+    persist_session(deferred=True)
+    get_draft_store().save(session_id, {
+        "attrs": st.session_state.user_attributes_temp,
+        "order": st.session_state.get("scenario_order"),
+        "responses": {
+            sid: OPT_RATING.index(r) + 1
+            for sid, r in st.session_state.get("temp_responses", {}).items() if r in OPT_RATING
+        },
+        "page": st.session_state.get("questionnaire_page", 1),
+    })
+
+
+# --- 再読み込み・再接続後は、回答途中の下書きから再開する ---
+if not st.session_state.get("user_id") and not st.session_state.get("draft_checked"):
+    st.session_state.draft_checked = True
+    draft = get_draft_store().load(session_id)
+    if draft and draft.get("attrs"):
+        restored = {sid: OPT_RATING[r - 1] for sid, r in draft["responses"].items() if 1 <= r <= 6}
+        if not st.session_state.diagnosis_started:
+            st.session_state.user_attributes_temp = draft["attrs"]
+            st.session_state.scenario_order = draft.get("order")
+            st.session_state.temp_responses = restored
+            st.session_state.questionnaire_page = draft.get("page", 1)
+            st.session_state.diagnosis_started = True
+            st.toast("前回の回答途中から再開しました", icon="💾")
+        else:
+            # セッションストアから復元済みでも、設問ごとに保存される下書きの方が新しい
+            st.session_state.temp_responses = {**st.session_state.get("temp_responses", {}), **restored}
+
 # =========================================================
 # CASE 0: 完了画面
 # =========================================================
@@ -165,6 +250,7 @@ if not st.session_state.diagnosis_started:
                     "service_years": service_years, "position": position, "industry": industry, "job": job
                 }
                 st.session_state.diagnosis_started = True
+                save_draft()
                 st.rerun()
 
 # =========================================================
@@ -179,25 +265,55 @@ else:
         st.error("シナリオが見つかりません。")
         st.stop()
 
-    if "scenario_order" not in st.session_state or st.session_state.scenario_order is None:
+    scenario_dict = {s['scenario_id']: s for s in scenarios}
+
+    # 適応型出題（モデルが用意できなければ全問出題にする）
+    adaptive = adaptive_settings()
+    irt_model = None
+    if adaptive:
+        # numpy / pandas を使う集計モジュールは、必要になるまで読み込まない（初回表示を軽くする）
+        from utils.population import get_irt_model
+        irt_model = get_irt_model()
+    if irt_model is None:
+        adaptive = None
+
+    if adaptive:
+        # 出題順 = これまでに出題したシナリオ（次の設問は回答のたびに選ぶ）
+        answered = st.session_state.get("temp_responses", {})
+        st.session_state.scenario_order = [
+            sid for sid in st.session_state.get("scenario_order") or [] if sid in scenario_dict and sid in answered
+        ]
+        st.session_state.temp_responses = {sid: answered[sid] for sid in st.session_state.scenario_order}
+    # 下書きから復元した出題順がシナリオの追加・削除で合わなくなっていたら作り直す
+    elif st.session_state.get("scenario_order") is None or set(st.session_state.scenario_order) != set(scenario_dict):
         scenario_ids = [s['scenario_id'] for s in scenarios]
         random.shuffle(scenario_ids)
         st.session_state.scenario_order = scenario_ids
+        if "temp_responses" in st.session_state:
+            st.session_state.temp_responses = {sid: r for sid, r in st.session_state.temp_responses.items() if sid in scenario_dict}
 
-    scenario_dict = {s['scenario_id']: s for s in scenarios}
     shuffled_scenarios = [scenario_dict[sid] for sid in st.session_state.scenario_order]
     total_q = len(shuffled_scenarios)
 
     if "temp_responses" not in st.session_state: st.session_state.temp_responses = {}
 
     st.title(" パワハラ認識傾向チェック")
-    st.progress(len(st.session_state.temp_responses) / total_q, text="回答進捗")
-    st.info(f"全 {total_q} 問。各シナリオを読み、その言動にどの程度「ハラスメント」を感じるか、あなたの直感に最も近いものを選んでください。")
+    if adaptive:
+        # 出題数は回答によって変わるため、上限に対する割合で進捗を示す
+        max_items = min(adaptive["max_items"], len(scenario_dict))
+        answered = len(st.session_state.temp_responses)
+        st.progress(min(answered / max_items, 1.0), text=f"回答進捗 {answered} 問（最大 {max_items} 問）")
+        st.info(f"回答に合わせて、次のシナリオを 1 問ずつ選んで出題します（最大 {max_items} 問）。各シナリオを読み、その言動にどの程度「ハラスメント」を感じるか、あなたの直感に最も近いものを選んでください。")
+    else:
+        st.progress(len(st.session_state.temp_responses) / total_q, text="回答進捗")
+        st.info(f"全 {total_q} 問。各シナリオを読み、その言動にどの程度「ハラスメント」を感じるか、あなたの直感に最も近いものを選んでください。")
 
-    options = ["全く感じない", "あまり感じない", "どちらかと言えば感じない", "どちらかと言えば感じる", "かなり感じる", "強く感じる"]
+    options = OPT_RATING
 
-    for idx, scenario in enumerate(shuffled_scenarios, 1):
-        st.markdown(f'<div id="question-{idx}"></div>', unsafe_allow_html=True)
+    @st.fragment
+    @timed("page1.question")
+    def render_question(idx, scenario):
+        """設問 1 問分（回答の選択はこの設問だけを再実行する）"""
         with st.container(border=True):
             st.markdown(f"**Question {idx} / {total_q}**")
             st.markdown(f"##### {scenario['text']}")
@@ -215,16 +331,35 @@ else:
             
             if response:
                 st.session_state.temp_responses[scenario['scenario_id']] = response
-        
-        st.write("")
+                # 回答を変えた直後（この設問だけの再実行）は、ページ上部の代わりにここで進捗を示す
+                if response != saved_response:
+                    save_draft()
+                    answered = len(st.session_state.temp_responses)
+                    st.progress(answered / total_q, text=f"回答進捗 {answered} / {total_q}")
 
-    st.markdown("---")
-    
-    # 送信中フラグの初期化
-    if "is_submitting" not in st.session_state:
-        st.session_state.is_submitting = False
-    
-    if st.button("回答を送信して結果を見る", type="primary", use_container_width=True, disabled=st.session_state.is_submitting):
+    def store_answers(scenario_ids):
+        """フォームで選んだ回答を temp_responses に移す（フォーム送信時のコールバック）"""
+        for sid in scenario_ids:
+            response = st.session_state.get(f"q_{sid}")
+            if response:
+                st.session_state.temp_responses[sid] = response
+        save_draft()
+
+    def go_to_page(scenario_ids, page):
+        st.session_state.questionnaire_page = page
+        store_answers(scenario_ids)
+
+    def answer_adaptive(scenario_id):
+        """適応型出題で 1 問に回答したとき（フォーム送信時のコールバック）"""
+        response = st.session_state.get(f"q_{scenario_id}")
+        if not response:
+            st.session_state.unanswered_notice = ("回答を選択してください", None)
+            return
+        st.session_state.scenario_order = st.session_state.scenario_order + [scenario_id]
+        store_answers([scenario_id])
+
+    def submit_responses():
+        """全問の回答を検証して保存する"""
         # 二重送信防止：すでに送信中なら何もしない
         if st.session_state.is_submitting:
             st.stop()
@@ -238,7 +373,13 @@ else:
             st.session_state.is_submitting = False  # エラー時は解除
             unanswered_indices = [st.session_state.scenario_order.index(sid) + 1 for sid in unanswered_ids]
             first_unanswered = unanswered_indices[0]
-            st.error(f"未回答の質問があります（残り {len(unanswered_indices)}問）")
+            message = f"未回答の質問があります（残り {len(unanswered_indices)}問）"
+            if page_size:
+                # ページ送り表示では最初の未回答があるページへ移動してから知らせる
+                st.session_state.questionnaire_page = (first_unanswered - 1) // page_size + 1
+                st.session_state.unanswered_notice = (message, first_unanswered)
+                st.rerun()
+            st.error(message)
             components.html(f"""<script>setTimeout(()=>{{const t=window.parent.document.getElementById('question-{first_unanswered}');if(t)t.scrollIntoView({{behavior:'smooth',block:'center'}});}},200);</script>""", height=0)
         else:
             with st.spinner("結果を生成中..."):
@@ -255,14 +396,18 @@ else:
                 
                 if new_user_id:
                     responses_dict = {}
-                    for scenario_id, response in st.session_state.temp_responses.items():
-                        responses_dict[scenario_id] = options.index(response) + 1
+                    for scenario_id in st.session_state.scenario_order:
+                        responses_dict[scenario_id] = options.index(st.session_state.temp_responses[scenario_id]) + 1
                     
                     if save_responses_bulk(new_user_id, responses_dict):
+                        from utils.population import observe_submission
+                        observe_submission(responses_dict, user_id=new_user_id, attributes=attrs)
+                        get_draft_store().delete(session_id)
                         st.session_state.user_id = new_user_id
                         st.session_state.temp_responses = {} 
                         st.session_state.user_attributes_temp = {}
                         st.session_state.diagnosis_started = False
+                        st.session_state.questionnaire_page = 1
                         st.session_state.is_submitting = False  # 完了時にリセット
                         st.session_state.show_completion_screen = True
                         st.rerun()
@@ -271,4 +416,106 @@ else:
                         st.error("回答の保存に失敗しました。")
                 else:
                     st.session_state.is_submitting = False  # エラー時は解除
-                    st.error("データの保存に失敗しました。")
\ No newline at end of file
+                    st.error("データの保存に失敗しました。")
+
+    # 送信中フラグの初期化
+    if "is_submitting" not in st.session_state:
+        st.session_state.is_submitting = False
+
+    page_size = questionnaire_page_size()
+    if adaptive:
+        # 適応型出題：回答済みの評価から θ の事後分布を求め、終了判定と次の設問の選択を行う
+        ratings = {sid: options.index(r) + 1 for sid, r in st.session_state.temp_responses.items()}
+        with section_timer("page1.adaptive_select"):
+            _, se = irt_model.estimate(ratings)
+            n_answered = len(ratings)
+            finished = n_answered >= max_items or (n_answered >= adaptive["min_items"] and se <= adaptive["se_target"])
+            next_id = None if finished else irt_model.select_next(ratings, candidates=scenario_dict)
+
+        notice = st.session_state.pop("unanswered_notice", None)
+        if notice:
+            st.error(notice[0])
+
+        if next_id is not None:
+            scenario = scenario_dict[next_id]
+            with st.form(f"adaptive_question_{n_answered + 1}", border=False):
+                with st.container(border=True):
+                    st.markdown(f"**Question {n_answered + 1}**")
+                    st.markdown(f"##### {scenario['text']}")
+                    st.radio(
+                        "この言動に「ハラスメント」を感じますか？",
+                        options,
+                        index=None,
+                        key=f"q_{next_id}",
+                        label_visibility="collapsed"
+                    )
+                st.form_submit_button(
+                    "次へ →", type="primary", use_container_width=True,
+                    on_click=answer_adaptive, args=(next_id,)
+                )
+        else:
+            st.success(f"{n_answered} 問の回答で、あなたの認識傾向を推定できました。")
+            if st.button("回答を送信して結果を見る", type="primary", use_container_width=True, disabled=st.session_state.is_submitting):
+                submit_responses()
+    elif not page_size:
+        for idx, scenario in enumerate(shuffled_scenarios, 1):
+            st.markdown(f'<div id="question-{idx}"></div>', unsafe_allow_html=True)
+            render_question(idx, scenario)
+            st.write("")
+
+        st.markdown("---")
+        
+        if st.button("回答を送信して結果を見る", type="primary", use_container_width=True, disabled=st.session_state.is_submitting):
+            submit_responses()
+    else:
+        # ページ送り表示：表示中のページの設問だけを送り、回答はフォーム送信時（ページ単位）にまとめて受け取る
+        n_pages = -(-total_q // page_size)
+        page = min(max(st.session_state.get("questionnaire_page", 1), 1), n_pages)
+        st.session_state.questionnaire_page = page
+        first = (page - 1) * page_size
+        page_scenarios = shuffled_scenarios[first:first + page_size]
+        page_ids = [scenario['scenario_id'] for scenario in page_scenarios]
+
+        notice = st.session_state.pop("unanswered_notice", None)
+        if notice:
+            st.error(notice[0])
+
+        with st.form(f"question_page_{page}", border=False):
+            for idx, scenario in enumerate(page_scenarios, first + 1):
+                st.markdown(f'<div id="question-{idx}"></div>', unsafe_allow_html=True)
+                with st.container(border=True):
+                    st.markdown(f"**Question {idx} / {total_q}**")
+                    st.markdown(f"##### {scenario['text']}")
+
+                    saved_response = st.session_state.temp_responses.get(scenario['scenario_id'])
+                    st.radio(
+                        "この言動に「ハラスメント」を感じますか？",
+                        options,
+                        index=options.index(saved_response) if saved_response in options else None,
+                        key=f"q_{scenario['scenario_id']}",
+                        label_visibility="collapsed"
+                    )
+                st.write("")
+
+            st.caption(f"ページ {page} / {n_pages}")
+            c_prev, c_next = st.columns(2)
+            c_prev.form_submit_button(
+                "← 前へ", use_container_width=True, disabled=page == 1,
+                on_click=go_to_page, args=(page_ids, page - 1)
+            )
+            if page < n_pages:
+                c_next.form_submit_button(
+                    "次へ →", type="primary", use_container_width=True,
+                    on_click=go_to_page, args=(page_ids, page + 1)
+                )
+                submitted = False
+            else:
+                submitted = c_next.form_submit_button(
+                    "回答を送信して結果を見る", type="primary", use_container_width=True,
+                    disabled=st.session_state.is_submitting, on_click=store_answers, args=(page_ids,)
+                )
+
+        if notice:
+            components.html(f"""<script>setTimeout(()=>{{const t=window.parent.document.getElementById('question-{notice[1]}');if(t)t.scrollIntoView({{behavior:'smooth',block:'center'}});}},200);</script>""", height=0)
+        if submitted:
+            submit_responses()
@@ -1,10 +1,16 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px
-import numpy as np
-import textwrap
-from utils.db import get_user_responses, get_global_averages_stats, generate_demo_data
+from plotly.colors import qualitative
+from utils.db import get_user_responses, get_global_averages_stats, generate_demo_data, get_all_scenarios, get_catalog_version
+from utils.population import (
+    load_population, get_profile_model, get_similar_respondents, get_aggregate_mode, get_snapshot,
+    response_vector, estimate_similar_shares,
+)
+from utils.charts import SCATTER_RANGE, TYPE_LABELS, cached_figure, gap_band_shapes, get_scenario_display_table, hover_column
+from utils.timing import timed
+from utils.clustering import profile_name
+from utils.session import init_session
 
 # 初回訪問フラグ
 if "visited_page2" not in st.session_state:
@@ -13,17 +19,14 @@ if "visited_page2" not in st.session_state:
 # ページ設定
 st.set_page_config(page_title="あなたの認識傾向", layout="wide")
 
+# セッション初期化（再読み込みや別のレプリカへの再接続でも、cookie の再開用トークンから user_id を復元する）
+init_session()
+
 # モバイル向け表示トグル
 is_mobile = st.toggle("📱 モバイル向け表示", value=False, help="スマホではONにするとホバー表示を短く折り返し、フォントとマーカーサイズを最適化します。")
-wrap_w = 22 if is_mobile else 40
 hover_font_size = 11 if is_mobile else 13
 marker_size = 10 if is_mobile else 12
 
-# ツールチップ用にテキストを改行する関数
-def format_hover_text(text, width=40):
-    if not isinstance(text, str): return ""
-    return "<br>".join(textwrap.wrap(text, width=width))
-
 # ==========================================
 # 0. データ取得 & 前処理
 # ==========================================
@@ -145,6 +148,14 @@ with st.spinner("診断結果を分析中..."):
 # UI表示：トップサマリー
 # ==========================================
 
+# 図のキャッシュキーに使うデータバージョン
+# 上段の図はあなたの回答と全体平均（scenario_stats、5 分間キャッシュ）・シナリオ情報だけから作るため、
+# 評価行列は読み込まず、全体平均の内容の指紋とカタログの版（軽い問い合わせ、60 秒キャッシュ）を使う
+stats_fingerprint = int(
+    pd.util.hash_pandas_object(stats_df[['scenario_id', 'avg_rating', 'std_dev']], index=False).sum()
+)
+data_version = (get_catalog_version(), stats_fingerprint)
+
 demo_notice = " (デモデータ使用)" if use_demo_data else ""
 st.title(f"👤 あなたの認識傾向{demo_notice}")
 st.markdown("""
@@ -328,40 +339,44 @@ with tab_cat_legal:
     if not legal_miss.empty or not legal_over.empty:
         df_legal_summary = pd.merge(legal_miss, legal_over, on='category', how='outer').fillna(0)
         
-        fig_legal = go.Figure()
-        # 左側（認識が不足）
-        fig_legal.add_trace(go.Bar(
-            y=df_legal_summary['category'], x=-df_legal_summary['legal_miss'], orientation='h',
-            name='認識が不足 ', marker_color='#ef4444',
-            text=df_legal_summary['legal_miss'].apply(lambda x: f"{x:.1f}" if x > 0 else ""), textposition='inside',
-            hovertemplate='<b>%{y}</b><br><b>不足度:</b> %{x:.1f}<extra></extra>'
-        ))
-        # 右側（認識が過剰）
-        fig_legal.add_trace(go.Bar(
-            y=df_legal_summary['category'], x=df_legal_summary['legal_over'], orientation='h',
-            name='認識が過剰 ', marker_color='#f97316',
-            text=df_legal_summary['legal_over'].apply(lambda x: f"{x:.1f}" if x > 0 else ""), textposition='inside',
-            hovertemplate='<b>%{y}</b><br><b>過剰度:</b> %{x:.1f}<extra></extra>'
-        ))
+        def build_legal_figure():
+            fig_legal = go.Figure()
+            # 左側（認識が不足）
+            fig_legal.add_trace(go.Bar(
+                y=df_legal_summary['category'], x=-df_legal_summary['legal_miss'], orientation='h',
+                name='認識が不足 ', marker_color='#ef4444',
+                text=df_legal_summary['legal_miss'].apply(lambda x: f"{x:.1f}" if x > 0 else ""), textposition='inside',
+                hovertemplate='<b>%{y}</b><br><b>不足度:</b> %{x:.1f}<extra></extra>'
+            ))
+            # 右側（認識が過剰）
+            fig_legal.add_trace(go.Bar(
+                y=df_legal_summary['category'], x=df_legal_summary['legal_over'], orientation='h',
+                name='認識が過剰 ', marker_color='#f97316',
+                text=df_legal_summary['legal_over'].apply(lambda x: f"{x:.1f}" if x > 0 else ""), textposition='inside',
+                hovertemplate='<b>%{y}</b><br><b>過剰度:</b> %{x:.1f}<extra></extra>'
+            ))
         
-        fig_legal.add_vline(x=0, line_width=1.5, line_color="#666")
-        fig_legal.update_layout(
-            xaxis=dict(
-                range=[-3, 3], 
-                title="← 認識が不足  ｜ 認識が過剰  →",
-                tickvals=[-2, 0, 2],
-                ticktext=['要注意', '適正', '要注意'],
-                fixedrange=True
-            ),
-            yaxis=dict(autorange="reversed", fixedrange=True), 
-            barmode='relative', 
-            height=420 if is_mobile else 400,
-            margin=dict(l=0,r=0,t=10,b=100 if is_mobile else 0), 
-            showlegend=True,
-            legend=dict(orientation="h", yanchor="bottom", y=-0.35 if is_mobile else 1.02, xanchor="center" if is_mobile else "right", x=0.5 if is_mobile else 1, font=dict(size=9 if is_mobile else 10))
-        )
-        if is_mobile:
-            fig_legal.update_traces(text=None, selector=dict(type='bar'))
+            fig_legal.add_vline(x=0, line_width=1.5, line_color="#666")
+            fig_legal.update_layout(
+                xaxis=dict(
+                    range=[-3, 3], 
+                    title="← 認識が不足  ｜ 認識が過剰  →",
+                    tickvals=[-2, 0, 2],
+                    ticktext=['要注意', '適正', '要注意'],
+                    fixedrange=True
+                ),
+                yaxis=dict(autorange="reversed", fixedrange=True), 
+                barmode='relative', 
+                height=420 if is_mobile else 400,
+                margin=dict(l=0,r=0,t=10,b=100 if is_mobile else 0), 
+                showlegend=True,
+                legend=dict(orientation="h", yanchor="bottom", y=-0.35 if is_mobile else 1.02, xanchor="center" if is_mobile else "right", x=0.5 if is_mobile else 1, font=dict(size=9 if is_mobile else 10))
+            )
+            if is_mobile:
+                fig_legal.update_traces(text=None, selector=dict(type='bar'))
+            return fig_legal
+
+        fig_legal = cached_figure(("legal", data_version, st.session_state.user_id, is_mobile), build_legal_figure)
         st.plotly_chart(fig_legal, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
     else:
         st.info("データが不足しています")
@@ -374,40 +389,44 @@ with tab_cat_social:
     st.caption("パワハラ6類型ごとの**世間平均とのズレ**を分析します。**中心（0）が世間平均と一致**しています。")
 
     gap_summary = df.groupby('category')['standardized_bias'].mean().reset_index()
-    colors = ['#0d6efd' if x >= 0 else '#fd7e14' for x in gap_summary['standardized_bias']]
+    def build_gap_figure():
+        colors = ['#0d6efd' if x >= 0 else '#fd7e14' for x in gap_summary['standardized_bias']]
     
-    fig_gap = go.Figure()
-    fig_gap.add_trace(go.Bar(
-        y=gap_summary['category'], 
-        x=gap_summary['standardized_bias'], 
-        orientation='h',
-        marker_color=colors,
-        text=gap_summary['standardized_bias'].apply(lambda x: f"{x:+.1f}"),
-        textposition='outside',
-        hovertemplate='<b>%{y}</b><br><b>世間とのズレ:</b> %{x:+.2f}<extra></extra>'
-    ))
+        fig_gap = go.Figure()
+        fig_gap.add_trace(go.Bar(
+            y=gap_summary['category'], 
+            x=gap_summary['standardized_bias'], 
+            orientation='h',
+            marker_color=colors,
+            text=gap_summary['standardized_bias'].apply(lambda x: f"{x:+.1f}"),
+            textposition='outside',
+            hovertemplate='<b>%{y}</b><br><b>世間とのズレ:</b> %{x:+.2f}<extra></extra>'
+        ))
     
-    fig_gap.add_vline(x=0, line_width=2, line_color="#333", line_dash="solid")
-    fig_gap.add_vrect(x0=0, x1=2.5, fillcolor="#0d6efd", opacity=0.05, layer="below", line_width=0)
-    fig_gap.add_vrect(x0=-2.5, x1=0, fillcolor="#fd7e14", opacity=0.05, layer="below", line_width=0)
+        fig_gap.add_vline(x=0, line_width=2, line_color="#333", line_dash="solid")
+        fig_gap.add_vrect(x0=0, x1=2.5, fillcolor="#0d6efd", opacity=0.05, layer="below", line_width=0)
+        fig_gap.add_vrect(x0=-2.5, x1=0, fillcolor="#fd7e14", opacity=0.05, layer="below", line_width=0)
 
-    fig_gap.update_layout(
-        xaxis=dict(
-            range=[-2.5, 2.5], 
-            title="← 甘い (寛容) ｜ 厳しい (厳格) →",
-            tickvals=[-2, 0, 2],
-            ticktext=['甘い', '世間平均', '厳しい'],
-            fixedrange=True
-        ),
-        yaxis=dict(autorange="reversed", fixedrange=True), 
-        margin=dict(l=0,r=0,t=10,b=0), 
-        height=420 if is_mobile else 400,
-        showlegend=False,
-        uniformtext_minsize=8 if is_mobile else 10,
-        uniformtext_mode='hide'
-    )
-    if is_mobile:
-        fig_gap.update_traces(text=None)
+        fig_gap.update_layout(
+            xaxis=dict(
+                range=[-2.5, 2.5], 
+                title="← 甘い (寛容) ｜ 厳しい (厳格) →",
+                tickvals=[-2, 0, 2],
+                ticktext=['甘い', '世間平均', '厳しい'],
+                fixedrange=True
+            ),
+            yaxis=dict(autorange="reversed", fixedrange=True), 
+            margin=dict(l=0,r=0,t=10,b=0), 
+            height=420 if is_mobile else 400,
+            showlegend=False,
+            uniformtext_minsize=8 if is_mobile else 10,
+            uniformtext_mode='hide'
+        )
+        if is_mobile:
+            fig_gap.update_traces(text=None)
+        return fig_gap
+
+    fig_gap = cached_figure(("gap", data_version, st.session_state.user_id, is_mobile), build_gap_figure)
     st.plotly_chart(fig_gap, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
 
 st.markdown("---")
@@ -441,50 +460,24 @@ st.info("""
 """, icon="ℹ️")
 
 # --- 散布図描画ロジック ---
-def plot_scatter_analysis(df_scatter: pd.DataFrame, wrap_width=40, hover_font_size=13, marker_size=12):
+def plot_scatter_analysis(df_scatter: pd.DataFrame, hover_col='hover_40', hover_font_size=13, marker_size=12):
     df_plot = df_scatter.copy()
     
-    # ホバーテキスト準備
-    if 'text' not in df_plot.columns:
-        df_plot['text_body'] = df_plot['title']
-    else:
-        df_plot['text_body'] = df_plot['text']
-        
-    df_plot['hover_text'] = df_plot['text_body'].apply(lambda x: format_hover_text(x, wrap_width))
+    # ホバーテキスト準備（折り返し済みの本文をシナリオ表示テーブルから引く）
+    scenario_display = get_scenario_display_table(get_all_scenarios())
+    df_plot['hover_text'] = df_plot['scenario_id'].map(scenario_display[hover_col]).fillna(df_plot['title'])
     df_plot['is_legal_risk'] = df_plot['legal_level'].apply(lambda x: True if x != "なし" else False)
 
     fig = go.Figure()
 
-    # 背景：等高線
-    # Z = |Y - X| で中心線からの距離を計算
+    # 背景：対角線からの距離 |Y - X| で色分けした帯（全セッション共有の静的な shape）
     # 色: 緑(安全) -> 黄(注意) -> 赤(危険)
-    x_grid = np.linspace(0.5, 6.5, 100)
-    y_grid = np.linspace(0.5, 6.5, 100)
-    X, Y = np.meshgrid(x_grid, y_grid)
-    Z = np.abs(Y - X) 
-
-    fig.add_trace(go.Contour(
-        z=Z, x=x_grid, y=y_grid,
-        colorscale=[
-            [0.0, 'rgba(46, 204, 113, 0.15)'], # 0.0: Green
-            [0.2, 'rgba(46, 204, 113, 0.15)'], # 1.0付近まで緑
-            [0.2, 'rgba(241, 196, 15, 0.15)'], # 1.0から黄色
-            [0.5, 'rgba(241, 196, 15, 0.15)'], # 2.5付近まで黄色
-            [0.5, 'rgba(231, 76, 60, 0.15)'],  # 2.5から赤
-            [1.0, 'rgba(231, 76, 60, 0.15)'],  # 最後まで赤
-        ],
-        contours=dict(
-            start=0, end=6, 
-            coloring='fill', 
-            showlines=False
-        ),
-        showscale=False, 
-        hoverinfo='skip',
-    ))
+    for shape in gap_band_shapes():
+        fig.add_shape(**shape)
 
     # データ点
     categories = df_plot['category'].unique()
-    colors = px.colors.qualitative.Bold
+    colors = qualitative.Bold
 
     for i, cat in enumerate(categories):
         df_cat = df_plot[df_plot['category'] == cat]
@@ -512,6 +505,8 @@ def plot_scatter_analysis(df_scatter: pd.DataFrame, wrap_width=40, hover_font_si
     fig.update_layout(
         xaxis_title="世の中の平均", 
         yaxis_title="あなたの回答", 
+        xaxis=dict(range=SCATTER_RANGE),
+        yaxis=dict(range=SCATTER_RANGE),
         height=550 if is_mobile else 500, 
         margin=dict(l=20,r=20,t=20,b=100 if is_mobile else 20), 
         plot_bgcolor='white',
@@ -521,11 +516,125 @@ def plot_scatter_analysis(df_scatter: pd.DataFrame, wrap_width=40, hover_font_si
     )
     return fig
 
-fig_map = plot_scatter_analysis(df, wrap_width=wrap_w, hover_font_size=hover_font_size, marker_size=marker_size)
+fig_map = cached_figure(
+    ("scatter", data_version, st.session_state.user_id, is_mobile),
+    lambda: plot_scatter_analysis(df, hover_col=hover_column(is_mobile), hover_font_size=hover_font_size, marker_size=marker_size)
+)
 st.plotly_chart(fig_map, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
 
 st.markdown("---")
 
+# ==========================================
+# UI表示：3-2. 認識プロファイル
+# ==========================================
+st.subheader("🧭 あなたの認識プロファイル")
+st.caption("全回答者の評価パターンをいくつかの「認識プロファイル」に分類し、あなたの回答に最も近いプロファイルを表示します。")
+
+# 集計スナップショットモードでは、ワーカーが作成済みのプロファイル・層別抽出サンプル・属性別人数を使い、
+# 評価行列（全回答）は読み込まない
+snapshot = get_snapshot() if get_aggregate_mode() == "snapshot" else None
+user_ratings = dict(zip(df['scenario_id'], df['rating']))
+
+if snapshot is not None:
+    profile_model, profile_ids, profile_types = snapshot.profile_model, snapshot.scenario_ids, snapshot.scenario_types
+else:
+    profile_model = get_profile_model()
+    if profile_model is not None:
+        population = load_population()
+        profile_ids, profile_types = population.scenario_ids, population.scenario_types
+if profile_model is None:
+    st.info("プロファイルを算出するためのデータが不足しています。")
+else:
+    user_vec = response_vector(profile_ids, user_ratings)
+    user_profile = profile_model.assign(user_vec)
+    profile_df = pd.DataFrame(profile_model.describe(profile_types))
+
+    st.markdown(f"あなたは **{profile_name(user_profile, profile_model.k)}** のプロファイルに最も近い回答パターンです。")
+
+    fig_profile = go.Figure()
+    type_colors = {'Black': '#dc3545', 'Gray': '#6c757d', 'White': '#28a745'}
+    opacity = [1.0 if p == user_profile else 0.35 for p in profile_df['profile']]
+    for t in ['White', 'Gray', 'Black']:
+        fig_profile.add_trace(go.Bar(
+            x=profile_df['name'], y=profile_df[t], name=TYPE_LABELS[t],
+            marker=dict(color=type_colors[t], opacity=opacity),
+            hovertemplate="<b>%{x}</b><br>" + TYPE_LABELS[t] + "の平均: %{y:.2f}<extra></extra>"
+        ))
+    fig_profile.update_layout(
+        barmode='group',
+        height=320,
+        yaxis=dict(range=[1, 6], title="平均スコア", fixedrange=True),
+        xaxis=dict(fixedrange=True),
+        margin=dict(l=0, r=0, t=10, b=0),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, font=dict(size=9 if is_mobile else 10))
+    )
+    st.plotly_chart(fig_profile, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
+    st.caption("濃く表示されているのがあなたのプロファイルです。各プロファイルの類型別の平均スコアを比較できます。")
+
+st.markdown("---")
+
+# ==========================================
+# UI表示：3-3. あなたに近い回答者
+# ==========================================
+st.subheader("👥 あなたに近い回答者")
+st.caption("30問の回答パターンがあなたに最も近い回答者を探し、その属性の構成を全体と比較します。")
+
+n_neighbors = 50
+neighbor_axes = {'position': '役職', 'industry': '業界', 'service_years': '勤続年数'}
+if snapshot is not None:
+    # 層別抽出サンプル（各グループ最大数百人）から推定し、全体の構成は属性別の人数から求める
+    near_shares = estimate_similar_shares(
+        snapshot.reservoir, response_vector(snapshot.scenario_ids, user_ratings), list(neighbor_axes), n=n_neighbors,
+    )
+    all_shares = {}
+    for col, cube in snapshot.axis_cubes.items():
+        users = pd.Series(cube.users, index=cube.levels[col], dtype=float)
+        all_shares[col] = users / max(users.sum(), 1) * 100
+    near_label = "あなたに近い回答者（推定）"
+else:
+    neighbors_df = get_similar_respondents(user_ratings, n=n_neighbors, exclude_user_id=st.session_state.user_id)
+    near_shares, all_shares = {}, {}
+    if not neighbors_df.empty:
+        all_attrs = load_population().attrs
+        for col in neighbor_axes:
+            if col in neighbors_df.columns:
+                near_shares[col] = neighbors_df[col].fillna("不明").value_counts(normalize=True) * 100
+                all_shares[col] = all_attrs[col].fillna("不明").value_counts(normalize=True) * 100
+    near_label = f"あなたに近い{len(neighbors_df)}人"
+if not near_shares:
+    st.info("比較できる回答者がまだいません。")
+else:
+    neighbor_tabs = st.tabs(list(neighbor_axes.values()))
+    for tab, (col, label) in zip(neighbor_tabs, neighbor_axes.items()):
+        with tab:
+            if col not in near_shares:
+                st.info("データがありません")
+                continue
+            near_share = near_shares[col]
+            all_share = all_shares.get(col, pd.Series(dtype=float))
+            share_df = pd.DataFrame({'近い回答者': near_share, '全体': all_share}).fillna(0).sort_values('近い回答者')
+
+            fig_near = go.Figure()
+            fig_near.add_trace(go.Bar(
+                y=share_df.index, x=share_df['全体'], name='全体', orientation='h', marker_color='#ced4da',
+                hovertemplate="<b>%{y}</b><br>全体: %{x:.1f}%<extra></extra>"
+            ))
+            fig_near.add_trace(go.Bar(
+                y=share_df.index, x=share_df['近い回答者'], name=near_label, orientation='h', marker_color='#0d6efd',
+                hovertemplate="<b>%{y}</b><br>近い回答者: %{x:.1f}%<extra></extra>"
+            ))
+            fig_near.update_layout(
+                barmode='group',
+                height=max(240, 50 * len(share_df) + 80),
+                xaxis=dict(title="割合 (%)", fixedrange=True),
+                yaxis=dict(title=None, fixedrange=True),
+                margin=dict(l=0, r=0, t=10, b=0),
+                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, font=dict(size=9 if is_mobile else 10))
+            )
+            st.plotly_chart(fig_near, use_container_width=True, config={"displayModeBar": False} if is_mobile else None, key=f"near_{col}")
+
+st.markdown("---")
+
 # ==========================================
 # UI表示：4. 詳細リスト
 # ==========================================
@@ -537,42 +646,21 @@ st.session_state.setdefault("show_all_details", False)
 # デフォルトで「法的リスク項目」を選択
 st.session_state.setdefault("detail_filter", "⚠️ 法的リスク項目")
 
+# 1ページあたりのカード数（カードは表示中のページ分だけ描画する）
+DETAIL_PAGE_SIZE = 10
+
 # コールバックで相互同期
 def _on_show_all_change():
     if st.session_state.get("show_all_details"):
         st.session_state["detail_filter"] = None
+    st.session_state["detail_page"] = 1
 
 def _on_filter_change():
     # pills選択時に全表示をオフにする
     sel = st.session_state.get("detail_filter")
     if sel:
         st.session_state["show_all_details"] = False
-
-# フィルタ解除トグル（見た目用、チェックONでpillsを外す）
-show_all = st.checkbox(
-    "フィルタを解除して全シナリオを表示",
-    value=st.session_state["show_all_details"],
-    key="show_all_details",
-    on_change=_on_show_all_change
-)
-
-# Pillsフィルタ（全シナリオ一覧は「フィルタ解除」で制御）
-filter_options = ["⚠️ 法的リスク項目", "📈 世間より「厳しい」項目", "📉 世間より「甘い」項目"]
-try:
-    # セッション状態で初期値管理
-    selection = st.pills("表示フィルタ", filter_options, key="detail_filter", on_change=_on_filter_change)
-except AttributeError:
-    # radioには未選択状態がないため、全表示時はNone扱いにする
-    if show_all:
-        selection = None
-    else:
-        selection = st.radio("表示フィルタ", filter_options, horizontal=True, key="detail_filter_radio")
-        st.session_state["detail_filter"] = selection
-        _on_filter_change()
-
-# 事後評価用のフラグ（派生値として利用）
-active_filter = selection if selection else None
-show_all = st.session_state.get("show_all_details", False) or active_filter is None
+    st.session_state["detail_page"] = 1
 
 # ------------------------------------------
 # ヘルパー関数定義
@@ -591,8 +679,13 @@ def get_rating_label(score):
     }
     return labels.get(score_int, "")
 
-def create_distribution_chart(user_rating, avg_rating):
-    """世間の回答分布と自分の位置を示すミニグラフを作成"""
+def estimate_distribution(user_rating, avg_rating):
+    """
+    平均値を中心とした山形で世間の回答分布 (%) を推計する
+
+    Returns:
+        tuple: (各評価の割合のリスト, あなたと同じ回答の割合)
+    """
     x = [1, 2, 3, 4, 5, 6]
     y = []
     # 分布推計 (平均値を中心とした山を作る)
@@ -606,6 +699,13 @@ def create_distribution_chart(user_rating, avg_rating):
     
     user_idx = int(user_rating) - 1
     user_percentage = y_per[user_idx] if 0 <= user_idx < 6 else 0
+    return y_per, user_percentage
+
+def create_distribution_chart(user_rating, avg_rating):
+    """世間の回答分布と自分の位置を示すミニグラフを作成"""
+    x = [1, 2, 3, 4, 5, 6]
+    y_per, user_percentage = estimate_distribution(user_rating, avg_rating)
+    user_idx = int(user_rating) - 1
     
     colors = ['#e0e0e0'] * 6 
     if 0 <= user_idx < 6:
@@ -713,11 +813,12 @@ def render_detail_card(row, tag_text, tag_color, bg_color, show_severity=False):
         
         st.markdown("<br>", unsafe_allow_html=True)
 
-        # 3. 分布図
-        st.caption("📊 世間の回答分布とあなたの位置 (青)")
-        fig, user_share = create_distribution_chart(row['rating'], row['avg_rating'])
-        # ★変更点：キー引数を追加してID重複エラーを回避
-        st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False}, key=f"chart_{row['scenario_id']}")
+        # 3. 分布図（グラフは開いたときだけ組み立てる）
+        _, user_share = estimate_distribution(row['rating'], row['avg_rating'])
+        if st.toggle("📊 世間の回答分布とあなたの位置 (青) を表示", key=f"show_dist_{row['scenario_id']}"):
+            fig, _ = create_distribution_chart(row['rating'], row['avg_rating'])
+            # ★変更点：キー引数を追加してID重複エラーを回避
+            st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False}, key=f"chart_{row['scenario_id']}")
 
         # マイノリティ判定
         if user_share < 15:
@@ -752,86 +853,131 @@ def render_detail_card(row, tag_text, tag_color, bg_color, show_severity=False):
             st.markdown("        </div>", unsafe_allow_html=True)
 
 # ------------------------------------------
-# データフィルタリングと描画実行
+# フィルタと詳細カードの描画
 # ------------------------------------------
+@st.fragment
+@timed("page2.detail_list")
+def render_detail_list(df):
+    """回答詳細のフィルタとカード一覧（フィルタ操作はこのセクションだけを再実行する）"""
+    # フィルタ解除トグル（見た目用、チェックONでpillsを外す）
+    show_all = st.checkbox(
+        "フィルタを解除して全シナリオを表示",
+        value=st.session_state["show_all_details"],
+        key="show_all_details",
+        on_change=_on_show_all_change
+    )
 
-df_display = pd.DataFrame()
-empty_msg = ""
-
-if show_all:
-    df_display = df.copy()
-    df_display = df_display.sort_values('scenario_id')
-    empty_msg = "データがありません。"
-    def get_all_tag(row):
-        bias = row['standardized_bias']
-        if bias >= 1.0:
-            return ("🟣 過敏", "#6f42c1", "#f5f0ff")
-        elif bias <= -1.0:
-            return ("🔴 鈍感", "#dc3545", "#fff5f5")
-        elif 0.5 <= bias < 1.0:
-            return ("🔵 厳格傾向", "#0d6efd", "#f0f7ff")
-        elif -1.0 < bias <= -0.5:
-            return ("🟠 寛容傾向", "#fd7e14", "#fffaf0")
-        else:
-            return ("✅ 平均的", "#28a745", "#f0fff4")
-    tags = df_display.apply(get_all_tag, axis=1)
-    df_display['tag_text'] = [t[0] for t in tags]
-    df_display['tag_color'] = [t[1] for t in tags]
-    df_display['bg_color'] = [t[2] for t in tags]
-
-elif active_filter == "⚠️ 法的リスク項目":
-    df_display = df[df['legal_level'] != "なし"].copy()
-    empty_msg = "法的基準と大きく乖離している項目はありません。素晴らしい判断力です。"
-    # 法的規範ベースのタグに切り替え（不足/過剰）
-    df_display['tag_text'] = df_display.apply(lambda r: "🏴 認識不足" if r['type'] == 'Black' else "🏳️ 認識過剰", axis=1)
-    df_display['tag_color'] = df_display.apply(lambda r: "#dc3545" if r['type'] == 'Black' else "#fd7e14", axis=1)
-    df_display['bg_color'] = df_display.apply(lambda r: "#fff5f5" if r['type'] == 'Black' else "#fffaf0", axis=1)
-
-elif active_filter == "📈 世間より「厳しい」項目":
-    df_display = df[(df['legal_level'] == "なし") & (df['standardized_bias'] >= 1.5)].copy()
-    empty_msg = "世間よりも極端に厳しく捉えている項目はありません。"
-    # 厳しい方向のタグ（過敏 or 厳格傾向）
-    def get_strict_tag(row):
-        if row['standardized_bias'] >= 1.0:
-            return ("🟣 過敏", "#6f42c1", "#f5f0ff")
-        else:
-            return ("🔵 厳格傾向", "#0d6efd", "#f0f7ff")
-    tags = df_display.apply(get_strict_tag, axis=1)
-    df_display['tag_text'] = [t[0] for t in tags]
-    df_display['tag_color'] = [t[1] for t in tags]
-    df_display['bg_color'] = [t[2] for t in tags]
-
-elif active_filter == "📉 世間より「甘い」項目":
-    df_display = df[(df['legal_level'] == "なし") & (df['standardized_bias'] <= -1.5)].copy()
-    empty_msg = "世間よりも極端に甘く捉えている項目はありません。"
-    # 甘い方向のタグ（鈍感 or 寛容傾向）
-    def get_lenient_tag(row):
-        if row['standardized_bias'] <= -1.0:
-            return ("🔴 鈍感", "#dc3545", "#fff5f5")
+    # Pillsフィルタ（全シナリオ一覧は「フィルタ解除」で制御）
+    filter_options = ["⚠️ 法的リスク項目", "📈 世間より「厳しい」項目", "📉 世間より「甘い」項目"]
+    try:
+        # セッション状態で初期値管理
+        selection = st.pills("表示フィルタ", filter_options, key="detail_filter", on_change=_on_filter_change)
+    except AttributeError:
+        # radioには未選択状態がないため、全表示時はNone扱いにする
+        if show_all:
+            selection = None
         else:
-            return ("🟠 寛容傾向", "#fd7e14", "#fffaf0")
-    tags = df_display.apply(get_lenient_tag, axis=1)
-    df_display['tag_text'] = [t[0] for t in tags]
-    df_display['tag_color'] = [t[1] for t in tags]
-    df_display['bg_color'] = [t[2] for t in tags]
-
-else: # フォールバック（想定外の値）
-    df_display = df.copy()
-    df_display = df_display.sort_values('scenario_id')
-    empty_msg = "データがありません。"
-
-# リスト描画ループ
-if not df_display.empty:
-    for i, row in df_display.iterrows():
-        render_detail_card(
-            row,
-            row['tag_text'],
-            row['tag_color'],
-            row['bg_color'],
-            show_severity=(active_filter == "⚠️ 法的リスク項目")
-        )
-else:
-    st.info(empty_msg)
+            selection = st.radio("表示フィルタ", filter_options, horizontal=True, key="detail_filter_radio")
+            st.session_state["detail_filter"] = selection
+            _on_filter_change()
+
+    # 事後評価用のフラグ（派生値として利用）
+    active_filter = selection if selection else None
+    show_all = st.session_state.get("show_all_details", False) or active_filter is None
+
+    # ------------------------------------------
+    # データフィルタリングと描画実行
+    # ------------------------------------------
+
+    df_display = pd.DataFrame()
+    empty_msg = ""
+
+    if show_all:
+        df_display = df.copy()
+        df_display = df_display.sort_values('scenario_id')
+        empty_msg = "データがありません。"
+        def get_all_tag(row):
+            bias = row['standardized_bias']
+            if bias >= 1.0:
+                return ("🟣 過敏", "#6f42c1", "#f5f0ff")
+            elif bias <= -1.0:
+                return ("🔴 鈍感", "#dc3545", "#fff5f5")
+            elif 0.5 <= bias < 1.0:
+                return ("🔵 厳格傾向", "#0d6efd", "#f0f7ff")
+            elif -1.0 < bias <= -0.5:
+                return ("🟠 寛容傾向", "#fd7e14", "#fffaf0")
+            else:
+                return ("✅ 平均的", "#28a745", "#f0fff4")
+        tags = df_display.apply(get_all_tag, axis=1)
+        df_display['tag_text'] = [t[0] for t in tags]
+        df_display['tag_color'] = [t[1] for t in tags]
+        df_display['bg_color'] = [t[2] for t in tags]
+
+    elif active_filter == "⚠️ 法的リスク項目":
+        df_display = df[df['legal_level'] != "なし"].copy()
+        empty_msg = "法的基準と大きく乖離している項目はありません。素晴らしい判断力です。"
+        # 法的規範ベースのタグに切り替え（不足/過剰）
+        df_display['tag_text'] = df_display.apply(lambda r: "🏴 認識不足" if r['type'] == 'Black' else "🏳️ 認識過剰", axis=1)
+        df_display['tag_color'] = df_display.apply(lambda r: "#dc3545" if r['type'] == 'Black' else "#fd7e14", axis=1)
+        df_display['bg_color'] = df_display.apply(lambda r: "#fff5f5" if r['type'] == 'Black' else "#fffaf0", axis=1)
+
+    elif active_filter == "📈 世間より「厳しい」項目":
+        df_display = df[(df['legal_level'] == "なし") & (df['standardized_bias'] >= 1.5)].copy()
+        empty_msg = "世間よりも極端に厳しく捉えている項目はありません。"
+        # 厳しい方向のタグ（過敏 or 厳格傾向）
+        def get_strict_tag(row):
+            if row['standardized_bias'] >= 1.0:
+                return ("🟣 過敏", "#6f42c1", "#f5f0ff")
+            else:
+                return ("🔵 厳格傾向", "#0d6efd", "#f0f7ff")
+        tags = df_display.apply(get_strict_tag, axis=1)
+        df_display['tag_text'] = [t[0] for t in tags]
+        df_display['tag_color'] = [t[1] for t in tags]
+        df_display['bg_color'] = [t[2] for t in tags]
+
+    elif active_filter == "📉 世間より「甘い」項目":
+        df_display = df[(df['legal_level'] == "なし") & (df['standardized_bias'] <= -1.5)].copy()
+        empty_msg = "世間よりも極端に甘く捉えている項目はありません。"
+        # 甘い方向のタグ（鈍感 or 寛容傾向）
+        def get_lenient_tag(row):
+            if row['standardized_bias'] <= -1.0:
+                return ("🔴 鈍感", "#dc3545", "#fff5f5")
+            else:
+                return ("🟠 寛容傾向", "#fd7e14", "#fffaf0")
+        tags = df_display.apply(get_lenient_tag, axis=1)
+        df_display['tag_text'] = [t[0] for t in tags]
+        df_display['tag_color'] = [t[1] for t in tags]
+        df_display['bg_color'] = [t[2] for t in tags]
+
+    else: # フォールバック（想定外の値）
+        df_display = df.copy()
+        df_display = df_display.sort_values('scenario_id')
+        empty_msg = "データがありません。"
+
+    # リスト描画ループ（表示中のページ分のみ）
+    if not df_display.empty:
+        n_pages = -(-len(df_display) // DETAIL_PAGE_SIZE)
+        page = 1
+        if n_pages > 1:
+            st.session_state.setdefault("detail_page", 1)
+            page = st.segmented_control(
+                f"ページ（全{len(df_display)}件）", list(range(1, n_pages + 1)), key="detail_page",
+                format_func=lambda p: f"{(p - 1) * DETAIL_PAGE_SIZE + 1}〜{min(p * DETAIL_PAGE_SIZE, len(df_display))}"
+            ) or 1
+            page = min(page, n_pages)
+        df_page = df_display.iloc[(page - 1) * DETAIL_PAGE_SIZE: page * DETAIL_PAGE_SIZE]
+        for i, row in df_page.iterrows():
+            render_detail_card(
+                row,
+                row['tag_text'],
+                row['tag_color'],
+                row['bg_color'],
+                show_severity=(active_filter == "⚠️ 法的リスク項目")
+            )
+    else:
+        st.info(empty_msg)
+
+render_detail_list(df)
 
 # ==========================================
 # 5. 次のアクション (ページ遷移ボタン)
@@ -1,10 +1,25 @@
 import streamlit as st
+import time
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px
+from plotly.colors import qualitative
 import numpy as np
-import textwrap
-from utils.db import get_global_analysis_data_view, generate_demo_data
+from utils.db import generate_demo_data, get_all_scenarios
+from utils.population import (
+    load_population, get_profile_model, get_axis_cubes, get_cross_moments,
+    get_filter_cube, get_raking_cube, get_scenario_counts, get_aggregate_mode, get_sketch_store, get_reservoir, get_data_version,
+    get_item_quality, get_snapshot,
+    ATTRIBUTE_COLUMNS,
+)
+from utils.aggregates import (
+    stack_axis_cubes, variance_explained, hierarchical_order, distribution_metrics, kpi_summary, mean_std,
+    scenario_summary,
+)
+from utils.clustering import profile_name
+from utils.sketches import HLL_PRECISION, OVERALL
+from utils.charts import background_gradient, cached_figure, get_scenario_display_table, hover_column, scatter_trace_class
+from utils.timing import timed
+from utils.session import init_session
 
 # 初回訪問フラグ
 if "visited_page3" not in st.session_state:
@@ -12,6 +27,9 @@ if "visited_page3" not in st.session_state:
 
 st.set_page_config(page_title="世の中の傾向", page_icon="🌏", layout="wide")
 
+# セッション初期化
+init_session()
+
 # カスタムCSS
 st.markdown("""
     <style>
@@ -37,79 +55,42 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# ツールチップ用にテキストを改行する関数
-def format_hover_text(text, width=40):
-    if not isinstance(text, str): return ""
-    return "<br>".join(textwrap.wrap(text, width=width))
-
 # モバイル向け表示トグル
 is_mobile = st.toggle("📱 モバイル向け表示", value=False, help="スマホではONにするとホバー表示を短く折り返し、フォントとマーカーサイズを最適化します。")
-wrap_w = 22 if is_mobile else 40
 hover_font_size = 11 if is_mobile else 13
 marker_size = 10 if is_mobile else 14
 
-# モバイル時は長文を短縮してから折り返す
-def format_hover_compact(text: str, wrap_width: int, mobile: bool, max_chars: int = 140) -> str:
-    if not isinstance(text, str):
-        return ""
-    t = text.strip()
-    if mobile and len(t) > max_chars:
-        t = t[: max_chars - 1] + "…"
-    return "<br>".join(textwrap.wrap(t, width=wrap_width))
-
 # ==========================================
 # 0. データロード & 前処理
 # ==========================================
 
-# Note: キャッシュなし = リアルタイム反映（開発・小規模運用向け）
-# 大規模運用時は @st.cache_data(ttl=60) を追加して負荷軽減を検討
-def load_data():
-    """
-    データを読み込む。データが不足している場合はデモデータを使用。
-    
-    Returns:
-        tuple: (DataFrame, is_demo: bool)
-    """
-    # SQL Viewから一括取得
-    view_data = get_global_analysis_data_view()
-    
-    if not view_data:
-        st.info("📊 現在のデータ数: 0人（まだ回答データがありません）")
-        st.info("💻 研究・実験用のデモデータを使用します。")
-        return generate_demo_data(), True
-    
-    df_full = pd.DataFrame(view_data)
-    
-    # 必須カラムの確認
-    required_cols = ['user_id', 'rating', 'scenario_id', 'title', 'text', 'category', 'type']
-    missing_cols = [col for col in required_cols if col not in df_full.columns]
-    
-    if missing_cols:
-        st.error(f"⚠️ 必須カラムが不足しています: {missing_cols}")
-        st.write(f"利用可能なカラム: {df_full.columns.tolist()}")
-        st.info("デモデータを使用します。")
-        return generate_demo_data(), True
-    
-    # データ型の修正
-    df_full['rating'] = pd.to_numeric(df_full['rating'], errors='coerce')
-    df_full['scenario_id'] = df_full['scenario_id'].astype(int)
-    
-    # ユーザー数をチェック（10人未満ならデモデータ）
-    unique_users = df_full['user_id'].nunique()
-    
-    if unique_users < 10:
-        st.info(f"📊 現在のデータ数: {unique_users}人（統計的に十分なデータではありません）")
-        st.info("💻 研究・実験用のデモデータを使用します。")
-        return generate_demo_data(), True
-    
-    return df_full, False
-
-with st.spinner("データを分析中..."):
-    df, is_demo = load_data()
-
-if df.empty:
-    st.warning("⚠️ まだ十分な分析データが集まっていません。")
-    st.stop()
+# 集計スナップショットモードでは、バックグラウンドワーカー（python -m utils.worker）が
+# 作成済みの集計だけを読み、回答データは読み込まない（まだ作成されていなければ直接集計する）
+# 近似集計モードでは保存済みのスケッチだけを読み、回答データは読み込まない
+aggregate_mode = get_aggregate_mode()
+snapshot = get_snapshot() if aggregate_mode == "snapshot" else None
+if aggregate_mode == "snapshot" and snapshot is None:
+    aggregate_mode = "exact"
+sketch_store = get_sketch_store() if aggregate_mode == "sketch" else None
+
+if snapshot is not None:
+    is_demo = snapshot.is_demo
+    if snapshot.n_users == 0:
+        st.warning("⚠️ まだ十分な分析データが集まっていません。")
+        st.stop()
+elif sketch_store is not None:
+    is_demo = sketch_store.is_demo
+    if sketch_store.counts().sum() == 0:
+        st.warning("⚠️ まだ十分な分析データが集まっていません。")
+        st.stop()
+else:
+    # 共有の評価行列（10人未満ならデモデータ）を使い、分析用ビューを実行のたびに取得し直さない
+    with st.spinner("データを分析中..."):
+        population = load_population()
+    is_demo = population.is_demo
+    if len(population.user_ids) == 0:
+        st.warning("⚠️ まだ十分な分析データが集まっていません。")
+        st.stop()
 
 # デモデータ使用時の透明性表示
 if is_demo:
@@ -135,21 +116,66 @@ title_suffix = "(デモデータ)" if is_demo else ""
 st.title(f"🌏 世の中の認識傾向{title_suffix}")
 st.markdown("社会全体のハラスメント認識の傾向を把握し、どのような認識ギャップが存在するかを分析します。")
 
-# --- KPI計算 ---
-black_df = df[df['type'] == 'Black']
-miss_rate = (black_df['rating'] <= 3).mean() * 100 if not black_df.empty else 0.0
-
-white_df = df[df['type'] == 'White']
-over_rate = (white_df['rating'] >= 4).mean() * 100 if not white_df.empty else 0.0
-
-gray_stats = df[df['type'] == 'Gray'].groupby('scenario_id')['rating'].std()
-conflict_score = gray_stats.mean() if not gray_stats.empty else 0.0
+# --- KPI計算（集計キューブのヒストグラムから算出） ---
+# 近似集計モードでは書き込み時に更新されるスケッチ（数百KB）だけから算出する
+# 集計スナップショットモードではワーカーが算出済みのヒストグラム・KPI を使う（重み付けはキューブから再計算）
+use_weights = st.toggle(
+    "⚖️ 重み付け集計（母集団の属性構成に補正）", value=False, key="use_weights",
+    disabled=aggregate_mode == "sketch",
+    help="回答者の年代・性別・役職・業界の構成を目標分布に合わせる事後層化ウェイト（レイキング）を適用します。KPI・類型別の内訳・全シナリオ詳細データ（平均・SD・回答割合）に反映されます。判断傾向マップと属性間ギャップ分析は、役職・業界（およびギャップ分析の年代・性別）で絞り込んだときまで反映されます。"
+)
+if aggregate_mode == "sketch":
+    agg_scenario_ids = sketch_store.scenario_ids
+    agg_scenario_types = (
+        pd.DataFrame(get_all_scenarios()).set_index('scenario_id')['type']
+        .reindex(agg_scenario_ids.astype(int)).fillna('Gray').to_numpy()
+    )
+    scenario_counts = sketch_store.counts()
+    n_users = effective_n = sketch_store.users()
+    population_is_demo = sketch_store.is_demo
+elif aggregate_mode == "snapshot":
+    agg_scenario_ids, agg_scenario_types = snapshot.scenario_ids, snapshot.scenario_types
+    if use_weights:
+        scenario_counts, effective_n = get_scenario_counts(weighted=True, cube=snapshot.raking_cube)
+    else:
+        scenario_counts, effective_n = snapshot.scenario_counts, float(snapshot.n_users)
+    n_users = snapshot.n_users
+    population_is_demo = snapshot.is_demo
+else:
+    agg_scenario_ids, agg_scenario_types = population.scenario_ids, population.scenario_types
+    scenario_counts, effective_n = get_scenario_counts(weighted=use_weights)
+    n_users = len(population.user_ids)
+    population_is_demo = population.is_demo
+kpi = snapshot.kpi if snapshot is not None and not use_weights else kpi_summary(scenario_counts, agg_scenario_types)
+# 重み付け集計に使うレイキング用キューブ（重み付けなし・近似集計モードでは None）
+raking_cube = None
+if use_weights and aggregate_mode != "sketch":
+    raking_cube = snapshot.raking_cube if snapshot is not None else get_raking_cube()
+# 図のキャッシュキーに使うデータバージョン
+if snapshot is not None:
+    data_version = ((snapshot.built_at, snapshot.source_version), aggregate_mode)
+elif sketch_store is not None:
+    data_version = ((sketch_store.version,), aggregate_mode)
+else:
+    data_version = (get_data_version(), aggregate_mode)
+miss_rate = kpi['miss_rate'] or 0.0
+over_rate = kpi['over_rate'] or 0.0
+conflict_score = kpi['conflict_score'] or 0.0
 
 # --- KPI表示 ---
 k1, k2, k3, k4 = st.columns(4)
 
 with k1:
-    st.metric("👥 分析対象人数", f"{df['user_id'].nunique():,} 人", help="サンプル数")
+    if aggregate_mode == "sketch":
+        st.metric("👥 分析対象人数", f"約 {n_users:,.0f} 人", help=f"HyperLogLog による推定値（相対標準誤差 約{104 / 2 ** (HLL_PRECISION / 2):.1f}%）")
+        q1, q2, q3 = (sketch_store.quantiles[OVERALL].quantile(q) for q in (0.25, 0.5, 0.75))
+        st.caption(f"平均スコアの中央値: {q2:.2f}（四分位 {q1:.2f}〜{q3:.2f}）")
+    else:
+        st.metric("👥 分析対象人数", f"{n_users:,} 人", help="サンプル数")
+    if snapshot is not None:
+        st.caption(f"集計時刻: {time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot.built_at))}")
+    if use_weights:
+        st.caption(f"有効標本サイズ: {effective_n:,.0f} 人")
 with k2:
     st.metric("⚠️ 違法行為の見逃し", f"{miss_rate:.1f}%", help="法的にはパワハラに該当するシナリオを「パワハラではない」とした割合")
 with k3:
@@ -160,6 +186,22 @@ with k4:
     elif conflict_score < 1.3: st.markdown(":orange[**⚠️ 解釈の相違**]")
     else: st.markdown(":red[**🚨 価値観の対立**]")
 
+# 適応型出題の回答者は一部のシナリオにしか答えない（出題は回答に応じて選ばれる）ため、
+# 回答の充足率が下がっているときはシナリオ別の集計が偏り得ることを示す
+if aggregate_mode == "snapshot":
+    answered_counts = snapshot.scenario_counts
+elif aggregate_mode == "sketch" or not use_weights:
+    answered_counts = scenario_counts
+else:
+    answered_counts = get_scenario_counts(weighted=False)[0]
+answer_coverage = answered_counts.sum() / max(n_users * len(agg_scenario_ids), 1)
+if answer_coverage < 0.95:
+    st.caption(
+        f"ℹ️ 回答の充足率 {answer_coverage:.0%}: 一部のシナリオだけに回答した人（適応型出題）が含まれます。"
+        "適応型出題では回答に応じて出題するシナリオが選ばれるため、シナリオ別の平均・N と KPI は"
+        "そのシナリオを出題された人の傾向に偏ることがあります。"
+    )
+
 st.write("") 
 
 # --- 中段：属性分布 & 分野別内訳 ---
@@ -168,25 +210,41 @@ c_demo, c_breakdown = st.columns([2, 3])
 with c_demo:
     with st.expander("📊 参加者の属性分布を詳しく見る", expanded=True):
         st.caption("分析対象となっているユーザーの内訳です。")
-        df_users_unique = df.drop_duplicates(subset=['user_id'])
         tabs = st.tabs(["年代", "性別", "役職", "雇用形態", "業界", "職種", "勤続年数"])
-        colors_pie = px.colors.qualitative.Pastel
+        colors_pie = qualitative.Pastel
         
-        def plot_pie(col):
-            c = df_users_unique[col].value_counts().reset_index()
+        def _attribute_counts(col):
+            # 集計キューブの水準別人数（近似集計モードでは HyperLogLog の推定人数）を使う
+            if aggregate_mode == "sketch":
+                c = pd.Series({lv: round(sketch_store.users((col, lv))) for lv in sketch_store.segments(col)}, dtype=int)
+            else:
+                cube = (snapshot.axis_cubes if snapshot is not None else get_axis_cubes()).get(col)
+                c = pd.Series(cube.users, index=cube.levels[col]) if cube is not None else pd.Series(dtype=int)
+            c = c.drop("不明", errors="ignore")
+            c = c[c > 0].sort_values(ascending=False).reset_index()
             c.columns = [col, 'count']
-            fig = px.pie(c, values='count', names=col, hole=0.4, color_discrete_sequence=colors_pie)
-            fig.update_layout(height=220, margin=dict(t=10, b=10, l=10, r=10), showlegend=True)
-            st.plotly_chart(fig, use_container_width=True)
+            return c
+
+        def plot_pie(col):
+            def build():
+                # plotly.express は図を組み立てるとき（キャッシュにないとき）だけ読み込む
+                import plotly.express as px
+                c = _attribute_counts(col)
+                fig = px.pie(c, values='count', names=col, hole=0.4, color_discrete_sequence=colors_pie)
+                fig.update_layout(height=220, margin=dict(t=10, b=10, l=10, r=10), showlegend=True)
+                return fig
+            st.plotly_chart(cached_figure(("attr_pie", data_version, col), build), use_container_width=True)
 
         def plot_bar(col):
-            c = df_users_unique[col].value_counts().reset_index()
-            c.columns = [col, 'count']
-            c = c.sort_values('count', ascending=True)
-            fig = px.bar(c, x='count', y=col, orientation='h', text_auto=True)
-            fig.update_traces(marker_color='#6c5ce7')
-            fig.update_layout(height=220, margin=dict(t=10, b=10, l=0, r=0), xaxis=dict(showticklabels=False), yaxis_title=None)
-            st.plotly_chart(fig, use_container_width=True)
+            def build():
+                import plotly.express as px
+                c = _attribute_counts(col)
+                c = c.sort_values('count', ascending=True)
+                fig = px.bar(c, x='count', y=col, orientation='h', text_auto=True)
+                fig.update_traces(marker_color='#6c5ce7')
+                fig.update_layout(height=220, margin=dict(t=10, b=10, l=0, r=0), xaxis=dict(showticklabels=False), yaxis_title=None)
+                return fig
+            st.plotly_chart(cached_figure(("attr_bar", data_version, col), build), use_container_width=True)
 
         with tabs[0]: plot_pie('age')
         with tabs[1]: plot_pie('gender')
@@ -200,16 +258,12 @@ with c_breakdown:
     with st.expander("📊 【内訳】類型ごとの「認識ギャップ」を見る", expanded=True):
         st.caption("どの類型において、認識のズレや萎縮が起きているかを確認します。")
         cat_risks = []
-        _cat_series = df['category'].dropna().astype(str).str.strip()
-        for cat in sorted([c for c in _cat_series.unique() if c]):
-            cat_df = df[df['category'].astype(str).str.strip() == cat]
-            b_df = cat_df[cat_df['type'] == 'Black']
-            miss = (b_df['rating'] <= 3).mean() * 100 if not b_df.empty else None
-            w_df = cat_df[cat_df['type'] == 'White']
-            over = (w_df['rating'] >= 4).mean() * 100 if not w_df.empty else None
-            g_df = cat_df[cat_df['type'] == 'Gray']
-            std_avg = g_df.groupby('scenario_id')['rating'].std().mean() if not g_df.empty else None
-            cat_risks.append({"カテゴリ": cat, "⚠️ 違法行為の見逃し": miss, "🛡️ 適法行為の問題視": over, "⚡ 認識の割れ具合": std_avg})
+        scenario_category = pd.DataFrame(get_all_scenarios()).set_index('scenario_id')['category'].astype(str).str.strip()
+        scenario_category = scenario_category.reindex(agg_scenario_ids.astype(int)).fillna("").to_numpy()
+        for cat in sorted([c for c in set(scenario_category) if c]):
+            sel = scenario_category == cat
+            cat_kpi = kpi_summary(scenario_counts[sel], agg_scenario_types[sel])
+            cat_risks.append({"カテゴリ": cat, "⚠️ 違法行為の見逃し": cat_kpi['miss_rate'], "🛡️ 適法行為の問題視": cat_kpi['over_rate'], "⚡ 認識の割れ具合": cat_kpi['conflict_score']})
             
         risk_df = pd.DataFrame(cat_risks).set_index("カテゴリ")
         # 色付けの説明（凡例）
@@ -236,7 +290,7 @@ with c_breakdown:
         _base_h = 48
         _df_height = min(600, _base_h + _row_h * max(len(risk_df), 1))
         st.dataframe(
-            risk_df.style.background_gradient(cmap='RdYlGn_r', subset=['⚠️ 違法行為の見逃し', '🛡️ 適法行為の問題視'], vmin=0, vmax=50)
+            background_gradient(risk_df.style, 'RdYlGn_r', ['⚠️ 違法行為の見逃し', '🛡️ 適法行為の問題視'], vmin=0, vmax=50)
                         .format("{:.1f}%", subset=['⚠️ 違法行為の見逃し', '🛡️ 適法行為の問題視'], na_rep="-")
                         .format("{:.2f}", subset=['⚡ 認識の割れ具合'], na_rep="-")
                         .applymap(_conflict_bg, subset=['⚡ 認識の割れ具合'])
@@ -251,13 +305,13 @@ st.markdown("---")
 # 
 # ------------------------------------------
 st.subheader("パワハラ判断傾向マップ")
-st.markdown("各シナリオのハラスメント認識傾向を「ハラスメント強度」（平均スコア）と「認識の割れ具合」（標準偏差）の2軸で可視化します。 ")
+st.markdown("各シナリオのハラスメント認識傾向を「ハラスメント強度」（平均スコア）と「認識の割れ具合」（標準偏差）の2軸で可視化します。縦軸は回答の散らばり・二極化度・合意度にも切り替えられます。 ")
 st.info("""
 **🗺️ グラフの見方 (プロット上のシンボルをホバー/タップするとシナリオの詳細が表示されます)**
 
 **軸の意味:**
 - **X軸 (ハラスメント強度)**: スコアが高いほど「ハラスメント」と認識されやすい
-- **Y軸 (認識の割れ具合)**: スコアのばらつきが大きいほど、判断にばらつきがある
+- **Y軸 (認識の割れ具合)**: スコアのばらつきが大きいほど、判断にばらつきがある（指標は切り替え可能）
 
 **シンボルの意味:**
 - **× (Black)**: 法的には違法・アウト と判定されるシナリオ
@@ -269,98 +323,147 @@ st.info("""
 - 🟡 **グレーゾーン（中央）**: 判断が分かれ、解釈が異なりやすい領域
 - 🔴 **高リスクゾーン（右側）**: パワハラだと判断する人が多い領域
 """)
-df_filtered = df.copy()
-
-# セッション既定値（ウィジェット生成前に初期化）
-st.session_state.setdefault("map_sel_pos", "全役職")
-st.session_state.setdefault("map_sel_serv", "全勤続年数")
-st.session_state.setdefault("map_sel_ind", "全業界")
-st.session_state.setdefault("map_sel_job", "全職種")
-
-# 詳細フィルター（エクスパンダ）
-with st.expander("🔍 詳細フィルター", expanded=False):
-    st.caption("役職・勤続年数・業界・職種で絞り込みできます。")
-    ind_list = ["全業界"] + sorted([x for x in df['industry'].dropna().unique() if x])
-    pos_list = ["全役職"] + sorted([x for x in df['position'].dropna().unique() if x])
-    serv_list = ["全勤続年数"] + sorted(list(df['service_years'].dropna().unique()))
-    job_list = ["全職種"] + sorted([x for x in df['job_type'].dropna().unique() if x])
-
-    # 解除コールバック（ウィジェット生成前に状態を更新）
-    def _reset_map_filters():
-        st.session_state["map_sel_pos"] = "全役職"
-        st.session_state["map_sel_serv"] = "全勤続年数"
-        st.session_state["map_sel_ind"] = "全業界"
-        st.session_state["map_sel_job"] = "全職種"
-
-    st.button("フィルターを全て解除", type="secondary", on_click=_reset_map_filters)
-
-    cfa, cfb = st.columns(2)
-    with cfa:
-        st.selectbox("役職", pos_list, index=0, key="map_sel_pos")
-        st.selectbox("業界", ind_list, index=0, key="map_sel_ind")
-    with cfb:
-        st.selectbox("勤続年数", serv_list, index=0, key="map_sel_serv")
-        st.selectbox("職種", job_list, index=0, key="map_sel_job")
-
-# 絞り込みの適用
-sel_ind = st.session_state.get("map_sel_ind", "全業界")
-sel_pos = st.session_state.get("map_sel_pos", "全役職")
-sel_serv = st.session_state.get("map_sel_serv", "全勤続年数")
-sel_job = st.session_state.get("map_sel_job", "全職種")
-
-if sel_ind != "全業界":
-    df_filtered = df_filtered[df_filtered['industry'] == sel_ind]
-if sel_pos != "全役職":
-    df_filtered = df_filtered[df_filtered['position'] == sel_pos]
-if sel_serv != "全勤続年数":
-    df_filtered = df_filtered[df_filtered['service_years'] == sel_serv]
-if sel_job != "全職種":
-    df_filtered = df_filtered[df_filtered['job_type'] == sel_job]
-
-with st.container():
-    if df_filtered.empty:
-        st.warning("データが不足しています。")
+# 絞り込みは属性の組み合わせごとのヒストグラム（集計キューブ）から行い、生データは走査しない
+if snapshot is not None:
+    filter_cube = snapshot.filter_cube
+elif sketch_store is not None:
+    filter_cube = sketch_store.filter_cube()
+else:
+    filter_cube = get_filter_cube()
+
+@st.fragment
+@timed("page3.judgement_map")
+def render_judgement_map(filter_cube, raking_cube=None):
+    """判断傾向マップ（絞り込み・指標の変更はこのセクションだけを再実行する）"""
+    def _levels(axis):
+        return sorted([x for x in filter_cube.levels.get(axis, []) if x and x != "不明"])
+
+    # セッション既定値（ウィジェット生成前に初期化）
+    st.session_state.setdefault("map_sel_pos", "全役職")
+    st.session_state.setdefault("map_sel_serv", "全勤続年数")
+    st.session_state.setdefault("map_sel_ind", "全業界")
+    st.session_state.setdefault("map_sel_job", "全職種")
+
+    # 詳細フィルター（エクスパンダ）
+    with st.expander("🔍 詳細フィルター", expanded=False):
+        st.caption("役職・勤続年数・業界・職種で絞り込みできます。")
+        ind_list = ["全業界"] + _levels('industry')
+        pos_list = ["全役職"] + _levels('position')
+        serv_list = ["全勤続年数"] + _levels('service_years')
+        job_list = ["全職種"] + _levels('job_type')
+
+        # 解除コールバック（ウィジェット生成前に状態を更新）
+        def _reset_map_filters():
+            st.session_state["map_sel_pos"] = "全役職"
+            st.session_state["map_sel_serv"] = "全勤続年数"
+            st.session_state["map_sel_ind"] = "全業界"
+            st.session_state["map_sel_job"] = "全職種"
+
+        st.button("フィルターを全て解除", type="secondary", on_click=_reset_map_filters)
+
+        cfa, cfb = st.columns(2)
+        with cfa:
+            st.selectbox("役職", pos_list, index=0, key="map_sel_pos")
+            st.selectbox("業界", ind_list, index=0, key="map_sel_ind")
+        with cfb:
+            st.selectbox("勤続年数", serv_list, index=0, key="map_sel_serv")
+            st.selectbox("職種", job_list, index=0, key="map_sel_job")
+
+    # 縦軸の指標（いずれもヒストグラムから算出）
+    map_metrics = {
+        'std': ("認識の割れ具合", "標準偏差。大きいほど判断がばらつく"),
+        'entropy': ("回答の散らばり", "正規化エントロピー。0=全員同じ回答、1=6段階に均等"),
+        'bimodality': ("二極化度", "二峰性係数。0.555を超えると「感じない」と「強く感じる」に二極化"),
+        'consensus': ("合意度", "Leikの合意度。1=全員同じ回答、0=両端に半数ずつ"),
+    }
+    y_metric = st.radio(
+        "縦軸の指標", list(map_metrics), format_func=lambda m: map_metrics[m][0],
+        horizontal=True, key="map_y_metric"
+    )
+    st.caption(f"📏 {map_metrics[y_metric][0]}: {map_metrics[y_metric][1]}")
+
+    # 絞り込みの適用
+    sel_ind = st.session_state.get("map_sel_ind", "全業界")
+    sel_pos = st.session_state.get("map_sel_pos", "全役職")
+    sel_serv = st.session_state.get("map_sel_serv", "全勤続年数")
+    sel_job = st.session_state.get("map_sel_job", "全職種")
+
+    map_filters = {
+        axis: value for axis, value, all_label in [
+            ('industry', sel_ind, "全業界"), ('position', sel_pos, "全役職"),
+            ('service_years', sel_serv, "全勤続年数"), ('job_type', sel_job, "全職種"),
+        ] if value != all_label and axis in filter_cube.axes
+    }
+    # 重み付け集計はレイキング用キューブにある軸（役職・業界）での絞り込みまで。
+    # 勤続年数・職種はレイキング用キューブにないため、その絞り込みは重み付けなしで集計する
+    map_weighted = raking_cube is not None and all(axis in raking_cube.axes for axis in map_filters)
+    if map_weighted:
+        map_counts = get_scenario_counts(weighted=True, cube=raking_cube, filters=map_filters)[0]
+        st.caption("⚖️ 重み付け集計: 母集団の属性構成に補正した回答分布から算出しています。")
     else:
-        scenario_stats = df_filtered.groupby(['title', 'category', 'type', 'text']).agg(
-            mean=('rating', 'mean'), std=('rating', 'std'), count=('rating', 'count')
-        ).reset_index()
-        
-        scenario_stats['hover_text'] = scenario_stats['text'].apply(lambda x: format_hover_text(x, wrap_w))
+        map_counts = filter_cube.select(**map_filters).marginal().counts  # (シナリオ, 6)
+        if raking_cube is not None:
+            st.warning("⚖️ 勤続年数・職種で絞り込んだマップには重み付けを適用できません。重み付けなしの回答者数で集計しています。")
 
-        fig = go.Figure()
-        # Zones
-        fig.add_shape(type="rect", x0=1, y0=0, x1=2.5, y1=1.0, fillcolor="rgba(46, 204, 113, 0.1)", line_width=0, layer="below")
-        fig.add_shape(type="rect", x0=4.5, y0=0, x1=6, y1=1.0, fillcolor="rgba(231, 76, 60, 0.1)", line_width=0, layer="below")
-        fig.add_shape(type="rect", x0=1, y0=1.3, x1=6, y1=2.5, fillcolor="rgba(241, 196, 15, 0.1)", line_width=0, layer="below")
+    with st.container():
+        if map_counts.sum() == 0:
+            st.warning("データが不足しています。")
+        else:
+            def build_map_figure():
+                scenario_display = get_scenario_display_table(get_all_scenarios())
+                metrics = distribution_metrics(map_counts)
+                scenario_stats = pd.DataFrame({'scenario_id': filter_cube.scenario_ids.astype(int), **metrics})
+                scenario_stats = scenario_stats[scenario_stats['count'] > 0].merge(
+                    scenario_display[['title', 'category', 'type', hover_column(is_mobile)]].rename(columns={hover_column(is_mobile): 'hover_text'}),
+                    left_on='scenario_id', right_index=True, how='inner'
+                )
+                y_label = map_metrics[y_metric][0]
+
+                fig = go.Figure()
+                # Zones（標準偏差の閾値に基づくため、標準偏差表示のときのみ）
+                if y_metric == 'std':
+                    fig.add_shape(type="rect", x0=1, y0=0, x1=2.5, y1=1.0, fillcolor="rgba(46, 204, 113, 0.1)", line_width=0, layer="below")
+                    fig.add_shape(type="rect", x0=4.5, y0=0, x1=6, y1=1.0, fillcolor="rgba(231, 76, 60, 0.1)", line_width=0, layer="below")
+                    fig.add_shape(type="rect", x0=1, y0=1.3, x1=6, y1=2.5, fillcolor="rgba(241, 196, 15, 0.1)", line_width=0, layer="below")
+                elif y_metric == 'bimodality':
+                    fig.add_hline(y=0.555, line_width=1, line_dash="dash", line_color="#999")
         
-        symbol_map = {'Black': 'x', 'Gray': 'triangle-up', 'White': 'circle'}
-        color_palette = px.colors.qualitative.Bold 
-        cat_colors = {cat: color_palette[i % len(color_palette)] for i, cat in enumerate(sorted(scenario_stats['category'].unique()))}
+                symbol_map = {'Black': 'x', 'Gray': 'triangle-up', 'White': 'circle'}
+                color_palette = qualitative.Bold 
+                cat_colors = {cat: color_palette[i % len(color_palette)] for i, cat in enumerate(sorted(scenario_stats['category'].unique()))}
         
-        for t in ['White', 'Gray', 'Black']:
-            for cat in sorted(scenario_stats['category'].unique()):
-                d = scenario_stats[(scenario_stats['type'] == t) & (scenario_stats['category'] == cat)]
-                if not d.empty:
-                    fig.add_trace(go.Scatter(
-                        x=d['mean'], y=d['std'], mode='markers', name=cat, legendgroup=cat, showlegend=True,
-                        marker=dict(size=marker_size, symbol=symbol_map[t], color=cat_colors[cat], line=dict(width=1, color='white'), opacity=0.9),
-                        customdata=d['hover_text'],
+                # カテゴリごとに 1 トレース（種別はマーカー記号の配列で表す）。Black が手前に来るよう並べる
+                trace_class = scatter_trace_class(len(scenario_stats))
+                type_order = {'White': 0, 'Gray': 1, 'Black': 2}
+                for cat in sorted(scenario_stats['category'].unique()):
+                    d = scenario_stats[scenario_stats['category'] == cat].sort_values('type', key=lambda s: s.map(type_order), kind='stable')
+                    fig.add_trace(trace_class(
+                        x=d['mean'], y=d[y_metric], mode='markers', name=cat, legendgroup=cat, showlegend=True,
+                        marker=dict(size=marker_size, symbol=d['type'].map(symbol_map).tolist(), color=cat_colors[cat], line=dict(width=1, color='white'), opacity=0.9),
+                        customdata=d[['hover_text', 'std', 'entropy', 'bimodality', 'consensus']],
                         text=d['title'],
-                        hovertemplate="%{text}<br><br>%{customdata}<br><br><b>平均スコア:</b> %{x:.2f}<br><b>認識の割れ具合:</b> %{y:.2f}<extra></extra>"
+                        hovertemplate=(
+                            "%{text}<br><br>%{customdata[0]}<br><br><b>平均スコア:</b> %{x:.2f}"
+                            "<br><b>認識の割れ具合:</b> %{customdata[1]:.2f}<br><b>回答の散らばり:</b> %{customdata[2]:.2f}"
+                            "<br><b>二極化度:</b> %{customdata[3]:.2f}<br><b>合意度:</b> %{customdata[4]:.2f}<extra></extra>"
+                        )
                     ))
         
-        fig.update_layout(
-            xaxis_title="ハラスメント強度", 
-            yaxis_title="認識の割れ具合", 
-            height=620 if is_mobile else 550, 
-            margin=dict(l=0,r=0,t=10,b=120 if is_mobile else 80), 
-            legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5, font=dict(size=9 if is_mobile else 10)),
-            showlegend=True,
-            hoverlabel=dict(font_size=hover_font_size)
-        )
-        names = set()
-        fig.for_each_trace(lambda trace: trace.update(showlegend=False) if (trace.name in names) else names.add(trace.name))
-        st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
+                fig.update_layout(
+                    xaxis_title="ハラスメント強度", 
+                    yaxis_title=y_label, 
+                    height=620 if is_mobile else 550, 
+                    margin=dict(l=0,r=0,t=10,b=120 if is_mobile else 80), 
+                    legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5, font=dict(size=9 if is_mobile else 10)),
+                    showlegend=True,
+                    hoverlabel=dict(font_size=hover_font_size)
+                )
+                return fig
+
+            fig = cached_figure(("map", data_version, tuple(sorted(map_filters.items())), y_metric, map_weighted, is_mobile), build_map_figure)
+            st.plotly_chart(fig, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
+
+render_judgement_map(filter_cube, raking_cube)
 
 st.markdown("---")
 
@@ -374,153 +477,287 @@ if is_demo:
 else:
     st.info("実データに存在しない属性値は、デモデータで補完しています", icon="ℹ️")
 
+scenario_catalog = get_scenario_display_table(get_all_scenarios())
+
 axis_map = {
     'position': '役職', 'age': '年代', 'gender': '性別',
     'employment_status': '雇用形態', 'industry': '業界', 'job_type': '職種', 'service_years': '勤続年数'
 }
 
-# デモデータ（実シナリオ活用）
-demo_df = generate_demo_data()
-
-# 条件設定エリア
-with st.container(border=True):
-    st.markdown("##### 🛠️ 比較条件の設定")
-    c1, c2, c3 = st.columns(3)
+# --- 全属性 × 全シナリオの説明力ランキング ---
+with st.expander("📐 どの属性で判断が分かれるか（全属性の一括比較）", expanded=True):
+    st.caption("各シナリオの評価のばらつきのうち、属性グループの違いで説明できる割合（η²、群間分散の割合）を全ての軸について算出しています。値が大きいほど、その属性によって判断が分かれやすいことを示します。")
+    if aggregate_mode == "sketch":
+        axis_cubes = {axis: sketch_store.axis_cube(axis) for axis in ATTRIBUTE_COLUMNS if sketch_store.segments(axis)}
+    elif aggregate_mode == "snapshot":
+        axis_cubes = snapshot.axis_cubes
+    else:
+        axis_cubes = get_axis_cubes()
+    if not axis_cubes or scenario_counts.sum() == 0:
+        st.info("データが不足しています")
+    else:
+        eta_axes, eta_counts = stack_axis_cubes(axis_cubes)
+        eta_sq, f_stat = variance_explained(eta_counts)  # (軸, シナリオ)
+        title_map = scenario_catalog['title']
+        eta_titles = [title_map.get(int(sid), f"シナリオ{sid}") for sid in agg_scenario_ids]
+        eta_labels = [axis_map[a] for a in eta_axes]
+        eta_df = pd.DataFrame(eta_sq.T * 100, index=eta_titles, columns=eta_labels)
+        f_df = pd.DataFrame(f_stat.T, index=eta_titles, columns=eta_labels)
+
+        # 軸は平均 η² の降順、シナリオは最大 η² の降順に並べる
+        axis_rank = eta_df.mean().sort_values(ascending=False)
+        scenario_rank = eta_df.max(axis=1).sort_values(ascending=False).index
+        eta_df = eta_df.loc[scenario_rank, axis_rank.index]
+        f_df = f_df.loc[scenario_rank, axis_rank.index]
+
+        fig_eta = go.Figure(go.Heatmap(
+            z=eta_df.values, x=eta_df.columns, y=eta_df.index,
+            colorscale='Oranges', zmin=0,
+            customdata=f_df.values,
+            colorbar=dict(title="η² (%)"),
+            hovertemplate="<b>%{y}</b><br>%{x}: η² = %{z:.1f}%<br>F = %{customdata:.2f}<extra></extra>"
+        ))
+        fig_eta.update_layout(
+            height=max(400, 22 * len(eta_df) + 80),
+            xaxis=dict(side='top', fixedrange=True),
+            yaxis=dict(autorange="reversed", fixedrange=True),
+            margin=dict(l=0, r=0, t=40, b=0)
+        )
+        st.plotly_chart(fig_eta, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
+        st.caption(f"最も判断を分ける属性: **{axis_rank.index[0]}**（平均 η² {axis_rank.iloc[0]:.1f}%）")
+
+@st.fragment
+@timed("page3.gap_comparison")
+def render_gap_comparison(axis_cubes, raking_cube=None):
+    """2 グループの比較（条件の変更はこのセクションだけを再実行する）"""
+    # デモデータ（実シナリオ活用）
+    demo_df = generate_demo_data()
+
+    # 条件設定エリア
+    with st.container(border=True):
+        st.markdown("##### 🛠️ 比較条件の設定")
+        c1, c2, c3 = st.columns(3)
     
-    with c1:
-        target_axis = st.selectbox("① 比較する軸 (切り口)", list(axis_map.keys()), format_func=lambda x: axis_map[x])
-        # 実データとデモデータの属性値を統合
-        if target_axis in df.columns:
-            real_vals = set([str(x) for x in df[target_axis].dropna().unique() if x])
-            demo_vals = set([str(x) for x in demo_df[target_axis].dropna().unique() if x])
+        with c1:
+            target_axis = st.selectbox("① 比較する軸 (切り口)", list(axis_map.keys()), format_func=lambda x: axis_map[x])
+            # 集計キューブ（実データ）とデモデータの属性値を統合
+            gap_cube = axis_cubes.get(target_axis) if axis_cubes else None
+            real_vals = set([x for x in gap_cube.levels[target_axis] if x and x != "不明"]) if gap_cube is not None else set()
+            demo_vals = set([str(x) for x in demo_df[target_axis].dropna().unique() if x]) if target_axis in demo_df.columns else set()
             u_vals = sorted(list(real_vals | demo_vals))  # 和集合
-        else:
-            u_vals = []
         
-    with c2:
-        group_a = st.selectbox("② 比較対象 A", u_vals, index=0 if u_vals else None)
+        with c2:
+            group_a = st.selectbox("② 比較対象 A", u_vals, index=0 if u_vals else None)
         
-    with c3:
-        group_b = st.selectbox("③ 比較対象 B", u_vals, index=1 if len(u_vals)>1 else 0)
-
-st.caption("💡 グラフの点をホバー/タップすると、シナリオの全文が表示されます。")
-
-# グラフ描画エリア
-if group_a and group_b and group_a != group_b:
-    # 実データから取得（存在しない場合はデモデータで補完）
-    df_a = df[df[target_axis].astype(str) == group_a]
-    df_b = df[df[target_axis].astype(str) == group_b]
-    
-    # データが不足している場合はデモデータで補完
-    used_demo_a = False
-    used_demo_b = False
+        with c3:
+            group_b = st.selectbox("③ 比較対象 B", u_vals, index=1 if len(u_vals)>1 else 0)
+
+    # 重み付け集計はレイキングの軸（年代・性別・役職・業界）で比較するときだけ適用できる
+    gap_weighted = raking_cube is not None and target_axis in raking_cube.axes
+    if gap_weighted:
+        st.caption("⚖️ 重み付け集計: 各グループの平均は、グループ内の他の属性の構成を母集団に補正した値です。")
+    elif raking_cube is not None:
+        st.warning(f"⚖️ {axis_map[target_axis]}はレイキングの軸ではないため、この比較には重み付けを適用できません。重み付けなしの回答者数で集計しています。")
+    st.caption("💡 グラフの点をホバー/タップすると、シナリオの全文が表示されます。")
+
+    def group_means(group):
+        """
+        グループのシナリオ別平均スコア（集計キューブのヒストグラムから算出）
+        実データにないグループはデモデータで補完します。
+
+        Returns:
+            tuple: (pd.Series scenario_id → 平均, デモデータ使用フラグ)
+        """
+        if gap_weighted and group in raking_cube.levels[target_axis]:
+            counts, _ = get_scenario_counts(weighted=True, cube=raking_cube, filters={target_axis: group})
+            means, _ = mean_std(counts)
+            return pd.Series(means, index=raking_cube.scenario_ids.astype(int)).dropna(), False
+        if gap_cube is not None and group in real_vals:
+            means, _ = mean_std(gap_cube.select(**{target_axis: group}).counts)
+            return pd.Series(means, index=gap_cube.scenario_ids.astype(int)).dropna(), False
+        d = demo_df[demo_df[target_axis].astype(str) == group]
+        return d.groupby(d['scenario_id'].astype(int))['rating'].mean(), True
+
+    # グラフ描画エリア
+    if group_a and group_b and group_a != group_b:
+        sc_a, used_demo_a = group_means(group_a)
+        sc_b, used_demo_b = group_means(group_b)
     
-    if df_a.empty:
-        df_a = demo_df[demo_df[target_axis].astype(str) == group_a]
-        used_demo_a = True
-    
-    if df_b.empty:
-        df_b = demo_df[demo_df[target_axis].astype(str) == group_b]
-        used_demo_b = True
-    
-    if not df_a.empty and not df_b.empty:
-        # 補完情報を表示
-        if used_demo_a or used_demo_b:
-            補完情報 = []
-            if used_demo_a:
-                補完情報.append(f"**{group_a}**")
-            if used_demo_b:
-                補完情報.append(f"**{group_b}**")
-            st.caption(f"💻 {' と '.join(補完情報)} のデータはデモデータで補完されています")
+        if not sc_a.empty and not sc_b.empty:
+            # 補完情報を表示
+            if used_demo_a or used_demo_b:
+                補完情報 = []
+                if used_demo_a:
+                    補完情報.append(f"**{group_a}**")
+                if used_demo_b:
+                    補完情報.append(f"**{group_b}**")
+                st.caption(f"💻 {' と '.join(補完情報)} のデータはデモデータで補完されています")
         
-        # グルーピング前に必要なカラムの確認
-        required_cols = ['title', 'text', 'rating']
-        if all(col in df_a.columns for col in required_cols) and all(col in df_b.columns for col in required_cols):
-            # scenario_idが存在する場合はそれを使用、なければtitleとtextで
-            if 'scenario_id' in df_a.columns and 'scenario_id' in df_b.columns:
-                sc_a = df_a.groupby('scenario_id').agg({'rating': 'mean', 'title': 'first', 'text': 'first'})
-                sc_b = df_b.groupby('scenario_id').agg({'rating': 'mean', 'title': 'first', 'text': 'first'})
-                
-                # scenario_idでマージ（両方に存在するものだけ）
-                diff = pd.merge(sc_a, sc_b, left_index=True, right_index=True, suffixes=('_a', '_b'))
-                if not diff.empty:
-                    diff['gap'] = (diff['rating_b'] - diff['rating_a']).abs()
-                    diff = diff.rename(columns={'rating_a': 'a', 'rating_b': 'b', 'title_a': 'title', 'text_a': 'text'})
-                    top = diff.sort_values('gap', ascending=False).head(10).reset_index()
-                else:
-                    top = None
+            # scenario_idで結合（両方に存在するものだけ）
+            diff = pd.concat([sc_a, sc_b], axis=1, keys=['a', 'b'], join='inner')
+            diff = diff.join(scenario_catalog[['title', hover_column(is_mobile)]].rename(columns={hover_column(is_mobile): 'hover_text'}), how='inner')
+            if not diff.empty:
+                diff['gap'] = (diff['b'] - diff['a']).abs()
+                top = diff.sort_values('gap', ascending=False).head(10).reset_index()
             else:
-                # フォールバック：titleとtextでグループ化
-                sc_a = df_a.groupby(['title', 'text'])['rating'].mean()
-                sc_b = df_b.groupby(['title', 'text'])['rating'].mean()
-                
-                diff = pd.concat([sc_a, sc_b], axis=1, keys=['a', 'b']).reset_index()
-                # NaNを含む行を削除（両方のグループにデータがある行のみ残す）
-                diff = diff.dropna(subset=['a', 'b'])
-                
-                if not diff.empty:
-                    diff['gap'] = (diff['b'] - diff['a']).abs()
-                    top = diff.sort_values('gap', ascending=False).head(10)
-                else:
-                    top = None
-        else:
-            st.error(f"⚠️ データの構造が不正です。必要なカラム {required_cols} が見つかりません。")
-            top = None
+                top = None
         
         
         
-        if top is not None and not top.empty:
-            top['hover_text'] = top['text'].apply(lambda x: format_hover_text(x, wrap_w))
-            
-            fig_d = go.Figure()
-            for i, row in top.iterrows():
-                fig_d.add_trace(go.Scatter(
-                    x=[row['a'], row['b']], y=[row['title'], row['title']], 
-                    mode='lines', line=dict(color='#bdc3c7'), showlegend=False,
-                    hoverinfo='skip'
-                ))
-                fig_d.add_trace(go.Scatter(
-                    x=[row['a']], y=[row['title']], mode='markers', name=group_a, 
-                    marker=dict(color='#3498db', size=14), showlegend=(i==0), cliponaxis=False,
-                    customdata=[row['hover_text']],
-                    text=[row['title']],
-                    hovertemplate="%{text}<br><br>%{customdata}<br><br><b>" + group_a + ":</b> %{x:.2f}<extra></extra>"
-                ))
-                fig_d.add_trace(go.Scatter(
-                    x=[row['b']], y=[row['title']], mode='markers', name=group_b, 
-                    marker=dict(color='#e74c3c', size=14), showlegend=(i==0), cliponaxis=False,
-                    customdata=[row['hover_text']],
-                    text=[row['title']],
-                    hovertemplate="%{text}<br><br>%{customdata}<br><br><b>" + group_b + ":</b> %{x:.2f}<extra></extra>"
-                ))
+            if top is not None and not top.empty:
+                def build_gap_figure():
+                    # 接続線は None 区切りで 1 トレース、各グループの点も 1 トレースずつにまとめる
+                    trace_class = scatter_trace_class(3 * len(top))
+                    marker_opts = {} if trace_class is go.Scattergl else dict(cliponaxis=False)
+                    fig_d = go.Figure()
+                    fig_d.add_trace(trace_class(
+                        x=[v for a, b in zip(top['a'], top['b']) for v in (a, b, None)],
+                        y=[v for t in top['title'] for v in (t, t, None)],
+                        mode='lines', line=dict(color='#bdc3c7'), showlegend=False,
+                        hoverinfo='skip'
+                    ))
+                    for col, name, color in [('a', group_a, '#3498db'), ('b', group_b, '#e74c3c')]:
+                        fig_d.add_trace(trace_class(
+                            x=top[col], y=top['title'], mode='markers', name=name,
+                            marker=dict(color=color, size=14), showlegend=True, **marker_opts,
+                            customdata=top['hover_text'],
+                            text=top['title'],
+                            hovertemplate="%{text}<br><br>%{customdata}<br><br><b>" + name + ":</b> %{x:.2f}<extra></extra>"
+                        ))
                 
-            # X軸レンジは1〜6をベースに、マーカーのはみ出し防止で少し余白を追加
-            fig_d.update_xaxes(range=[0.9, 6.1], dtick=1)
-
-            fig_d.update_layout(
-                title=f"認識ギャップ 大きい順 TOP10 ({group_a} vs {group_b})",
-                height=560 if is_mobile else 500, 
-                legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5, font=dict(size=9 if is_mobile else 10)),
-                xaxis=dict(title=dict(text=("ハラスメント評価" if is_mobile else "ハラスメント評価 (右に行くほど厳しい)"), standoff=10), fixedrange=True),
-                yaxis=dict(autorange="reversed", fixedrange=True),
-                margin=dict(l=16, r=32 if is_mobile else 16, t=36 if is_mobile else 36, b=120 if is_mobile else 90),
-                hoverlabel=dict(font_size=hover_font_size)
-            )
-            st.plotly_chart(
-                fig_d,
-                use_container_width=True,
-                config=(
-                    {"displayModeBar": False, "scrollZoom": False, "modeBarButtonsToRemove": ["zoom2d", "zoomIn2d", "zoomOut2d", "autoScale2d", "resetScale2d"]}
-                    if is_mobile else None
+                    # X軸レンジは1〜6をベースに、マーカーのはみ出し防止で少し余白を追加
+                    fig_d.update_xaxes(range=[0.9, 6.1], dtick=1)
+
+                    fig_d.update_layout(
+                        title=f"認識ギャップ 大きい順 TOP10 ({group_a} vs {group_b})",
+                        height=560 if is_mobile else 500, 
+                        legend=dict(orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5, font=dict(size=9 if is_mobile else 10)),
+                        xaxis=dict(title=dict(text=("ハラスメント評価" if is_mobile else "ハラスメント評価 (右に行くほど厳しい)"), standoff=10), fixedrange=True),
+                        yaxis=dict(autorange="reversed", fixedrange=True),
+                        margin=dict(l=16, r=32 if is_mobile else 16, t=36 if is_mobile else 36, b=120 if is_mobile else 90),
+                        hoverlabel=dict(font_size=hover_font_size)
+                    )
+                    return fig_d
+
+                fig_d = cached_figure(("gap", data_version, target_axis, group_a, group_b, gap_weighted, is_mobile), build_gap_figure)
+                st.plotly_chart(
+                    fig_d,
+                    use_container_width=True,
+                    config=(
+                        {"displayModeBar": False, "scrollZoom": False, "modeBarButtonsToRemove": ["zoom2d", "zoomIn2d", "zoomOut2d", "autoScale2d", "resetScale2d"]}
+                        if is_mobile else None
+                    )
                 )
-            )
-        else:
-            st.warning("比較対象のシナリオが見つかりませんでした。別の属性を選択してみてください。")
+            else:
+                st.warning("比較対象のシナリオが見つかりませんでした。別の属性を選択してみてください。")
         
+        else:
+            st.warning("選択されたグループのデータが不足しています。")
     else:
-        st.warning("選択されたグループのデータが不足しています。")
+        st.info("👆 上記の条件を設定して、異なる2つのグループを比較してください。")
+
+render_gap_comparison(axis_cubes, raking_cube)
+
+# ------------------------------------------
+# 認識プロファイルの構成
+# ------------------------------------------
+st.markdown("---")
+st.subheader("🧭 認識プロファイルの構成")
+st.markdown("回答パターンの似た人同士を「認識プロファイル」に分類し、属性ごとの構成比を比較します。")
+
+@st.fragment
+@timed("page3.profile_composition")
+def render_profile_composition(profile_model, reservoir):
+    """認識プロファイルの構成（軸の切り替えはこのセクションだけを再実行する）"""
+    if profile_model is None:
+        st.info("プロファイルを算出するためのデータが不足しています。")
+    else:
+        profile_axis = st.selectbox("比較する軸", [a for a in axis_map if reservoir.segments(a)], format_func=lambda x: axis_map[x], key="profile_axis")
+        profile_names = [profile_name(j, profile_model.k) for j in range(profile_model.k)]
+        # 水準ごとの抽出サンプル（最大 RESERVOIR_CAPACITY 人）に割り当て、人数は抽出率で拡大推定する
+        profile_rows = {}
+        for level in reservoir.segments(profile_axis):
+            sample = reservoir.sample((profile_axis, level))
+            if len(sample):
+                share = np.bincount(profile_model.predict(sample), minlength=profile_model.k) / len(sample)
+                profile_rows[level] = share * reservoir.seen[(profile_axis, level)]
+        profile_ct = pd.DataFrame.from_dict(profile_rows, orient='index', columns=profile_names).round().astype(int)
+        profile_share = profile_ct.div(profile_ct.sum(axis=1), axis=0) * 100
+
+        fig_prof = go.Figure()
+        profile_colors = ['#fd7e14', '#ffc107', '#0d6efd', '#6f42c1']
+        for j, name in enumerate(profile_names):
+            fig_prof.add_trace(go.Bar(
+                y=profile_share.index, x=profile_share[name], name=name, orientation='h',
+                marker_color=profile_colors[j % len(profile_colors)],
+                customdata=profile_ct[name],
+                hovertemplate="<b>%{y}</b><br>" + name + ": %{x:.1f}% (%{customdata:,}人)<extra></extra>"
+            ))
+        fig_prof.update_layout(
+            barmode='stack',
+            height=max(260, 40 * len(profile_share) + 120),
+            xaxis=dict(title="構成比 (%)", range=[0, 100], fixedrange=True),
+            yaxis=dict(title=None, fixedrange=True),
+            margin=dict(l=0, r=0, t=10, b=0),
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, font=dict(size=9 if is_mobile else 10))
+        )
+        st.plotly_chart(fig_prof, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
+        profile_sampled = sum(reservoir.filled[(profile_axis, lv)] for lv in profile_rows)
+        profile_total = sum(reservoir.seen[(profile_axis, lv)] for lv in profile_rows)
+        st.caption(
+            f"対象: {profile_total:,}人" + ("（デモデータ）" if population_is_demo else "")
+            + (f" / 各グループ最大{reservoir.capacity:,}人（計{profile_sampled:,}人）の無作為抽出から推定" if profile_sampled < profile_total else "")
+        )
+
+if snapshot is not None:
+    render_profile_composition(snapshot.profile_model, snapshot.reservoir)
+elif sketch_store is not None:
+    # 回答者ごとのプロファイル推定には評価行列が必要なため、近似集計モードでは表示しない
+    st.info("近似集計モードでは認識プロファイルの構成は表示されません（集計スナップショットモードで表示できます）。")
+else:
+    render_profile_composition(get_profile_model(), get_reservoir())
+
+# ------------------------------------------
+# シナリオ間の相関
+# ------------------------------------------
+st.markdown("---")
+st.subheader("🔗 シナリオ間の相関")
+st.markdown("同じ人が**一貫した評価をしているシナリオの組み合わせ**を相関係数で示します。似た相関パターンのシナリオが隣り合うように並べ替えています。")
+
+if snapshot is not None:
+    cross_moments, moment_ids = snapshot.cross_moments, snapshot.scenario_ids
+elif sketch_store is not None:
+    cross_moments, moment_ids = sketch_store.cross_moments, sketch_store.scenario_ids
+else:
+    cross_moments, moment_ids = get_cross_moments(), load_population().scenario_ids
+corr = cross_moments.correlation()
+if corr.size == 0 or np.isnan(corr).all():
+    st.info("データが不足しています")
 else:
-    st.info("👆 上記の条件を設定して、異なる2つのグループを比較してください。")
+    def build():
+        # 並べ替え（階層クラスタリング）も図と一緒にデータバージョンごとに 1 回だけ行う
+        corr_order = hierarchical_order(corr)
+        corr_ids = moment_ids[corr_order]
+        corr_titles = [scenario_catalog['title'].get(int(sid), f"シナリオ{sid}") for sid in corr_ids]
+        corr_cats = [scenario_catalog['category'].get(int(sid), "") for sid in corr_ids]
+        corr_sorted = corr[np.ix_(corr_order, corr_order)]
+
+        fig_corr = go.Figure(go.Heatmap(
+            z=corr_sorted, x=corr_titles, y=corr_titles,
+            zmin=-1, zmax=1, colorscale='RdBu_r',
+            customdata=np.array([[f"{a} × {b}" for b in corr_cats] for a in corr_cats]),
+            colorbar=dict(title="相関係数"),
+            hovertemplate="<b>%{y}</b><br><b>%{x}</b><br>%{customdata}<br>r = %{z:.2f}<extra></extra>"
+        ))
+        fig_corr.update_layout(
+            height=700 if is_mobile else 760,
+            xaxis=dict(showticklabels=not is_mobile, tickangle=-60, fixedrange=True),
+            yaxis=dict(autorange="reversed", showticklabels=not is_mobile, fixedrange=True),
+            margin=dict(l=0, r=0, t=10, b=0)
+        )
+        return fig_corr
+    fig_corr = cached_figure(("corr_heatmap", data_version, is_mobile), build)
+    st.plotly_chart(fig_corr, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
 
 # ==========================================
 # 3. 全シナリオ詳細データ (Bottom)
@@ -528,19 +765,32 @@ else:
 st.markdown("---")
 st.subheader("📚 全シナリオ詳細データ")
 
-def get_mode(x):
-    m = x.mode()
-    return m.iloc[0] if not m.empty else np.nan
-
-detail_stats = df.groupby(['scenario_id', 'title', 'category', 'type', 'text']).agg(
-    avg=('rating', 'mean'),
-    median=('rating', 'median'),
-    mode=('rating', get_mode),
-    std=('rating', 'std'),
-    count=('rating', 'count')
-).reset_index()
-
-tab_chart, tab_table = st.tabs(["📊 分布可視化チャート", "📋 統計データ一覧"])
+# シナリオ × 評価ヒストグラム 1 枚（集計キューブ、近似集計モードではスケッチ）から
+# 平均・中央値・最頻値・SD・N をまとめて求める
+# 集計スナップショットモードではワーカーが算出済みの値をそのまま使う
+if aggregate_mode == "snapshot":
+    detail_hist_stats = snapshot.scenario_stats
+elif aggregate_mode == "sketch":
+    detail_hist_stats = scenario_summary(agg_scenario_ids, scenario_counts)
+else:
+    detail_hist_stats = scenario_summary(agg_scenario_ids, get_scenario_counts(weighted=False)[0])
+detail_stats = (
+    scenario_catalog[['title', 'category', 'type', 'text']]
+    .join(detail_hist_stats[detail_hist_stats['count'] > 0], how='inner')
+    .reset_index()
+)
+
+# 重み付け集計時は平均・標準偏差をウェイト付きヒストグラムの値に置き換える
+if use_weights:
+    w_mean, w_std = mean_std(scenario_counts)
+    weighted_stats = pd.DataFrame({'scenario_id': agg_scenario_ids.astype(int), 'w_avg': w_mean, 'w_std': w_std})
+    detail_stats = detail_stats.merge(weighted_stats, on='scenario_id', how='left')
+    detail_stats['avg'] = detail_stats['w_avg'].fillna(detail_stats['avg'])
+    detail_stats['std'] = detail_stats['w_std'].fillna(detail_stats['std'])
+    detail_stats = detail_stats.drop(columns=['w_avg', 'w_std'])
+    st.caption("⚖️ 重み付け集計: 平均・認識の割れ具合(SD)は母集団の属性構成に補正した値です。")
+
+tab_chart, tab_table, tab_quality = st.tabs(["📊 分布可視化チャート", "📋 統計データ一覧", "🧪 設問の品質"])
 
 # Tab 1: 二極分散グラフ
 with tab_chart:
@@ -554,58 +804,53 @@ with tab_chart:
         4: "どちらかと言えば感じる", 5: "かなり感じる", 6: "強く感じる"
     }
 
-    score_counts = df.groupby(['title', 'rating']).size().reset_index(name='count')
-    total_counts = df.groupby('title').size().reset_index(name='total')
-    score_pct = pd.merge(score_counts, total_counts, on='title')
-    score_pct['pct'] = score_pct['count'] / score_pct['total'] * 100
+    def build_diverging_figure():
+        # シナリオ × 評価ヒストグラムから回答割合を算出（重み付け集計時はウェイト付き）
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pct_matrix = scenario_counts / scenario_counts.sum(axis=1, keepdims=True) * 100
+        # 平均スコアの昇順に並べ、表示用の文字列はシナリオ ID で表示テーブルから引く
+        order = detail_stats.sort_values('avg', ascending=True)['scenario_id'].astype(int).to_numpy()
+        score_pct = pd.DataFrame(np.nan_to_num(pct_matrix), index=agg_scenario_ids.astype(int), columns=range(1, 7)).reindex(order).fillna(0)
+        titles = scenario_catalog['title'].reindex(order).to_numpy()
+        hover_texts = scenario_catalog[hover_column(is_mobile, compact=True)].reindex(order).fillna('').to_numpy()
+
+        fig_div = go.Figure()
     
-    titles = detail_stats.sort_values('avg', ascending=True)['title'].tolist()
-    title_text_map = detail_stats.set_index('title')['text'].to_dict()
-
-    fig_div = go.Figure()
+        colors_neg = ['#2E86C1', '#5DADE2', '#AED6F1'] 
+        for i, r in enumerate([1, 2, 3]):
+            fig_div.add_trace(go.Bar(
+                y=titles, x=-score_pct[r],
+                name=f'{r}: {options_map[r]}', 
+                orientation='h', 
+                marker_color=colors_neg[i], 
+                customdata=np.column_stack([score_pct[r], hover_texts]),
+                hovertemplate="%{y}<br><br>%{customdata[1]}<br><br><b>回答割合:</b> %{customdata[0]:.1f}%<extra></extra>"
+            ))
+
+        colors_pos = ['#F5B7B1', '#EC7063', '#C0392B'] 
+        for i, r in enumerate([4, 5, 6]):
+            fig_div.add_trace(go.Bar(
+                y=titles, x=score_pct[r],
+                name=f'{r}: {options_map[r]}', 
+                orientation='h', 
+                marker_color=colors_pos[i], 
+                customdata=np.column_stack([score_pct[r], hover_texts]),
+                hovertemplate="%{y}<br><br>%{customdata[1]}<br><br><b>回答割合:</b> %{customdata[0]:.1f}%<extra></extra>"
+            ))
     
-    colors_neg = ['#2E86C1', '#5DADE2', '#AED6F1'] 
-    for i, r in enumerate([1, 2, 3]):
-        d = score_pct[score_pct['rating'] == r]
-        d_merged = pd.DataFrame({'title': titles}).merge(d, on='title', how='left').fillna(0)
-        d_merged['text'] = d_merged['title'].map(title_text_map).fillna('')
-        d_merged['hover_text'] = d_merged['text'].apply(lambda x: format_hover_compact(x, wrap_w, is_mobile))
-
-        fig_div.add_trace(go.Bar(
-            y=d_merged['title'], x=-d_merged['pct'],
-            name=f'{r}: {options_map[r]}', 
-            orientation='h', 
-            marker_color=colors_neg[i], 
-            customdata=d_merged[['pct', 'hover_text']],
-            hovertemplate="%{y}<br><br>%{customdata[1]}<br><br><b>回答割合:</b> %{customdata[0]:.1f}%<extra></extra>"
-        ))
+        fig_div.update_layout(
+            barmode='relative', 
+            height=700 if is_mobile else 800,
+            xaxis=dict(title="回答割合 (%)", tickvals=[-100, -50, 0, 50, 100], ticktext=['100%', '50%', '0', '50%', '100%'], fixedrange=True),
+            yaxis=dict(title="", fixedrange=True),
+            legend=dict(orientation='h', yanchor="bottom", y=-0.35 if is_mobile else -0.3, x=0.0, xanchor='left', font=dict(size=9 if is_mobile else 10)),
+            margin=dict(l=0, r=0, t=10 if is_mobile else 80, b=170 if is_mobile else 150),
+            hoverlabel=dict(font_size=hover_font_size)
+        )
+        fig_div.add_vline(x=0, line_width=1, line_color="black")
+        return fig_div
 
-    colors_pos = ['#F5B7B1', '#EC7063', '#C0392B'] 
-    for i, r in enumerate([4, 5, 6]):
-        d = score_pct[score_pct['rating'] == r]
-        d_merged = pd.DataFrame({'title': titles}).merge(d, on='title', how='left').fillna(0)
-        d_merged['text'] = d_merged['title'].map(title_text_map).fillna('')
-        d_merged['hover_text'] = d_merged['text'].apply(lambda x: format_hover_compact(x, wrap_w, is_mobile))
-
-        fig_div.add_trace(go.Bar(
-            y=d_merged['title'], x=d_merged['pct'],
-            name=f'{r}: {options_map[r]}', 
-            orientation='h', 
-            marker_color=colors_pos[i], 
-            customdata=d_merged[['pct', 'hover_text']],
-            hovertemplate="%{y}<br><br>%{customdata[1]}<br><br><b>回答割合:</b> %{customdata[0]:.1f}%<extra></extra>"
-        ))
-    
-    fig_div.update_layout(
-        barmode='relative', 
-        height=700 if is_mobile else 800,
-        xaxis=dict(title="回答割合 (%)", tickvals=[-100, -50, 0, 50, 100], ticktext=['100%', '50%', '0', '50%', '100%'], fixedrange=True),
-        yaxis=dict(title="", fixedrange=True),
-        legend=dict(orientation='h', yanchor="bottom", y=-0.35 if is_mobile else -0.3, x=0.0, xanchor='left', font=dict(size=9 if is_mobile else 10)),
-        margin=dict(l=0, r=0, t=10 if is_mobile else 80, b=170 if is_mobile else 150),
-        hoverlabel=dict(font_size=hover_font_size)
-    )
-    fig_div.add_vline(x=0, line_width=1, line_color="black")
+    fig_div = cached_figure(("diverging", data_version, use_weights, is_mobile), build_diverging_figure)
     st.plotly_chart(fig_div, use_container_width=True, config={"displayModeBar": False} if is_mobile else None)
 
 # Tab 2: 統計データテーブル
@@ -620,9 +865,10 @@ with tab_table:
     cols = ['ID', 'シナリオ名', 'シナリオ本文', 'カテゴリ', '法的定義', '平均', '中央値', '最頻値', '認識の割れ具合(SD)', 'N']
     display_df = display_df[cols]
     
+    display_style = background_gradient(display_df.style, 'Oranges', ['認識の割れ具合(SD)'])
+    display_style = background_gradient(display_style, 'RdBu_r', ['平均'], vmin=1, vmax=6)
     st.dataframe(
-        display_df.style.background_gradient(cmap='Oranges', subset=['認識の割れ具合(SD)'])
-                .background_gradient(cmap='RdBu_r', subset=['平均'], vmin=1, vmax=6)
+        display_style
                 .format("{:.2f}", subset=['平均', '認識の割れ具合(SD)'])
                 .format("{:.0f}", subset=['中央値', '最頻値', 'N']),
         use_container_width=True, height=600, hide_index=True,
@@ -631,6 +877,49 @@ with tab_table:
         }
     )
 
+# Tab 3: 設問の品質（項目分析）
+with tab_quality:
+    item_quality, scale_alpha = get_item_quality(snapshot or sketch_store)
+    if item_quality.empty:
+        st.info("データが不足しています")
+    else:
+        st.markdown("""
+        **設問の品質**: 各シナリオが「ハラスメントへの感じ方の厳しさ」をどの程度うまく測れているかを示します。
+        項目-合計相関や識別力が低いシナリオは、他のシナリオと異なる観点で判断されている可能性があります。
+        """)
+        q1, q2 = st.columns(2)
+        q1.metric("尺度の信頼性 (Cronbach の α)", f"{scale_alpha:.2f}", help="0.7 以上でおおむね十分、0.8 以上で高いとされます")
+        q2.metric("項目-合計相関が 0.2 未満のシナリオ", f"{int((item_quality['item_total_r'] < 0.2).sum())}件")
+
+        quality_cols = {
+            'item_total_r': '項目-合計相関', 'alpha_if_deleted': '除いたときのα', 'discrimination': '識別力',
+            'location': '位置', 'difficulty': '難易度', 'n_responses': 'N',
+        }
+        quality_df = (
+            scenario_catalog[['title', 'category', 'type']]
+            .join(item_quality.set_index('scenario_id'), how='inner')
+            .reset_index()
+            .rename(columns={'scenario_id': 'ID', 'title': 'シナリオ名', 'category': 'カテゴリ', 'type': '法的定義', **quality_cols})
+        )
+        quality_df = quality_df[['ID', 'シナリオ名', 'カテゴリ', '法的定義'] + [c for c in quality_cols.values() if c in quality_df.columns]]
+        number_cols = [c for c in ['項目-合計相関', '除いたときのα', '識別力', '位置', '難易度'] if c in quality_df.columns]
+
+        st.dataframe(
+            background_gradient(quality_df.style, 'Greens', [c for c in ['項目-合計相関', '識別力'] if c in quality_df.columns])
+                .format("{:.2f}", subset=number_cols),
+            use_container_width=True, height=600, hide_index=True,
+        )
+        st.caption(
+            "項目-合計相関: そのシナリオを除いた合計との相関 / 除いたときのα: そのシナリオを外した場合の信頼性（全体の α より高ければ尺度の一貫性を下げている）"
+            + (
+                " / 識別力・位置: 段階反応モデルの推定値（位置が大きいほど、厳しい人でないと「ハラスメント」と評価しない）"
+                if 'discrimination' in item_quality.columns
+                else " / 識別力・位置: 項目パラメータの校正（python -m utils.calibrate）後に表示されます"
+            )
+            + " / 難易度: 平均評価を 0〜1 に換算した値"
+            + ("（デモデータ）" if population_is_demo else "")
+        )
+
 # ==========================================
 # 4. ユーザーアンケートへの誘導
 # ==========================================
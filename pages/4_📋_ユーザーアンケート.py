@@ -1,9 +1,13 @@
 import streamlit as st
 from utils.db import save_feedback, check_feedback_status, supabase
+from utils.session import init_session
 
 # ページ設定
 st.set_page_config(page_title="ユーザーアンケート", page_icon="📋", layout="centered")
 
+# セッション初期化（別のレプリカに再接続した場合も user_id を復元する）
+init_session()
+
 st.title("📋 ユーザーアンケート")
 st.markdown("""
 本システムの有効性を検証するための**研究用アンケート**です。  
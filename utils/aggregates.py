@@ -0,0 +1,426 @@
+"""
+集計レイヤー（属性セグメント × シナリオ × 評価 1〜6 のヒストグラム）
+
+回答の生データを毎回走査する代わりに、セグメントごとの 6 段階ヒストグラムを
+一度だけ作り、件数・合計・二乗和などの十分統計量はそこから導出します。
+Streamlit に依存しないため、ベンチマークやバッチ処理からも利用できます。
+"""
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+N_BINS = 6  # 評価 1〜6
+RATINGS = np.arange(1, N_BINS + 1, dtype=np.float64)
+
+
+@dataclass
+class HistogramCube:
+    """
+    属性軸ごとのセグメント × シナリオ × 評価のヒストグラム
+
+    counts の形状は (各軸の水準数..., シナリオ数, 6)、
+    users はセル（属性の組み合わせ）ごとの回答者数です。
+    """
+    axes: list
+    levels: dict
+    scenario_ids: np.ndarray
+    counts: np.ndarray
+    users: np.ndarray
+
+    def marginal(self, keep_axes=()):
+        """指定した軸以外を合算したキューブを返す"""
+        keep_axes = list(keep_axes)
+        drop = tuple(i for i, a in enumerate(self.axes) if a not in keep_axes)
+        return HistogramCube(
+            axes=[a for a in self.axes if a in keep_axes],
+            levels={a: self.levels[a] for a in keep_axes},
+            scenario_ids=self.scenario_ids,
+            counts=self.counts.sum(axis=drop),
+            users=self.users.sum(axis=drop),
+        )
+
+    def select(self, **filters):
+        """軸の水準で絞り込み、その軸を合算したキューブを返す（存在しない水準は 0 件）"""
+        counts, users = self.counts, self.users
+        axes = list(self.axes)
+        for axis, value in filters.items():
+            i = axes.index(axis)
+            levels = self.levels[axis]
+            if value in levels:
+                j = levels.index(value)
+                counts, users = np.take(counts, j, axis=i), np.take(users, j, axis=i)
+            else:
+                counts = np.zeros_like(np.take(counts, 0, axis=i))
+                users = np.zeros_like(np.take(users, 0, axis=i))
+            axes.pop(i)
+        return HistogramCube(
+            axes=axes, levels={a: self.levels[a] for a in axes},
+            scenario_ids=self.scenario_ids, counts=counts, users=users,
+        )
+
+
+    def add(self, x, cell):
+        """
+        回答者 1 人の回答ベクトル x（シナリオ順、未回答は NaN）を属性 cell {軸: 水準} のセルに加える
+        キューブにない水準なら何もせず False を返す（キューブを作り直したときに反映される）
+        """
+        index = []
+        for axis in self.axes:
+            level = cell.get(axis)
+            level = "不明" if level is None else str(level)
+            if level not in self.levels[axis]:
+                return False
+            index.append(self.levels[axis].index(level))
+        index = tuple(index)
+        x = np.asarray(x, dtype=np.float64)
+        s_idx = np.flatnonzero(~np.isnan(x))
+        r_idx = np.clip(x[s_idx].astype(np.int64), 1, N_BINS) - 1
+        with _CUBE_LOCK:
+            np.add.at(self.counts[index], (s_idx, r_idx), 1)
+            self.users[index] += 1
+        return True
+
+
+# キューブへの逐次加算（回答送信ごと）を直列化するロック
+_CUBE_LOCK = threading.Lock()
+
+
+def build_cube(X, attrs, axes, scenario_ids, chunk_size=200_000):
+    """
+    評価行列 X (ユーザー × シナリオ、未回答は NaN) と属性からヒストグラムキューブを作る
+    bincount によるベクトル化集計を、メモリを抑えるためユーザーのチャンク単位で行います。
+
+    Returns:
+        HistogramCube
+    """
+    axes = list(axes)
+    n_scenarios = X.shape[1]
+    levels, codes = {}, []
+    for axis in axes:
+        col = attrs[axis].fillna("不明").astype(str) if axis in attrs.columns else pd.Series("不明", index=attrs.index)
+        cat = pd.Categorical(col)
+        levels[axis] = list(cat.categories)
+        codes.append(np.asarray(cat.codes, dtype=np.int64))
+    shape = tuple(len(levels[a]) for a in axes)
+    n_cells = int(np.prod(shape)) if shape else 1
+    cell_of_user = np.ravel_multi_index(codes, shape) if axes else np.zeros(len(X), dtype=np.int64)
+
+    counts = np.zeros(n_cells * n_scenarios * N_BINS, dtype=np.int64)
+    for start in range(0, len(X), chunk_size):
+        block = X[start:start + chunk_size]
+        u_idx, s_idx = np.nonzero(~np.isnan(block))
+        r_idx = np.clip(block[u_idx, s_idx].astype(np.int64), 1, N_BINS) - 1
+        flat = (cell_of_user[start + u_idx] * n_scenarios + s_idx) * N_BINS + r_idx
+        counts += np.bincount(flat, minlength=counts.size)
+
+    users = np.bincount(cell_of_user, minlength=n_cells)
+    return HistogramCube(
+        axes=axes, levels=levels, scenario_ids=np.asarray(scenario_ids),
+        counts=counts.reshape(shape + (n_scenarios, N_BINS)), users=users.reshape(shape),
+    )
+
+
+def rating_crosstab(scenario_col, ratings):
+    """
+    縦持ちの回答 (scenario_id, rating) をシナリオ × 評価のヒストグラムにする（1 回の bincount）
+
+    Returns:
+        tuple: (scenario_ids (S,), counts (S, 6))
+    """
+    scenario_col = np.asarray(scenario_col)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    valid = ~np.isnan(ratings)
+    scenario_ids, s_idx = np.unique(scenario_col[valid].astype(np.int64), return_inverse=True)
+    r_idx = np.clip(ratings[valid].astype(np.int64), 1, N_BINS) - 1
+    counts = np.bincount(s_idx * N_BINS + r_idx, minlength=len(scenario_ids) * N_BINS)
+    return scenario_ids, counts.reshape(len(scenario_ids), N_BINS)
+
+
+# -------------------------------------------------------
+# ヒストグラムから導く統計量
+# -------------------------------------------------------
+def moments(counts):
+    """
+    6 段階ヒストグラム (..., 6) から件数・合計・二乗和を求める
+
+    Returns:
+        tuple: (n, sum, sumsq) いずれも形状 (...)
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    return counts.sum(axis=-1), counts @ RATINGS, counts @ (RATINGS ** 2)
+
+
+def mean_std(counts):
+    """ヒストグラムから平均と標準偏差（不偏, ddof=1）を求める。件数不足は NaN"""
+    n, s1, s2 = moments(counts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(n > 0, s1 / n, np.nan)
+        var = np.where(n > 1, (s2 - s1 ** 2 / np.where(n > 0, n, 1)) / (n - 1), np.nan)
+    return mean, np.sqrt(np.maximum(var, 0.0))
+
+
+def histogram_mode(counts):
+    """最頻値（同数なら小さい評価）。件数 0 は NaN"""
+    counts = np.asarray(counts, dtype=np.float64)
+    return np.where(counts.sum(axis=-1) > 0, counts.argmax(axis=-1) + 1.0, np.nan)
+
+
+def histogram_median(counts):
+    """中央値（偶数件なら中央 2 件の平均）。件数 0 は NaN"""
+    counts = np.asarray(counts, dtype=np.float64)
+    cum = np.cumsum(counts, axis=-1)
+    n = cum[..., -1]
+    lo = (cum > np.floor((n - 1) / 2)[..., None]).argmax(axis=-1) + 1.0
+    hi = (cum > np.floor(n / 2)[..., None]).argmax(axis=-1) + 1.0
+    return np.where(n > 0, (lo + hi) / 2, np.nan)
+
+
+def scenario_summary(scenario_ids, counts):
+    """
+    シナリオ × 評価のヒストグラム (S, 6) からシナリオ別の平均・中央値・最頻値・SD・N をまとめて求める
+
+    Returns:
+        pd.DataFrame: index=scenario_id, columns=avg/median/mode/std/count
+    """
+    avg, std = mean_std(counts)
+    return pd.DataFrame({
+        'avg': avg,
+        'median': histogram_median(counts),
+        'mode': histogram_mode(counts),
+        'std': std,
+        'count': np.asarray(counts).sum(axis=1),
+    }, index=pd.Index(np.asarray(scenario_ids).astype(int), name='scenario_id'))
+
+
+def variance_explained(group_counts):
+    """
+    グループ × シナリオのヒストグラム (G, S, 6) から、シナリオごとの
+    群間分散の割合 η² と一元配置分散分析の F 値を求める
+
+    複数軸を水準数の最大値でゼロ埋めして (A, G, S, 6) にまとめれば、
+    全軸 × 全シナリオを一度に計算できます（空のグループは自由度に数えません）。
+
+    Returns:
+        tuple: (eta_sq, f_stat) 形状は group_counts の先頭 2 次元を除いたもの
+    """
+    n, s1, s2 = moments(group_counts)            # (..., G, S)
+    N = n.sum(axis=-2)
+    T = s1.sum(axis=-2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correction = np.where(N > 0, T ** 2 / N, 0.0)
+        ss_total = s2.sum(axis=-2) - correction
+        ss_between = np.where(n > 0, s1 ** 2 / np.where(n > 0, n, 1), 0.0).sum(axis=-2) - correction
+        ss_within = ss_total - ss_between
+        df_between = (n > 0).sum(axis=-2) - 1
+        df_within = N - df_between - 1
+        eta_sq = np.where(ss_total > 0, ss_between / ss_total, np.nan)
+        f_stat = np.where(
+            (df_between > 0) & (df_within > 0) & (ss_within > 0),
+            (ss_between / np.maximum(df_between, 1)) / (ss_within / np.maximum(df_within, 1)),
+            np.nan,
+        )
+    return np.clip(eta_sq, 0.0, 1.0), f_stat
+
+
+def stack_axis_cubes(cubes):
+    """
+    軸ごとのキューブ {axis: HistogramCube(1軸)} を (軸数, 最大水準数, S, 6) にゼロ埋めで積み重ねる
+    """
+    axes = list(cubes)
+    max_levels = max(len(cubes[a].levels[a]) for a in axes)
+    first = cubes[axes[0]].counts
+    stacked = np.zeros((len(axes), max_levels) + first.shape[1:], dtype=first.dtype)
+    for i, a in enumerate(axes):
+        stacked[i, :cubes[a].counts.shape[0]] = cubes[a].counts
+    return axes, stacked
+
+
+# -------------------------------------------------------
+# シナリオ間の相関（累積クロス積）
+# -------------------------------------------------------
+class CrossMoments:
+    """
+    シナリオ対ごとの累積十分統計量
+
+    ペアワイズ（両方に回答した人のみ）で n, Σx, Σx², Σxy を保持するため、
+    回答 1 件の反映も相関行列の算出も回答者数によらず O(シナリオ数²) です。
+    """
+
+    def __init__(self, n_scenarios):
+        shape = (n_scenarios, n_scenarios)
+        self.n = np.zeros(shape)
+        self.sum_x = np.zeros(shape)   # [i, j]: j にも回答した人の x_i の合計
+        self.sum_xx = np.zeros(shape)  # [i, j]: 同じく x_i² の合計
+        self.sum_xy = np.zeros(shape)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_matrix(cls, X, chunk_size=200_000):
+        """評価行列 (ユーザー × シナリオ、未回答は NaN) から初期化する"""
+        moments = cls(X.shape[1])
+        for start in range(0, len(X), chunk_size):
+            moments.update(X[start:start + chunk_size])
+        return moments
+
+    def update(self, X):
+        """新しい回答ベクトル（1 件またはバッチ）を加算する"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        present = (~np.isnan(X)).astype(np.float64)
+        values = np.nan_to_num(X)
+        with self._lock:
+            self.n += present.T @ present
+            self.sum_x += values.T @ present
+            self.sum_xx += (values ** 2).T @ present
+            self.sum_xy += values.T @ values
+
+    def merge(self, other):
+        """別の累積値（他プロセス・他期間）を合算する"""
+        with self._lock:
+            self.n += other.n
+            self.sum_x += other.sum_x
+            self.sum_xx += other.sum_xx
+            self.sum_xy += other.sum_xy
+
+    def covariance(self):
+        """ペアワイズの共分散行列（両方に回答した人で算出。対角は各シナリオの分散、算出できない組は NaN）"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            n = np.where(self.n > 0, self.n, np.nan)
+            return (self.sum_xy - self.sum_x * self.sum_x.T / n) / n
+
+    def correlation(self):
+        """ペアワイズのピアソン相関行列（算出できない組は NaN）"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            n = np.where(self.n > 0, self.n, np.nan)
+            cov = self.sum_xy - self.sum_x * self.sum_x.T / n
+            var_i = self.sum_xx - self.sum_x ** 2 / n
+            corr = cov / np.sqrt(var_i * var_i.T)
+        corr = np.clip(corr, -1.0, 1.0)
+        np.fill_diagonal(corr, 1.0)
+        return corr
+
+
+def hierarchical_order(corr):
+    """
+    相関行列を群平均法の階層クラスタリング（距離 = 1 - r）にかけ、
+    デンドログラムの葉の順序を返す。似たシナリオが隣り合う並びになります。
+
+    クラスタ間距離は併合のたびに Lance-Williams の更新式（大きさで重み付けした平均）で
+    距離行列の 1 行だけを書き換えるため、全体で O(シナリオ数³) の行列演算で済みます。
+    """
+    corr = np.nan_to_num(np.asarray(corr, dtype=np.float64))
+    n = len(corr)
+    if n == 0:
+        return []
+    dist = 1.0 - corr
+    np.fill_diagonal(dist, np.inf)
+    upper = np.triu(np.ones((n, n), dtype=bool), k=1)
+    sizes = np.ones(n)
+    members = {i: [i] for i in range(n)}
+    for _ in range(n - 1):
+        # 番号の小さい組を優先する（同じ距離なら先に見つかった組）
+        a, b = divmod(int(np.argmin(np.where(upper, dist, np.inf))), n)
+        merged = (sizes[a] * dist[a] + sizes[b] * dist[b]) / (sizes[a] + sizes[b])
+        dist[a], dist[:, a] = merged, merged
+        dist[a, a] = np.inf
+        dist[b], dist[:, b] = np.inf, np.inf
+        sizes[a] += sizes[b]
+        members[a] = members[a] + members.pop(b)
+    return next(iter(members.values()))
+
+
+# -------------------------------------------------------
+# 合意・二極化の指標（6 段階ヒストグラムから算出）
+# -------------------------------------------------------
+def shannon_entropy(counts):
+    """正規化シャノンエントロピー（0 = 全員同じ回答、1 = 6 段階に一様）"""
+    counts = np.asarray(counts, dtype=np.float64)
+    n = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = np.where(n > 0, counts / n, 0.0)
+        h = -np.where(p > 0, p * np.log(p), 0.0).sum(axis=-1) / np.log(N_BINS)
+    return np.where(n[..., 0] > 0, np.maximum(h, 0.0), np.nan)
+
+
+def bimodality_coefficient(counts):
+    """
+    二峰性係数 BC = (歪度² + 1) / (尖度 + 3(n-1)² / ((n-2)(n-3)))
+    標本歪度・標本超過尖度はビンの中心モーメントから求める。
+    一様分布の 0.555 を超えると二峰（1 と 6 に割れる）傾向とみなせます。
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    n = counts.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = counts / np.where(n > 0, n, 1)[..., None]
+        mean = p @ RATINGS
+        dev = RATINGS - mean[..., None]
+        m2 = (p * dev ** 2).sum(axis=-1)
+        m3 = (p * dev ** 3).sum(axis=-1)
+        m4 = (p * dev ** 4).sum(axis=-1)
+        skew = np.sqrt(n * (n - 1)) / (n - 2) * m3 / m2 ** 1.5
+        kurt = (n - 1) / ((n - 2) * (n - 3)) * ((n + 1) * m4 / m2 ** 2 - 3 * (n - 1))
+        bc = (skew ** 2 + 1) / (kurt + 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+    return np.where((n > 3) & (m2 > 0), bc, np.nan)
+
+
+def leik_consensus(counts):
+    """
+    Leik の順序尺度合意度 (1 - D)。1 = 全員同じ回答、0 = 両端に半数ずつ
+    D = Σ min(F_i, 1 - F_i) / ((k - 1) / 2)、F_i は累積比率
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    n = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cum = np.cumsum(counts, axis=-1)[..., :-1] / n
+        dispersion = np.minimum(cum, 1 - cum).sum(axis=-1) / ((N_BINS - 1) / 2)
+    return np.where(n[..., 0] > 0, 1 - dispersion, np.nan)
+
+
+def distribution_metrics(counts):
+    """
+    ヒストグラム (..., 6) からシナリオ・セグメント単位の要約指標をまとめて求める
+
+    Returns:
+        dict: count, mean, std, entropy, bimodality, consensus（各形状 (...)）
+    """
+    n, _, _ = moments(counts)
+    mean, std = mean_std(counts)
+    return {
+        "count": n,
+        "mean": mean,
+        "std": std,
+        "entropy": shannon_entropy(counts),
+        "bimodality": bimodality_coefficient(counts),
+        "consensus": leik_consensus(counts),
+    }
+
+
+# -------------------------------------------------------
+# KPI（Page 3 上部の指標）
+# -------------------------------------------------------
+def kpi_summary(counts, scenario_types):
+    """
+    シナリオ × 評価のヒストグラム (S, 6)（ウェイト付きでも可）から KPI を求める
+
+    Returns:
+        dict:
+            miss_rate: Black シナリオで 1〜3（パワハラではない）と回答した割合 (%)
+            over_rate: White シナリオで 4〜6（パワハラである）と回答した割合 (%)
+            conflict_score: Gray シナリオの標準偏差の平均
+            （該当シナリオがない指標は None）
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    scenario_types = np.asarray(scenario_types)
+
+    def _share(sel, bins):
+        total = counts[sel].sum()
+        return float(counts[sel][:, bins].sum() / total * 100) if total > 0 else None
+
+    _, std = mean_std(counts[scenario_types == 'Gray'])
+    std = std[~np.isnan(std)]
+    return {
+        "miss_rate": _share(scenario_types == 'Black', slice(0, 3)),
+        "over_rate": _share(scenario_types == 'White', slice(3, 6)),
+        "conflict_score": float(std.mean()) if len(std) else None,
+    }
@@ -0,0 +1,74 @@
+"""
+項目パラメータのオフライン校正と項目分析
+
+    python -m utils.calibrate [--dry-run] [--max-iter 50] [--input responses.parquet]
+
+全回答から評価行列を作り、
+- 段階反応モデル（utils.irt）の識別力・閾値・位置
+- 尺度の信頼性（Cronbach の α）と、シナリオごとの項目-合計相関・難易度・除いたときの α
+を求めて、シナリオごとの行を scenario_irt_params テーブルへ保存します。
+適応型出題と Page 3 の「設問の品質」は保存済みの値を使うため、回答が増えたら定期的に（cron などで）実行してください。
+
+回答は既定で分析用ビューから読み込みます。大規模なデータでは --input に
+縦持ち (user_id, scenario_id, rating) の CSV / Parquet を指定すると、API のページングを経由せずに済みます。
+--dry-run では保存せずに結果を表示します。
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from utils.aggregates import CrossMoments
+from utils.db import get_global_analysis_data_view, save_irt_params
+from utils.irt import fit_grm, item_statistics
+from utils.population import build_rating_matrix
+
+
+def load_responses(path=None):
+    """縦持ちの回答データ。path がなければ分析用ビューから取得する"""
+    if path is None:
+        return pd.DataFrame(get_global_analysis_data_view())
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=["user_id", "scenario_id", "rating"])
+    return pd.read_csv(path, usecols=["user_id", "scenario_id", "rating"])
+
+
+def calibrate(X, scenario_ids, max_iter=50, verbose=False):
+    """
+    評価行列からシナリオごとのパラメータ表を作る
+
+    Returns:
+        tuple: (DataFrame, α, GradedResponseModel)
+    """
+    stats, alpha = item_statistics(CrossMoments.from_matrix(X), scenario_ids)
+    model = fit_grm(X, scenario_ids, n_iter=max_iter, verbose=verbose)
+    return model.to_frame().merge(stats, on="scenario_id"), alpha, model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="テーブルへ保存しない")
+    parser.add_argument("--max-iter", type=int, default=50)
+    parser.add_argument("--input", help="縦持ちの回答データ (CSV / Parquet)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    population = build_rating_matrix(load_responses(args.input))
+    n_users, n_scenarios = population.X.shape
+    print(f"rating matrix : {n_users:,} users x {n_scenarios} scenarios ({time.perf_counter() - t0:.1f}s)")
+    if n_users == 0:
+        raise SystemExit("回答データがありません")
+
+    t0 = time.perf_counter()
+    params, alpha, model = calibrate(population.X, population.scenario_ids, max_iter=args.max_iter, verbose=True)
+    print(f"fit           : {model.n_iter} iterations, loglik {model.loglik:,.1f} ({time.perf_counter() - t0:.1f}s)")
+    print(f"cronbach alpha: {alpha:.3f}")
+    print(params.round(3).to_string(index=False))
+
+    if not args.dry_run:
+        save_irt_params(params)
+        print(f"saved         : scenario_irt_params ({len(params)} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+グラフ描画の共通部品
+
+- Plotly 図のキャッシュ: ウィジェット操作による再実行のたびに go.Figure を組み立て直さないよう、
+  組み立て済みの図を JSON 文字列として保持します。キーは
+  (図の名前, データバージョン, 絞り込み条件..., is_mobile) のタプルで、
+  合計サイズが上限を超えたら最も古く使われた図から破棄します (LRU)。
+- 描画モード: 点の多い図は WebGL (Scattergl) で描きます。図の JSON が予算を超えたらログに残します。
+- シナリオ表示テーブル: ホバー用の折り返し済み本文などを、カタログの版ごとに一度だけ作ります。
+- 表のセルの背景: Styler.background_gradient は matplotlib を読み込むため、Plotly のカラースケールで塗ります。
+"""
+import hashlib
+import json
+import logging
+import textwrap
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from plotly.colors import sample_colorscale, unlabel_rgb
+
+logger = logging.getLogger(__name__)
+
+# キャッシュ全体の上限（JSON のバイト数）
+FIGURE_CACHE_BYTES = 64 * 1024 * 1024
+# 図 1 枚あたりの JSON の目安。超えたら警告ログを出す
+FIGURE_PAYLOAD_BUDGET = 512 * 1024
+
+
+class FigureCache:
+    """バイト数で上限を設けた LRU キャッシュ（値は図の JSON 文字列）"""
+
+    def __init__(self, max_bytes=FIGURE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, fig_json):
+        size = len(fig_json.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._items[key] = (fig_json, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+
+    def __len__(self):
+        return len(self._items)
+
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache():
+    """プロセス内で共有する図のキャッシュ（セッションをまたいで再利用される）"""
+    return FigureCache()
+
+
+def check_payload(name, fig_json, budget=FIGURE_PAYLOAD_BUDGET):
+    """図の JSON が予算を超えていたら警告ログを出す。サイズ (バイト) を返す"""
+    size = len(fig_json.encode("utf-8"))
+    if size > budget:
+        logger.warning("figure '%s' payload %.0fKB exceeds budget %.0fKB", name, size / 1024, budget / 1024)
+    return size
+
+
+def cached_figure(key, build, budget=FIGURE_PAYLOAD_BUDGET):
+    """
+    キャッシュ済みの図を返す。なければ build() で組み立てて保存する
+
+    Args:
+        key: (図の名前, データバージョン, 絞り込み条件..., is_mobile) のタプル
+        build: 引数なしで go.Figure を返す関数
+        budget: この図の JSON の目安 (バイト)。組み立て時に超えていたら警告ログを出す
+
+    Returns:
+        go.Figure: 再検証を省いて復元した図
+    """
+    cache = get_figure_cache()
+    fig_json = cache.get(key)
+    if fig_json is None:
+        fig_json = build().to_json()
+        check_payload(key[0], fig_json, budget)
+        cache.put(key, fig_json)
+    # 組み立て時に検証済みのため、復元時の検証は省く
+    return go.Figure(json.loads(fig_json), _validate=False)
+
+
+# -------------------------------------------------------
+# 描画モード
+# -------------------------------------------------------
+# render_mode = "auto" のとき、1 枚の図の点の数がこれを超えたら WebGL で描く
+WEBGL_POINT_THRESHOLD = 1000
+
+
+def get_render_mode():
+    """
+    散布図の描画モード。st.secrets の [charts] render_mode で指定する
+
+    Returns:
+        str: "svg" | "webgl" | "auto"（既定。点の数で切り替える）
+    """
+    try:
+        mode = dict(st.secrets.get("charts", {})).get("render_mode", "auto")
+    except Exception:
+        mode = "auto"
+    return mode if mode in ("svg", "webgl", "auto") else "auto"
+
+
+def scatter_trace_class(n_points):
+    """描画モードと点の数に応じて go.Scatter か go.Scattergl を返す"""
+    mode = get_render_mode()
+    if mode == "webgl" or (mode == "auto" and n_points > WEBGL_POINT_THRESHOLD):
+        return go.Scattergl
+    return go.Scatter
+
+
+# -------------------------------------------------------
+# シナリオ表示テーブル
+# -------------------------------------------------------
+# ホバーの折り返し幅（モバイル / PC）と、モバイルで本文を省略する文字数
+HOVER_WIDTHS = {True: 22, False: 40}
+MOBILE_MAX_CHARS = 140
+
+TYPE_LABELS = {'Black': '違法（Black）', 'Gray': 'グレー（Gray）', 'White': '適法（White）'}
+
+
+def format_hover_text(text, width=40):
+    """ツールチップ用にテキストを <br> で折り返す"""
+    if not isinstance(text, str): return ""
+    return "<br>".join(textwrap.wrap(text, width=width))
+
+
+def format_hover_compact(text, wrap_width, mobile, max_chars=MOBILE_MAX_CHARS):
+    """モバイル時は長文を短縮してから折り返す"""
+    if not isinstance(text, str):
+        return ""
+    t = text.strip()
+    if mobile and len(t) > max_chars:
+        t = t[: max_chars - 1] + "…"
+    return "<br>".join(textwrap.wrap(t, width=wrap_width))
+
+
+def catalog_version(scenarios):
+    """
+    シナリオカタログの版
+    updated_at があればその最大値、なければ ID と本文のハッシュを使います。
+    """
+    stamps = [s.get('updated_at') for s in scenarios if s.get('updated_at')]
+    if stamps and len(stamps) == len(scenarios):
+        return f"{len(scenarios)}:{max(stamps)}"
+    digest = hashlib.blake2b(digest_size=16)
+    for s in scenarios:
+        digest.update(f"{s.get('scenario_id')}\t{s.get('title')}\t{s.get('text')}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _build_display_table(version, _scenarios):
+    columns = ['scenario_id', 'title', 'text', 'category', 'type']
+    df = pd.DataFrame(_scenarios).reindex(columns=columns)
+    df[columns[1:]] = df[columns[1:]].fillna("")
+    df['scenario_id'] = df['scenario_id'].astype(int)
+    for mobile, width in HOVER_WIDTHS.items():
+        df[f"hover_{width}"] = df['text'].map(lambda t: format_hover_text(t, width))
+        df[f"hover_compact_{width}"] = df['text'].map(lambda t: format_hover_compact(t, width, mobile))
+    df['type_label'] = df['type'].map(TYPE_LABELS).fillna(df['type'])
+    return df.set_index('scenario_id', drop=False)
+
+
+def get_scenario_display_table(scenarios):
+    """
+    シナリオ ID で引ける表示用テーブル（カタログの版が変わるまで作り直さない）
+
+    Returns:
+        pd.DataFrame: index=scenario_id。title/text/category/type/type_label と
+        hover_{幅}（折り返し済み本文）、hover_compact_{幅}（モバイルでは省略後に折り返し）
+    """
+    return _build_display_table(catalog_version(scenarios), scenarios)
+
+
+def hover_column(is_mobile, compact=False):
+    """表示テーブルのホバー列名"""
+    return f"hover_{'compact_' if compact else ''}{HOVER_WIDTHS[bool(is_mobile)]}"
+
+
+# -------------------------------------------------------
+# 散布図の背景（あなたの回答 × 世の中の平均）
+# -------------------------------------------------------
+# 対角線からの距離 |y - x| による帯の境界（これ未満が緑 / 黄、以上が赤）
+GAP_BANDS = (1.2, 3.0)
+GAP_BAND_COLORS = ('rgba(46, 204, 113, 0.15)', 'rgba(241, 196, 15, 0.15)', 'rgba(231, 76, 60, 0.15)')
+SCATTER_RANGE = (0.5, 6.5)
+
+
+def _band_path(points):
+    return "M " + " L ".join(f"{x:g},{y:g}" for x, y in points) + " Z"
+
+
+@st.cache_resource(show_spinner=False)
+def gap_band_shapes():
+    """
+    散布図の背景となる帯（緑: 一致 / 黄: 注意 / 赤: 乖離）の多角形 shape
+
+    以前は 100×100 の格子で |y - x| の等高線を描いていましたが、境界は対角線に平行な直線なので
+    多角形 5 枚で同じ見た目になります。全セッションで共有します。
+    """
+    lo, hi = SCATTER_RANGE
+    near, far = GAP_BANDS
+    polygons = [
+        (GAP_BAND_COLORS[0], [(lo, lo), (lo, lo + near), (hi - near, hi), (hi, hi), (hi, hi - near), (lo + near, lo)]),
+        (GAP_BAND_COLORS[1], [(lo, lo + near), (lo, lo + far), (hi - far, hi), (hi - near, hi)]),
+        (GAP_BAND_COLORS[1], [(lo + near, lo), (lo + far, lo), (hi, hi - far), (hi, hi - near)]),
+        (GAP_BAND_COLORS[2], [(lo, lo + far), (lo, hi), (hi - far, hi)]),
+        (GAP_BAND_COLORS[2], [(lo + far, lo), (hi, lo), (hi, hi - far)]),
+    ]
+    return tuple(
+        dict(type="path", path=_band_path(points), fillcolor=color, line_width=0, layer="below")
+        for color, points in polygons
+    )
+
+
+# -------------------------------------------------------
+# 表のセルの背景（matplotlib を使わないグラデーション）
+# -------------------------------------------------------
+# 背景の相対輝度がこれ以下なら文字を白にする（pandas の text_color_threshold と同じ値）
+TEXT_COLOR_THRESHOLD = 0.408
+
+
+def _relative_luminance(rgb):
+    linear = [c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in (v / 255 for v in rgb)]
+    return 0.2126 * linear[0] + 0.7152 * linear[1] + 0.0722 * linear[2]
+
+
+def background_gradient(styler, colorscale, subset, vmin=None, vmax=None):
+    """
+    Styler.background_gradient の代わり（列ごとに値の大小で背景を塗る）
+
+    Args:
+        styler: DataFrame.style
+        colorscale: Plotly のカラースケール名（'Oranges', 'RdBu_r' など。末尾 _r で反転）
+        subset: 塗る列
+        vmin, vmax: 色の両端に対応する値（省略時は列の最小・最大）
+    """
+    def column_styles(col):
+        values = pd.to_numeric(col, errors="coerce").astype(float)
+        lo = values.min() if vmin is None else vmin
+        hi = values.max() if vmax is None else vmax
+        position = ((values - lo) / ((hi - lo) or 1.0)).clip(0.0, 1.0)
+        styles = []
+        for pos, color in zip(position, sample_colorscale(colorscale, position.fillna(0.0).tolist())):
+            if pd.isna(pos):
+                styles.append("")
+                continue
+            text = "#f1f1f1" if _relative_luminance(unlabel_rgb(color)) <= TEXT_COLOR_THRESHOLD else "#000000"
+            styles.append(f"background-color: {color}; color: {text};")
+        return styles
+
+    return styler.apply(column_styles, subset=subset)
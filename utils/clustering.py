@@ -0,0 +1,164 @@
+"""
+回答者クラスタリング（認識プロファイル）
+
+ユーザー × シナリオの評価ベクトルに対してミニバッチ k-means を適用し、
+回答者をいくつかの「認識プロファイル」に分類します。
+Streamlit に依存しないため、ベンチマークやバッチ処理からも利用できます。
+"""
+import threading
+
+import numpy as np
+
+# クラスタ数はオフラインで選定した固定値（エルボー法で 4 が最も解釈しやすかった）
+N_PROFILES = 4
+PROFILE_NAMES = ["寛容型", "やや寛容型", "やや厳格型", "厳格型"]
+
+
+def _sq_distances(X, centers):
+    """各行と各中心の二乗ユークリッド距離 (n, k) を返す"""
+    x_sq = np.einsum("ij,ij->i", X, X)[:, None]
+    c_sq = np.einsum("ij,ij->i", centers, centers)[None, :]
+    return np.maximum(x_sq - 2.0 * (X @ centers.T) + c_sq, 0.0)
+
+
+def _kmeans_plus_plus(X, k, rng):
+    """k-means++ による初期中心の選択"""
+    centers = np.empty((k, X.shape[1]), dtype=X.dtype)
+    centers[0] = X[rng.integers(len(X))]
+    closest = _sq_distances(X, centers[:1]).ravel()
+    for j in range(1, k):
+        total = closest.sum()
+        if total <= 0:
+            centers[j:] = X[rng.integers(len(X), size=k - j)]
+            break
+        centers[j] = X[rng.choice(len(X), p=closest / total)]
+        closest = np.minimum(closest, _sq_distances(X, centers[j:j + 1]).ravel())
+    return centers
+
+
+class ProfileModel:
+    """
+    ミニバッチ k-means の状態（中心・学習カウント）を保持するモデル
+
+    assign() は 1 人あたり O(k·シナリオ数) で所属プロファイルを返し、
+    partial_fit() は新しい回答を受け取るたびに中心を逐次更新します。
+    """
+
+    def __init__(self, centers, counts, fill_values):
+        self.centers = np.asarray(centers, dtype=np.float64)
+        self.counts = np.asarray(counts, dtype=np.float64)
+        # 未回答シナリオを埋めるためのシナリオ別平均
+        self.fill_values = np.asarray(fill_values, dtype=np.float64)
+        self._lock = threading.Lock()
+
+    @property
+    def k(self):
+        return len(self.centers)
+
+    def _prepare(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        mask = np.isnan(X)
+        if mask.any():
+            X = np.where(mask, self.fill_values[None, :], X)
+        return X
+
+    def assign(self, x):
+        """1 人分の評価ベクトルが属するプロファイル番号を返す"""
+        x = self._prepare(x)[0]
+        d = ((self.centers - x[None, :]) ** 2).sum(axis=1)
+        return int(d.argmin())
+
+    def predict(self, X, chunk_size=100_000):
+        """複数ユーザーのプロファイル番号をまとめて返す（メモリ節約のためチャンク処理）"""
+        X = np.atleast_2d(X)
+        labels = np.empty(len(X), dtype=np.int64)
+        for start in range(0, len(X), chunk_size):
+            block = self._prepare(X[start:start + chunk_size])
+            labels[start:start + chunk_size] = _sq_distances(block, self.centers).argmin(axis=1)
+        return labels
+
+    def partial_fit(self, X):
+        """
+        新しい回答ベクトル（1 件またはミニバッチ）で中心を逐次更新する
+        中心ごとの学習率は 1 / 累積件数 (Sculley, 2010)
+        更新で中心の平均スコアの順序が入れ替わったら並べ直し、プロファイル番号と表示名の対応
+        （平均スコアの昇順）を保ちます。返すラベルは並べ直した後の番号です。
+        """
+        X = self._prepare(X)
+        with self._lock:
+            labels = _sq_distances(X, self.centers).argmin(axis=1)
+            batch_counts = np.bincount(labels, minlength=self.k).astype(np.float64)
+            batch_sums = np.zeros_like(self.centers)
+            np.add.at(batch_sums, labels, X)
+            hit = batch_counts > 0
+            self.counts[hit] += batch_counts[hit]
+            self.centers[hit] += (batch_sums[hit] - batch_counts[hit, None] * self.centers[hit]) / self.counts[hit, None]
+            rank = self._sort_by_mean()
+        return rank[labels]
+
+    def _sort_by_mean(self):
+        """
+        中心（と学習カウント）を平均スコアの昇順に並べ替える
+
+        Returns:
+            np.ndarray: 旧番号 → 新番号の対応
+        """
+        order = np.argsort(self.centers.mean(axis=1), kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        if (order != np.arange(len(order))).any():
+            self.centers = self.centers[order]
+            self.counts = self.counts[order]
+        return rank
+
+    def describe(self, scenario_types):
+        """
+        各プロファイルの中心をシナリオ類型 (Black/White/Gray) ごとの平均に要約する
+
+        Returns:
+            list[dict]: profile, name, overall, Black, White, Gray
+        """
+        scenario_types = np.asarray(scenario_types)
+        rows = []
+        for j, center in enumerate(self.centers):
+            row = {"profile": j, "name": profile_name(j, self.k), "overall": float(center.mean())}
+            for t in ("Black", "White", "Gray"):
+                sel = scenario_types == t
+                row[t] = float(center[sel].mean()) if sel.any() else float("nan")
+            rows.append(row)
+        return rows
+
+
+def profile_name(index, k=N_PROFILES):
+    """プロファイル番号（平均スコアの昇順）を表示名に変換する"""
+    if k == len(PROFILE_NAMES):
+        return PROFILE_NAMES[index]
+    return f"プロファイル {chr(ord('A') + index)}"
+
+
+def fit_profiles(X, k=N_PROFILES, batch_size=4096, n_batches=200, seed=0):
+    """
+    評価行列 X (ユーザー × シナリオ、未回答は NaN) にミニバッチ k-means を適用する
+
+    プロファイル番号が実行ごとに入れ替わらないよう、
+    中心は常に平均スコアの昇順（寛容 → 厳格）に並べます（partial_fit が更新のたびに並べ直す）。
+
+    Returns:
+        ProfileModel
+    """
+    X = np.asarray(X, dtype=np.float64)
+    fill_values = np.nanmean(X, axis=0) if len(X) else np.full(X.shape[1], 3.5)
+    fill_values = np.where(np.isnan(fill_values), 3.5, fill_values)
+    rng = np.random.default_rng(seed)
+
+    n = len(X)
+    k = min(k, n)
+    init_sample = X[rng.choice(n, size=min(n, 10 * batch_size), replace=False)]
+    model = ProfileModel(np.zeros((k, X.shape[1])), np.zeros(k), fill_values)
+    init_sample = model._prepare(init_sample)
+    model.centers = _kmeans_plus_plus(init_sample, k, rng).astype(np.float64)
+
+    for _ in range(n_batches):
+        model.partial_fit(X[rng.integers(n, size=min(batch_size, n))])
+    model._sort_by_mean()
+    return model
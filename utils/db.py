@@ -1,6 +1,11 @@
+import logging
+import time
+
 import streamlit as st
-import pandas as pd
-import numpy as np
+
+# pandas / numpy は集計・デモデータの関数の中で読み込む（Home や診断ページの初回表示では不要なため）
+
+logger = logging.getLogger(__name__)
 
 # キャッシュ設定
 @st.cache_resource
@@ -54,11 +59,71 @@ def register_user(session_id, age, gender, employment, service_years, position,
 # -------------------------------------------------------
 # シナリオ取得
 # -------------------------------------------------------
-@st.cache_data(ttl=3600)
+# カタログの版を確認する間隔（秒）。全件の取り直しは版が変わったときだけ
+CATALOG_VERSION_TTL = 60
+
+@st.cache_data(ttl=CATALOG_VERSION_TTL, show_spinner=False)
+def _fetch_catalog_version():
+    """カタログの版。updated_at 列がない・一時的に取得できない場合は None"""
+    try:
+        # 件数と updated_at の最大値だけを 1 行で取得する（本文は取らない）
+        response = (
+            supabase.table("scenarios").select("updated_at", count="exact")
+            .order("updated_at", desc=True).limit(1).execute()
+        )
+        if response.data and response.data[0].get("updated_at"):
+            return f"{response.count}:{response.data[0]['updated_at']}"
+    except Exception as e:
+        logger.warning("カタログの版の取得エラー: %s", e)
+    return None
+
+# カタログの版が変わったときに呼ぶ関数（シナリオに依存する共有キャッシュの破棄用）
+_catalog_listeners = []
+_seen_catalog_version = None
+
+def on_catalog_change(callback):
+    """カタログの版が変わったときに呼ぶ関数を登録する"""
+    _catalog_listeners.append(callback)
+
+def get_catalog_version():
+    """
+    シナリオカタログの版（"件数:updated_at の最大値"）
+    確認は CATALOG_VERSION_TTL 秒ごとの軽い問い合わせで、前回と変わっていれば
+    on_catalog_change で登録された関数を呼んで派生キャッシュをまとめて破棄します。
+    取得に失敗したときは最後に確認できた版のまま（派生キャッシュは破棄しない）です。
+
+    Returns:
+        str | None: まだ一度も確認できていなければ None
+    """
+    global _seen_catalog_version
+    version = _fetch_catalog_version()
+    if version is None:
+        return _seen_catalog_version
+    if version != _seen_catalog_version:
+        changed = _seen_catalog_version is not None
+        _seen_catalog_version = version
+        if changed:
+            for callback in _catalog_listeners:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.warning("キャッシュ破棄エラー: %s", e)
+    return version
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _fetch_all_scenarios(version):
+    # 失敗は例外のまま返し、空の結果をキャッシュしない
+    response = supabase.table("scenarios").select("*").order("scenario_id").execute()
+    return response.data
+
 def get_all_scenarios():
+    """
+    シナリオ一覧（カタログの版が変わったときだけ全件を取り直す）
+    版が確認できない（updated_at 列がない・取得できていない）間は、1 時間ごとに取り直します。
+    """
+    version = get_catalog_version() or f"hourly:{int(time.time() // 3600)}"
     try:
-        response = supabase.table("scenarios").select("*").order("scenario_id").execute()
-        return response.data
+        return _fetch_all_scenarios(version)
     except Exception as e:
         st.error(f"シナリオ取得エラー: {e}")
         return []
@@ -134,30 +199,40 @@ def get_global_averages_stats():
     """
     統計テーブル(scenario_stats)から集計済みデータを取得
     Page 2 で重い計算をさせないために使用
+    集計テーブルは頻繁には変わらないため 5 分間キャッシュします（起動時のウォームアップでも読み込む）
     
     Returns:
         pd.DataFrame: scenario_id, avg_rating, std_dev を含むDataFrame
     """
+    import pandas as pd
+
     try:
-        response = supabase.table("scenario_stats").select(
-            "scenario_id, avg_rating, std_dev, count"
-        ).execute()
-        
-        if not response.data:
-            return pd.DataFrame()
-        
-        df = pd.DataFrame(response.data)
-        
-        # データ型の確認と修正
-        df['scenario_id'] = df['scenario_id'].astype(int)
-        df['avg_rating'] = pd.to_numeric(df['avg_rating'], errors='coerce')
-        df['std_dev'] = pd.to_numeric(df['std_dev'], errors='coerce')
-        
-        return df
+        return _fetch_scenario_stats()
     except Exception as e:
         st.error(f"統計データ取得エラー: {e}")
         return pd.DataFrame()
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_scenario_stats():
+    import pandas as pd
+
+    # 失敗は例外のまま返し、空の結果をキャッシュしない
+    response = supabase.table("scenario_stats").select(
+        "scenario_id, avg_rating, std_dev, count"
+    ).execute()
+    
+    if not response.data:
+        return pd.DataFrame()
+    
+    df = pd.DataFrame(response.data)
+    
+    # データ型の確認と修正
+    df['scenario_id'] = df['scenario_id'].astype(int)
+    df['avg_rating'] = pd.to_numeric(df['avg_rating'], errors='coerce')
+    df['std_dev'] = pd.to_numeric(df['std_dev'], errors='coerce')
+    
+    return df
+
 def get_global_analysis_data_view():
     """
     SQLビューから分析用データを一括取得
@@ -195,6 +270,72 @@ def get_global_analysis_data_view():
         st.error(f"分析データ取得エラー: {e}")
         return []
 
+def get_responses_version():
+    """
+    回答データの版（"件数:created_at の最大値"）
+    バックグラウンドワーカーが新しい回答の有無を確かめるための軽い問い合わせで、回答本体は取得しません。
+
+    Returns:
+        str | None: 取得できなければ None
+    """
+    try:
+        response = (
+            supabase.table("responses").select("created_at", count="exact")
+            .order("created_at", desc=True).limit(1).execute()
+        )
+        latest = response.data[0].get("created_at") if response.data else None
+        return f"{response.count}:{latest}"
+    except Exception:
+        pass
+    # created_at 列がない場合は件数だけで判定する
+    try:
+        response = supabase.table("responses").select("user_id", count="exact").limit(1).execute()
+        return f"{response.count}"
+    except Exception as e:
+        logger.warning("回答データの版の取得エラー: %s", e)
+        return None
+
+# -------------------------------------------------------
+# 項目パラメータ（段階反応モデル）
+# -------------------------------------------------------
+def get_irt_params():
+    """
+    オフライン校正 (python -m utils.calibrate) で保存したシナリオごとのパラメータを取得
+
+    Returns:
+        pd.DataFrame: scenario_id, discrimination, threshold_1..5。
+        テーブル未作成・未校正・取得失敗なら空の DataFrame（呼び出し側では全問出題にします）
+    """
+    import pandas as pd
+
+    if supabase is None:
+        return pd.DataFrame()
+    try:
+        return _fetch_irt_params()
+    except Exception as e:
+        logger.warning("項目パラメータ取得エラー: %s", e)
+        return pd.DataFrame()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_irt_params():
+    import pandas as pd
+
+    # 失敗は例外のまま返し、空の結果をキャッシュしない
+    response = supabase.table("scenario_irt_params").select("*").execute()
+    if not response.data:
+        return pd.DataFrame()
+    df = pd.DataFrame(response.data)
+    df['scenario_id'] = df['scenario_id'].astype(int)
+    return df
+
+def save_irt_params(df):
+    """シナリオごとのパラメータ表を scenario_irt_params テーブルへ一括で upsert する"""
+    if supabase is None:
+        raise RuntimeError("データベース接続が未設定です")
+    records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    supabase.table("scenario_irt_params").upsert(records).execute()
+    _fetch_irt_params.clear()
+
 # -------------------------------------------------------
 # デモデータ生成（研究・実験用）
 # -------------------------------------------------------
@@ -202,12 +343,26 @@ def generate_demo_data():
     """
     実際のシナリオメタデータ（title/text/category/type など）を使用しつつ、
     回答のみをシミュレーション生成するデモデータ（25人×シナリオ数）。
+    カタログの版ごとに 1 回だけ生成し、どのページからも同じデータを返します。
+    版が確認できない間は、シナリオ一覧と同じく 1 時間ごとに作り直します。
     """
+    import pandas as pd
+
     scenarios = get_all_scenarios() or []
     if not scenarios:
         # シナリオが取得できない場合は空データを返す
         st.info("シナリオデータが未登録のため、デモ生成をスキップします。")
         return pd.DataFrame()
+    version = get_catalog_version() or f"hourly:{int(time.time() // 3600)}"
+    return _build_demo_data(version, scenarios)
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _build_demo_data(version, _scenarios):
+    import numpy as np
+    import pandas as pd
+
+    scenarios = _scenarios
+    rng = np.random.default_rng(0)
 
     ages = ["20代", "30代", "40代", "50代"]
     genders = ["男性", "女性"]
@@ -225,23 +380,23 @@ def generate_demo_data():
     for user_idx in range(1, num_users + 1):
         user_attrs = {
             "user_id": user_idx,
-            "age": np.random.choice(ages),
-            "gender": np.random.choice(genders),
-            "position": np.random.choice(positions),
-            "industry": np.random.choice(industries),
-            "employment_status": np.random.choice(employments),
-            "job_type": np.random.choice(job_types),
-            "service_years": np.random.choice(service_years_list)
+            "age": rng.choice(ages),
+            "gender": rng.choice(genders),
+            "position": rng.choice(positions),
+            "industry": rng.choice(industries),
+            "employment_status": rng.choice(employments),
+            "job_type": rng.choice(job_types),
+            "service_years": rng.choice(service_years_list)
         }
 
         for scenario in scenarios:
             s_type = scenario.get("type", "Gray")
             if s_type == "Black":
-                rating = int(np.clip(np.random.normal(5.0, 0.8), 1, 6))
+                rating = int(np.clip(rng.normal(5.0, 0.8), 1, 6))
             elif s_type == "White":
-                rating = int(np.clip(np.random.normal(2.5, 0.8), 1, 6))
+                rating = int(np.clip(rng.normal(2.5, 0.8), 1, 6))
             else:
-                rating = int(np.clip(np.random.normal(3.5, 1.5), 1, 6))
+                rating = int(np.clip(rng.normal(3.5, 1.5), 1, 6))
 
             record = {
                 "response_id": len(demo_records) + 1,
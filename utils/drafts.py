@@ -0,0 +1,136 @@
+"""
+回答途中の下書き（診断ページの途中保存と再開）
+
+回答の選択はメモリ上の保留バッファに置くだけにし、バックグラウンドのスレッドが
+一定間隔でまとめて SQLite に書き込みます（回答操作の待ち時間を増やさないため）。
+下書きは session_id をキーに、圧縮した JSON として保存します。
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# 保留中の下書きをまとめて書き込む間隔（秒）
+FLUSH_INTERVAL = 2.0
+# これより古い下書きは読み込まず、書き込みのついでに削除する
+DRAFT_TTL = 7 * 24 * 3600
+
+
+def encode_draft(draft):
+    """下書き dict を圧縮したバイト列にする（回答は [scenario_id, 評価 1〜6] の組で持つ）"""
+    body = dict(draft)
+    body["responses"] = [[int(sid), int(r)] for sid, r in draft.get("responses", {}).items()]
+    return zlib.compress(json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_draft(data):
+    body = json.loads(zlib.decompress(data).decode("utf-8"))
+    body["responses"] = {sid: r for sid, r in body.get("responses", [])}
+    return body
+
+
+class DraftStore:
+    """
+    session_id → 下書きの保存先（SQLite）
+    save() は保留バッファへの登録だけで戻り、書き込みは flush() がまとめて行います。
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS drafts (session_id TEXT PRIMARY KEY, payload BLOB, updated_at REAL)"
+            )
+        self._thread = threading.Thread(target=self._run, name="draft-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def save(self, session_id, draft):
+        """下書きを保留バッファに置く（同じセッションの古い保留分は上書き）"""
+        with self._lock:
+            self._pending[session_id] = (encode_draft(draft), time.time())
+        self._wakeup.set()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._pending[session_id] = (None, time.time())
+        self._wakeup.set()
+
+    def load(self, session_id):
+        """下書きを返す（保留中のものを優先）。なければ None"""
+        with self._lock:
+            pending = self._pending.get(session_id)
+        if pending is not None:
+            return decode_draft(pending[0]) if pending[0] is not None else None
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT payload FROM drafts WHERE session_id = ? AND updated_at > ?",
+                    (session_id, time.time() - DRAFT_TTL),
+                ).fetchone()
+            return decode_draft(row[0]) if row else None
+        except Exception as e:
+            logger.warning("下書き読み込みエラー: %s", e)
+            return None
+
+    def flush(self):
+        """保留中の下書きを 1 トランザクションで書き込む"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        upserts = [(sid, payload, ts) for sid, (payload, ts) in batch.items() if payload is not None]
+        deletes = [(sid,) for sid, (payload, _) in batch.items() if payload is None]
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT INTO drafts (session_id, payload, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at",
+                    upserts,
+                )
+                conn.executemany("DELETE FROM drafts WHERE session_id = ?", deletes)
+                conn.execute("DELETE FROM drafts WHERE updated_at < ?", (time.time() - DRAFT_TTL,))
+        except Exception as e:
+            logger.warning("下書き保存エラー: %s", e)
+            # 書けなかった分は、その後に新しい保留が入っていなければ戻して次回に回す
+            with self._lock:
+                for sid, item in batch.items():
+                    self._pending.setdefault(sid, item)
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # 最初の保存から flush_interval の間に届いた分をまとめて書く
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+def _drafts_path():
+    try:
+        return dict(st.secrets.get("drafts", {})).get("path", os.path.join("data", "drafts.sqlite"))
+    except Exception:
+        return os.path.join("data", "drafts.sqlite")
+
+
+@st.cache_resource(show_spinner=False)
+def get_draft_store():
+    """プロセス内で共有する下書きストア"""
+    return DraftStore(_drafts_path())
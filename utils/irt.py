@@ -0,0 +1,336 @@
+"""
+項目反応理論（段階反応モデル, GRM）
+
+6 段階評価を「潜在的な厳しさ θ」の指標とみなし、シナリオごとに識別力 a と
+5 つの閾値 b_1 < … < b_5 を推定します。
+    P(評価 > k | θ) = σ(a (θ - b_k))   (k = 1..5)
+推定は θ を求積点上で扱う周辺最尤法 (Bock–Aitkin の EM) で、E ステップは
+one-hot 行列と行列積、M ステップはシナリオ単位のフィッシャースコアリングで
+すべてベクトル化しています。適応型出題では、求積点上の情報量を前計算しておき
+「事後分布で重み付けした情報量が最大のシナリオ」を 1 ステップ数十 µs で選びます。
+あわせて、尺度としての信頼性（Cronbach の α）と項目分析（項目-合計相関・難易度）を
+シナリオ対の累積統計量 (utils.aggregates.CrossMoments) から求めます。
+Streamlit に依存しないため、ベンチマークやバッチ処理からも利用できます。
+"""
+import numpy as np
+import pandas as pd
+
+from utils.aggregates import N_BINS
+
+N_THRESHOLDS = N_BINS - 1
+# θ の求積点と事前分布 N(0, 1)
+THETA_GRID = np.linspace(-4.0, 4.0, 61)
+_LOG_PRIOR = -0.5 * THETA_GRID ** 2 - np.log(np.exp(-0.5 * THETA_GRID ** 2).sum())
+
+# 適応型出題の既定値（st.secrets の [questionnaire] で上書き可能）
+SE_TARGET = 0.35  # θ の事後標準偏差がこれ以下になったら終了
+MIN_ITEMS = 5
+MAX_ITEMS = 20
+
+# 推定値の範囲（回答のないカテゴリで閾値が発散しないように）
+A_RANGE = (0.1, 5.0)
+B_RANGE = (-6.0, 6.0)
+_MIN_GAP = 1e-3
+_EPS = 1e-10
+
+
+def _sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def _category_probs(a, b, theta):
+    """
+    シナリオ (J,) × 閾値 (J, 5) のパラメータから、求積点 (Q,) ごとのカテゴリ確率を求める
+
+    Returns:
+        tuple: (P (J, 6, Q), 累積確率 P* (J, 5, Q))
+    """
+    p_star = _sigmoid(a[:, None, None] * (theta[None, None, :] - b[:, :, None]))
+    ones = np.ones((len(a), 1, len(theta)))
+    full = np.concatenate([ones, p_star, np.zeros_like(ones)], axis=1)
+    return np.maximum(full[:, :-1] - full[:, 1:], _EPS), p_star
+
+
+def _order_thresholds(b):
+    """閾値を範囲内に収め、昇順（最小間隔つき）に揃える"""
+    b = np.sort(np.clip(b, *B_RANGE), axis=1)
+    for k in range(1, b.shape[1]):
+        b[:, k] = np.maximum(b[:, k], b[:, k - 1] + _MIN_GAP)
+    return b
+
+
+class GradedResponseModel:
+    """
+    推定済みの段階反応モデル
+
+    求積点上のカテゴリ対数確率と項目情報量を前計算しておき、
+    estimate() / select_next() は回答済みシナリオ数に比例する計算だけで済ませます。
+    """
+
+    def __init__(self, scenario_ids, a, b):
+        self.scenario_ids = np.asarray(scenario_ids).astype(int)
+        self.a = np.asarray(a, dtype=np.float64)
+        self.b = _order_thresholds(np.asarray(b, dtype=np.float64).reshape(len(self.a), N_THRESHOLDS))
+        self._index = {sid: j for j, sid in enumerate(self.scenario_ids)}
+        P, p_star = _category_probs(self.a, self.b, THETA_GRID)
+        # (Q, J, 6) のカテゴリ対数確率と (Q, J) のフィッシャー情報量
+        self._log_probs = np.log(P).transpose(2, 0, 1)
+        w = p_star * (1.0 - p_star)
+        w_full = np.pad(w, ((0, 0), (1, 1), (0, 0)))
+        dP = self.a[:, None, None] * (w_full[:, :-1] - w_full[:, 1:])
+        self._info = (dP ** 2 / P).sum(axis=1).T
+
+    def __len__(self):
+        return len(self.scenario_ids)
+
+    def _codes(self, responses):
+        items, cats = [], []
+        for sid, rating in responses.items():
+            j = self._index.get(int(sid))
+            if j is not None and rating is not None and 1 <= int(rating) <= N_BINS:
+                items.append(j)
+                cats.append(int(rating) - 1)
+        return np.asarray(items, dtype=np.int64), np.asarray(cats, dtype=np.int64)
+
+    def posterior(self, responses):
+        """回答 {scenario_id: 評価 1〜6} を与えたときの θ の事後分布（求積点上, 和が 1）"""
+        items, cats = self._codes(responses)
+        log_post = _LOG_PRIOR + self._log_probs[:, items, cats].sum(axis=1)
+        post = np.exp(log_post - log_post.max())
+        return post / post.sum()
+
+    def estimate(self, responses):
+        """
+        θ の事後期待値 (EAP) と事後標準偏差
+
+        Returns:
+            tuple: (theta, se)
+        """
+        post = self.posterior(responses)
+        theta = float(post @ THETA_GRID)
+        return theta, float(np.sqrt(post @ (THETA_GRID - theta) ** 2))
+
+    def select_next(self, responses, candidates=None):
+        """
+        次に出題するシナリオ（事後分布で重み付けした情報量が最大のもの）
+
+        Args:
+            responses: 回答済み {scenario_id: 評価}
+            candidates: 出題してよい scenario_id（None ならモデル内の全シナリオ）
+
+        Returns:
+            int | None: scenario_id。候補が残っていなければ None
+        """
+        gain = self.posterior(responses) @ self._info
+        allowed = np.ones(len(self), dtype=bool)
+        if candidates is not None:
+            allowed &= np.isin(self.scenario_ids, np.fromiter((int(c) for c in candidates), dtype=np.int64))
+        answered, _ = self._codes(responses)
+        allowed[answered] = False
+        if not allowed.any():
+            return None
+        return int(self.scenario_ids[np.where(allowed, gain, -np.inf).argmax()])
+
+    def to_frame(self):
+        """シナリオごとのパラメータ表（scenario_irt_params テーブルの形式）"""
+        df = pd.DataFrame({"scenario_id": self.scenario_ids, "discrimination": self.a})
+        for k in range(N_THRESHOLDS):
+            df[f"threshold_{k + 1}"] = self.b[:, k]
+        # 位置（閾値の平均）: 大きいほど、厳しい人でないと「ハラスメント」と評価しないシナリオ
+        df["location"] = self.b.mean(axis=1)
+        return df
+
+    @classmethod
+    def from_frame(cls, df):
+        cols = [f"threshold_{k + 1}" for k in range(N_THRESHOLDS)]
+        df = df.sort_values("scenario_id")
+        return cls(df["scenario_id"].to_numpy(), df["discrimination"].to_numpy(dtype=np.float64), df[cols].to_numpy(dtype=np.float64))
+
+
+_MISSING = 255
+_CATEGORIES = np.arange(N_BINS, dtype=np.uint8)
+
+
+def _encode(X, chunk_size=200_000):
+    """評価行列 (n, J) をカテゴリ番号 0〜5 の uint8 行列にする（未回答は 255）。EM の反復の前に 1 回だけ行う"""
+    codes = np.empty(X.shape, dtype=np.uint8)
+    for start in range(0, len(X), chunk_size):
+        block = np.asarray(X[start:start + chunk_size], dtype=np.float32)
+        codes[start:start + chunk_size] = np.where(np.isnan(block), _MISSING, np.clip(np.nan_to_num(block), 1, N_BINS) - 1)
+    return codes
+
+
+def _one_hot(codes):
+    """カテゴリ番号のブロック (n, J) を one-hot (n, J*6) に展開する（未回答は全て 0）"""
+    return (codes[:, :, None] == _CATEGORIES).reshape(len(codes), -1).astype(np.float32)
+
+
+def _e_step(codes, a, b, chunk_size):
+    """
+    求積点ごとの期待度数 R (J, 6, Q) と周辺対数尤度を求める
+    対数尤度は one-hot 行列とカテゴリ対数確率の行列積 (n, J*6) @ (J*6, Q) で一括計算し、
+    事後分布は float32 のままバッファを使い回して計算します。
+    """
+    J = codes.shape[1]
+    P, _ = _category_probs(a, b, THETA_GRID)
+    L = np.log(P).reshape(J * N_BINS, -1).astype(np.float32)
+    log_prior = _LOG_PRIOR.astype(np.float32)
+    R = np.zeros((len(THETA_GRID), J * N_BINS))
+    loglik = 0.0
+    for start in range(0, len(codes), chunk_size):
+        Y = _one_hot(codes[start:start + chunk_size])
+        post = Y @ L
+        post += log_prior
+        peak = post.max(axis=1, keepdims=True)
+        post -= peak
+        np.exp(post, out=post)
+        total = post.sum(axis=1, keepdims=True)
+        loglik += float(np.log(total).sum(dtype=np.float64) + peak.sum(dtype=np.float64))
+        post /= total
+        R += post.T @ Y
+    return R.T.reshape(J, N_BINS, -1), loglik
+
+
+def _m_step(R, a, b, n_steps=4):
+    """
+    期待度数 R に対し、シナリオごとの (a, b_1..b_5) をフィッシャースコアリングで更新する
+    6 × 6 の情報行列をシナリオ数ぶん並べ、np.linalg.solve で全シナリオ同時に解きます。
+    """
+    J = len(a)
+    n_q = R.sum(axis=1)  # (J, Q)
+    for _ in range(n_steps):
+        P, p_star = _category_probs(a, b, THETA_GRID)
+        w = p_star * (1.0 - p_star)
+        # カテゴリ確率のパラメータ微分 dP (J, カテゴリ 6, パラメータ 6, Q)
+        e_full = np.pad(w * (THETA_GRID[None, None, :] - b[:, :, None]), ((0, 0), (1, 1), (0, 0)))
+        d_b = -a[:, None, None] * w
+        dP = np.zeros((J, N_BINS, 1 + N_THRESHOLDS, len(THETA_GRID)))
+        dP[:, :, 0] = e_full[:, :-1] - e_full[:, 1:]
+        for k in range(N_THRESHOLDS):
+            dP[:, k + 1, 1 + k] = d_b[:, k]
+            dP[:, k, 1 + k] = -d_b[:, k]
+        grad = np.einsum("jcq,jcpq->jp", R / P, dP)
+        info = np.einsum("jq,jcpq,jcrq->jpr", n_q, dP / P[:, :, None, :], dP)
+        info += 1e-6 * np.eye(1 + N_THRESHOLDS)
+        step = np.linalg.solve(info, grad[:, :, None])[:, :, 0]
+        # 1 回の更新幅を抑えて発散を防ぐ
+        scale = np.minimum(1.0, 1.0 / np.maximum(np.abs(step).max(axis=1), _EPS))[:, None]
+        step *= scale
+        a = np.clip(a + step[:, 0], *A_RANGE)
+        b = _order_thresholds(b + step[:, 1:])
+    return a, b
+
+
+def item_rest_correlations(X, chunk_size=200_000):
+    """
+    各シナリオの評価と「残りのシナリオの平均」との相関（未回答は回答者平均で補完）
+    十分統計量をチャンク単位で集計するので、大きな行列でもメモリを抑えて 1 パスで求まります。
+    """
+    J = X.shape[1]
+    s = np.zeros((2, J))     # Σx, Σrest
+    ss = np.zeros((3, J))    # Σx², Σrest², Σx·rest
+    n = 0
+    for start in range(0, len(X), chunk_size):
+        block = np.asarray(X[start:start + chunk_size], dtype=np.float64)
+        answered = ~np.isnan(block)
+        keep = answered.sum(axis=1) >= 2
+        block, answered = block[keep], answered[keep]
+        user_mean = np.nanmean(block, axis=1, keepdims=True) if len(block) else np.zeros((0, 1))
+        filled = np.where(answered, block, user_mean)
+        rest = (filled.sum(axis=1, keepdims=True) - filled) / (J - 1)
+        s += [filled.sum(axis=0), rest.sum(axis=0)]
+        ss += [(filled ** 2).sum(axis=0), (rest ** 2).sum(axis=0), (filled * rest).sum(axis=0)]
+        n += len(block)
+    if n < 2:
+        return np.full(J, np.nan)
+    mx, mr = s / n
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = ss[2] / n - mx * mr
+        return cov / np.sqrt((ss[0] / n - mx ** 2) * (ss[1] / n - mr ** 2))
+
+
+def fit_grm(X, scenario_ids, n_iter=50, tol=1e-5, chunk_size=100_000, verbose=False):
+    """
+    評価行列 X (ユーザー × シナリオ、未回答は NaN) に段階反応モデルを当てはめる（周辺最尤 EM）
+
+    1 反復はデータの 1 パス（チャンク単位の行列積）で、100 万人 × 30 シナリオでも
+    CPU で 1 反復数秒です。回答者 1 人あたりの周辺対数尤度の改善が tol 未満になったら打ち切ります。
+
+    Returns:
+        GradedResponseModel（loglik 属性に最終の周辺対数尤度、n_iter に反復回数を持つ）
+    """
+    J = X.shape[1]
+    codes = _encode(X)
+    # 初期値: 識別力は項目-残余相関 r から a ≈ 1.7 r / √(1 - r²)、閾値は各カテゴリを超える割合のロジットを a で割ったもの
+    counts = np.stack([np.bincount(col, minlength=_MISSING + 1)[:N_BINS] for col in codes.T])
+    above = 1.0 - np.cumsum(counts, axis=1)[:, :-1] / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    above = np.clip(above, 0.01, 0.99)
+    r = np.clip(np.nan_to_num(item_rest_correlations(X)), 0.05, 0.9)
+    a = np.clip(1.7 * r / np.sqrt(1.0 - r ** 2), *A_RANGE)
+    b = _order_thresholds(-np.log(above / (1.0 - above)) * np.sqrt(1.0 + (a[:, None] / 1.7) ** 2) / a[:, None])
+
+    prev = None
+    for it in range(1, n_iter + 1):
+        R, loglik = _e_step(codes, a, b, chunk_size)
+        a, b = _m_step(R, a, b)
+        if verbose:
+            print(f"  iter {it:3d}: loglik {loglik:,.1f}")
+        if prev is not None and abs(loglik - prev) < tol * len(X):
+            break
+        prev = loglik
+
+    model = GradedResponseModel(scenario_ids, a, b)
+    model.loglik = loglik
+    model.n_iter = it
+    return model
+
+
+# -------------------------------------------------------
+# 古典的テスト理論の指標（信頼性・項目分析）
+# -------------------------------------------------------
+def cronbach_alpha(cov):
+    """
+    共分散行列から Cronbach の α を求める
+    未回答を含むデータでは、ペアワイズの共分散 (CrossMoments.covariance) を渡します。
+    """
+    cov = np.nan_to_num(np.asarray(cov, dtype=np.float64))
+    J = len(cov)
+    total = cov.sum()
+    if J < 2 or total <= 0:
+        return float("nan")
+    return float(J / (J - 1) * (1.0 - np.trace(cov) / total))
+
+
+def item_statistics(moments, scenario_ids):
+    """
+    シナリオごとの項目分析（回答者数によらず O(シナリオ数²)）
+
+    Args:
+        moments: 評価行列の CrossMoments
+        scenario_ids: moments の列順のシナリオID
+
+    Returns:
+        tuple: (DataFrame, α)。DataFrame の列は
+        scenario_id, n_responses, mean_rating, difficulty（平均評価を 0〜1 に換算）,
+        item_total_r（そのシナリオを除いた合計との相関）, alpha_if_deleted（除いたときの α）
+    """
+    cov = np.nan_to_num(moments.covariance())
+    J = len(cov)
+    n = np.diag(moments.n)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.diag(moments.sum_x) / n
+        var = np.diag(cov)
+        total = cov.sum()
+        cov_rest = cov.sum(axis=1) - var      # cov(x_j, 残りの合計)
+        var_rest = total - 2.0 * cov.sum(axis=1) + var  # var(残りの合計)
+        item_total_r = cov_rest / np.sqrt(var * var_rest)
+        alpha_if_deleted = (J - 1) / (J - 2) * (1.0 - (np.trace(cov) - var) / var_rest) if J > 2 else np.full(J, np.nan)
+    stats = pd.DataFrame({
+        "scenario_id": np.asarray(scenario_ids).astype(int),
+        "n_responses": n.astype(np.int64),
+        "mean_rating": mean,
+        "difficulty": (mean - 1.0) / (N_BINS - 1),
+        "item_total_r": item_total_r,
+        "alpha_if_deleted": alpha_if_deleted,
+    })
+    return stats, cronbach_alpha(cov)
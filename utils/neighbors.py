@@ -0,0 +1,161 @@
+"""
+評価ベクトルの近傍探索（「あなたに近い回答者」）
+
+中規模までは全件のベクトル化された厳密探索、大規模では k-means の粗い量子化器で
+評価空間をセルに分割し (IVF)、クエリに近い数セルの候補だけを厳密な距離で並べ替えます。
+Streamlit に依存しないため、ベンチマークからも利用できます。
+"""
+import threading
+
+import numpy as np
+
+from utils.clustering import fit_profiles
+
+# これを超える件数では近似インデックスを使う
+EXACT_SEARCH_LIMIT = 200_000
+# 未マージの追加分がこれを超えたらセル内の並びを再構築する
+PENDING_MERGE_LIMIT = 10_000
+# 近似探索で調べるセル数（多いほど再現率が上がり、検索は遅くなる）
+N_PROBE = 8
+
+
+def _cells_for(n):
+    """セル数は件数の平方根の 1/4 程度（100万人で約 250 セル）"""
+    return int(np.clip(np.sqrt(max(n, 1)) / 4, 16, 1024))
+
+
+class NeighborIndex:
+    """
+    評価行列に対する近傍探索インデックス
+
+    add() で新しい回答者を逐次追加できます。行列は倍々で確保するため追加は償却 O(シナリオ数)、
+    近似モードでは追加分を未整列の領域に溜め、一定件数ごとにセル順の並べ替えをまとめて行います。
+    """
+
+    def __init__(self, X, ids, fill_values=None, approximate=None, seed=0):
+        X = np.asarray(X, dtype=np.float32)
+        if fill_values is None:
+            fill_values = np.nanmean(X, axis=0) if len(X) else np.full(X.shape[1], 3.5)
+        self.fill_values = np.where(np.isnan(fill_values), 3.5, fill_values).astype(np.float32)
+        self._X = self._prepare(X)
+        self._ids = np.asarray(ids)
+        self._sq_norms = np.einsum("ij,ij->i", self._X, self._X)
+        self._size = len(self._X)
+        self.approximate = self._size > EXACT_SEARCH_LIMIT if approximate is None else approximate
+        self._lock = threading.Lock()
+
+        if self.approximate:
+            self.quantizer = fit_profiles(self._X, k=_cells_for(self._size), batch_size=8192, n_batches=100, seed=seed)
+            self._cells = self.quantizer.predict(self._X)
+            self._rebuild_cells()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def X(self):
+        return self._X[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    def _prepare(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        mask = np.isnan(X)
+        if mask.any():
+            X = np.where(mask, self.fill_values[None, :], X)
+        return X
+
+    def _rebuild_cells(self):
+        cells = self._cells[:self._size]
+        self._order = np.argsort(cells, kind="stable")
+        self._bounds = np.searchsorted(cells[self._order], np.arange(self.quantizer.k + 1))
+        self._n_sorted = self._size
+
+    def _reserve(self, extra):
+        """追加分の領域を確保する（容量が足りなければ倍に拡張）"""
+        needed = self._size + extra
+        if needed <= len(self._X):
+            return
+        capacity = max(needed, 2 * len(self._X))
+
+        def grow(arr, dtype):
+            out = np.empty((capacity,) + arr.shape[1:], dtype=dtype)
+            out[:self._size] = arr[:self._size]
+            return out
+
+        self._X = grow(self._X, np.float32)
+        self._ids = grow(self._ids, self._ids.dtype if len(self._ids) else np.int64)
+        self._sq_norms = grow(self._sq_norms, np.float32)
+        if self.approximate:
+            self._cells = grow(self._cells, np.int64)
+
+    def add(self, X_new, ids_new):
+        """新しい回答者を追加する（近似モードでは所属セルだけを求めて差分更新）"""
+        X_new = self._prepare(X_new)
+        ids_new = np.atleast_1d(ids_new)
+        with self._lock:
+            self._reserve(len(X_new))
+            start, end = self._size, self._size + len(X_new)
+            self._X[start:end] = X_new
+            self._ids[start:end] = ids_new
+            self._sq_norms[start:end] = np.einsum("ij,ij->i", X_new, X_new)
+            if self.approximate:
+                self._cells[start:end] = self.quantizer.predict(X_new)
+            self._size = end
+            if self.approximate and self._size - self._n_sorted > PENDING_MERGE_LIMIT:
+                self._rebuild_cells()
+
+    def _snapshot(self):
+        """
+        検索に使う配列の組をロックの中で取り出す
+        add() は確保済みの領域の末尾に書き足すか新しい配列に置き換えるだけで、
+        取り出した時点の件数までの行は書き換えないため、ロックの外でそのまま検索できます。
+        """
+        with self._lock:
+            state = {"size": self._size, "X": self._X, "ids": self._ids, "sq_norms": self._sq_norms}
+            if self.approximate:
+                state.update(order=self._order, bounds=self._bounds, n_sorted=self._n_sorted)
+        return state
+
+    def _candidates(self, x, state):
+        """クエリに近い N_PROBE 個のセルの所属者と、未整列の追加分を候補にする"""
+        d_cells = ((self.quantizer.centers - x[None, :]) ** 2).sum(axis=1)
+        n_probe = min(N_PROBE, self.quantizer.k)
+        probe = np.argpartition(d_cells, n_probe - 1)[:n_probe]
+        order, bounds = state["order"], state["bounds"]
+        found = [order[bounds[c]:bounds[c + 1]] for c in probe]
+        if state["size"] > state["n_sorted"]:
+            found.append(np.arange(state["n_sorted"], state["size"]))
+        return np.concatenate(found)
+
+    def query(self, x, n=50, exclude_ids=()):
+        """
+        ベクトル x に近い n 人の行番号と二乗距離を返す
+        add() と並行に呼ばれても、呼び出した時点の一貫した状態を検索します。
+
+        Returns:
+            tuple: (rows: np.ndarray, sq_distances: np.ndarray) 距離の昇順
+        """
+        x = self._prepare(x)[0]
+        state = self._snapshot()
+        X, sq_norms = state["X"], state["sq_norms"]
+        if self.approximate:
+            rows = self._candidates(x, state)
+            d = sq_norms[rows] - 2.0 * (X[rows] @ x) + float(x @ x)
+        else:
+            size = state["size"]
+            rows = np.arange(size)
+            d = sq_norms[:size] - 2.0 * (X[:size] @ x) + float(x @ x)
+
+        if len(exclude_ids):
+            keep = ~np.isin(state["ids"][rows], np.asarray(list(exclude_ids)))
+            rows, d = rows[keep], d[keep]
+
+        k = min(n, len(d))
+        if k == 0:
+            return np.array([], dtype=np.int64), np.array([])
+        top = np.argpartition(d, k - 1)[:k]
+        top = top[np.argsort(d[top], kind="stable")]
+        return rows[top], np.maximum(d[top], 0.0)
@@ -0,0 +1,700 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass
+
+from utils.db import (
+    get_global_analysis_data_view, generate_demo_data, get_irt_params, get_catalog_version, on_catalog_change,
+)
+from utils.clustering import fit_profiles
+from utils.neighbors import NeighborIndex
+from utils.aggregates import build_cube, CrossMoments
+from utils.weighting import RAKING_COLUMNS, DEFAULT_TARGETS, rake, apply_weights, effective_sample_size
+from utils.sketches import SketchStore, StratifiedReservoir, OVERALL
+from utils.irt import GradedResponseModel, item_statistics
+from utils.snapshot import read_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックなし
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 属性軸（view_analysis_data のカラム名）
+ATTRIBUTE_COLUMNS = ['age', 'gender', 'position', 'industry', 'job_type', 'service_years', 'employment_status']
+
+# register_user の引数名と属性軸の対応（名前が異なるもののみ）
+_ATTRIBUTE_ALIASES = {'employment': 'employment_status', 'job': 'job_type'}
+
+
+@dataclass
+class Population:
+    """
+    回答者全体を「ユーザー × シナリオ」の評価行列として保持する
+
+    X[i, j] は user_ids[i] のシナリオ scenario_ids[j] への評価（未回答は NaN）、
+    attrs は X と同じ行順のユーザー属性です。
+    """
+    user_ids: np.ndarray
+    scenario_ids: np.ndarray
+    scenario_types: np.ndarray
+    X: np.ndarray
+    attrs: pd.DataFrame
+    is_demo: bool = False
+    loaded_at: float = 0.0
+
+    def vector_from_responses(self, responses):
+        """{scenario_id: rating} を行列の列順に並べたベクトルに変換する"""
+        return response_vector(self.scenario_ids, responses)
+
+
+def response_vector(scenario_ids, responses):
+    """{scenario_id: rating} を scenario_ids の順に並べたベクトルに変換する（未回答は NaN）"""
+    vec = np.full(len(scenario_ids), np.nan)
+    pos = {int(sid): j for j, sid in enumerate(scenario_ids)}
+    for sid, rating in responses.items():
+        j = pos.get(int(sid))
+        if j is not None and rating is not None:
+            vec[j] = float(rating)
+    return vec
+
+
+def build_rating_matrix(df: pd.DataFrame, is_demo=False) -> Population:
+    """
+    縦持ちの回答データ (user_id, scenario_id, rating, 属性...) から評価行列を作る
+    行ループを使わず、factorize とインデックス代入で一括変換します。
+    """
+    if df.empty or not {'user_id', 'scenario_id', 'rating'}.issubset(df.columns):
+        return Population(
+            user_ids=np.array([]), scenario_ids=np.array([], dtype=int), scenario_types=np.array([]),
+            X=np.empty((0, 0), dtype=np.float32), attrs=pd.DataFrame(columns=ATTRIBUTE_COLUMNS), is_demo=is_demo,
+        )
+
+    df = df.dropna(subset=['user_id', 'scenario_id', 'rating'])
+    user_codes, user_ids = pd.factorize(df['user_id'])
+    scenario_col = df['scenario_id'].astype(int).to_numpy()
+    scenario_ids = np.unique(scenario_col)
+    scenario_codes = np.searchsorted(scenario_ids, scenario_col)
+
+    X = np.full((len(user_ids), len(scenario_ids)), np.nan, dtype=np.float32)
+    X[user_codes, scenario_codes] = pd.to_numeric(df['rating'], errors='coerce').to_numpy(dtype=np.float32)
+
+    # シナリオ類型 (Black/White/Gray)
+    types = (
+        df.drop_duplicates('scenario_id').assign(scenario_id=lambda d: d['scenario_id'].astype(int))
+        .set_index('scenario_id')['type'].reindex(scenario_ids).fillna('Gray').to_numpy()
+        if 'type' in df.columns else np.full(len(scenario_ids), 'Gray')
+    )
+
+    attr_cols = [c for c in ATTRIBUTE_COLUMNS if c in df.columns]
+    attrs = df.drop_duplicates('user_id').set_index('user_id')[attr_cols].reindex(user_ids).reset_index(drop=True)
+
+    return Population(
+        user_ids=np.asarray(user_ids), scenario_ids=scenario_ids, scenario_types=types,
+        X=X, attrs=attrs, is_demo=is_demo,
+    )
+
+
+def load_population():
+    """
+    分析用ビューを評価行列として読み込む（Page 3 と同じく 10人未満ならデモデータ）
+    行列は大きくなり得るため、コピーを伴う cache_data ではなく cache_resource で共有します。
+    シナリオカタログの版ごとに読み込み直します。
+    """
+    return _load_population(get_catalog_version())
+
+
+@st.cache_resource(ttl=600, max_entries=1, show_spinner=False)
+def _load_population(catalog_version):
+    return read_population()
+
+
+def read_population():
+    """分析用ビューをキャッシュを通さずに評価行列として読み込む（バックグラウンドワーカーからも使う）"""
+    view_data = get_global_analysis_data_view()
+    df = pd.DataFrame(view_data) if view_data else pd.DataFrame()
+
+    if df.empty or 'user_id' not in df.columns or df['user_id'].nunique() < 10:
+        population = build_rating_matrix(generate_demo_data(), is_demo=True)
+    else:
+        population = build_rating_matrix(df)
+    population.loaded_at = time.time()
+    return population
+
+
+# プロセス内で反映した回答送信の回数（データバージョンの一部）
+_submission_count = 0
+
+
+def get_data_version():
+    """
+    集計結果が変わり得るたびに変わるトークン（図のキャッシュキーなどに使う）
+
+    Returns:
+        tuple: (評価行列の読み込み時刻, プロセス内の回答送信回数)
+    """
+    return (load_population().loaded_at, _submission_count)
+
+
+def _clear_catalog_caches():
+    """シナリオカタログの版が変わったら、評価行列から作った共有キャッシュをまとめて破棄する"""
+    for cached in (
+        _axis_cubes, _filter_cube, _raking_cube, _cross_moments,
+        _profile_model, _neighbor_index, _reservoir, get_irt_model,
+    ):
+        cached.clear()
+
+
+# 評価行列そのものは版をキーに読み込み直され、図のキャッシュはデータバージョン（読み込み時刻）で切り替わる
+on_catalog_change(_clear_catalog_caches)
+
+# 評価行列から作る共有キャッシュ（キューブ・モデル・インデックス）は評価行列の読み込み時刻をキーにし、
+# 評価行列と同時に作り直す（別々の TTL で期限切れになり、古い行列と新しい行列の集計が混ざらないように）。
+# 読み込み直すまでの間の回答送信は observe_submission が逐次反映する。
+
+
+# -------------------------------------------------------
+# 集計キューブ
+# -------------------------------------------------------
+def get_axis_cubes():
+    """
+    属性軸ごとの「水準 × シナリオ × 評価」ヒストグラム
+
+    Returns:
+        dict: {axis: HistogramCube}
+    """
+    population = load_population()
+    return _axis_cubes(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _axis_cubes(loaded_at, _population):
+    population = _population
+    return {
+        axis: build_cube(population.X, population.attrs, [axis], population.scenario_ids)
+        for axis in ATTRIBUTE_COLUMNS if axis in population.attrs.columns
+    }
+
+
+# 判断傾向マップの絞り込みに使う軸（組み合わせで絞り込めるよう同時分布で保持）
+FILTER_COLUMNS = ['position', 'service_years', 'industry', 'job_type']
+
+
+def get_filter_cube():
+    """
+    役職 × 勤続年数 × 業界 × 職種 × シナリオ × 評価 のヒストグラム
+    任意の絞り込みの組み合わせを、生データを走査せずに集計できます。
+
+    Returns:
+        HistogramCube
+    """
+    population = load_population()
+    return _filter_cube(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _filter_cube(loaded_at, _population):
+    population = _population
+    return build_cube(population.X, population.attrs, FILTER_COLUMNS, population.scenario_ids)
+
+
+def get_raking_cube():
+    """
+    年代 × 性別 × 役職 × 業界 × シナリオ × 評価 のヒストグラム（事後層化ウェイトの計算用）
+
+    Returns:
+        HistogramCube
+    """
+    population = load_population()
+    return _raking_cube(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _raking_cube(loaded_at, _population):
+    population = _population
+    return build_cube(population.X, population.attrs, RAKING_COLUMNS, population.scenario_ids)
+
+
+def get_raking_targets():
+    """目標分布。st.secrets の [raking.<軸>] があればその軸を上書きする"""
+    targets = {axis: dict(shares) for axis, shares in DEFAULT_TARGETS.items()}
+    try:
+        custom = st.secrets.get("raking", {})
+    except Exception:
+        custom = {}
+    for axis, shares in custom.items():
+        targets[axis] = {str(level): float(v) for level, v in dict(shares).items()}
+    return targets
+
+
+def get_scenario_counts(weighted=False, cube=None, filters=None):
+    """
+    全回答者のシナリオ × 評価ヒストグラムを返す（weighted=True でレイキング後のウェイト付き）
+    cube を渡すとそのキューブ（集計スナップショットのものなど）から求めます。
+    filters {軸: 水準} を渡すとその属性グループだけを合算します（軸はレイキングの軸のみ）。
+    ウェイトは全回答者で求めたものを使うため、グループ内の他の軸の構成も目標分布に補正されます。
+
+    Returns:
+        tuple: (counts (S, 6), 有効標本サイズ)
+    """
+    cube = cube if cube is not None else get_raking_cube()
+    filters = filters or {}
+    if not weighted:
+        selected = cube.select(**filters).marginal()
+        return selected.counts, float(selected.users.sum())
+    weights, _ = rake(cube.users, cube.axes, cube.levels, get_raking_targets())
+    for axis, value in filters.items():
+        # グループ外のセルのウェイトを 0 にする
+        shape = [1] * weights.ndim
+        shape[cube.axes.index(axis)] = -1
+        weights = weights * np.array([level == value for level in cube.levels[axis]]).reshape(shape)
+    return apply_weights(cube.counts, weights), effective_sample_size(cube.users, weights)
+
+
+def get_cross_moments():
+    """
+    シナリオ間相関のための累積クロス積（回答送信のたびに加算される）
+
+    Returns:
+        CrossMoments
+    """
+    population = load_population()
+    return _cross_moments(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _cross_moments(loaded_at, _population):
+    return CrossMoments.from_matrix(_population.X)
+
+
+# -------------------------------------------------------
+# 認識プロファイル
+# -------------------------------------------------------
+def get_profile_model():
+    """
+    評価行列に k-means を学習させたプロファイルモデルを返す
+    モデルはプロセス内で共有され、新しい回答が届くたびに逐次更新されます。
+    """
+    population = load_population()
+    return _profile_model(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _profile_model(loaded_at, _population):
+    population = _population
+    if len(population.user_ids) == 0:
+        return None
+    return fit_profiles(population.X)
+
+
+# -------------------------------------------------------
+# 近傍探索（あなたに近い回答者）
+# -------------------------------------------------------
+def get_neighbor_index():
+    """
+    評価行列の近傍探索インデックスを返す
+    件数が多い場合は自動的に近似インデックスになります。
+    """
+    population = load_population()
+    return _neighbor_index(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _neighbor_index(loaded_at, _population):
+    population = _population
+    if len(population.user_ids) == 0:
+        return None
+    return NeighborIndex(population.X, population.user_ids)
+
+
+def get_similar_respondents(responses, n=50, exclude_user_id=None):
+    """
+    回答 {scenario_id: rating} に最も近い n 人の属性を返す
+
+    Returns:
+        pd.DataFrame: 近傍ユーザーの属性（距離の昇順）。インデックス構築後に
+        回答した人は属性が未取得のため含まれません。
+    """
+    population = load_population()
+    index = get_neighbor_index()
+    if index is None:
+        return pd.DataFrame(columns=population.attrs.columns)
+    exclude = () if exclude_user_id is None else (exclude_user_id,)
+    rows, _ = index.query(population.vector_from_responses(responses), n=n, exclude_ids=exclude)
+    positions = pd.Index(population.user_ids).get_indexer(index.ids[rows])
+    return population.attrs.iloc[positions[positions >= 0]]
+
+
+def estimate_similar_shares(reservoir, vec, axes, n=50):
+    """
+    層別リザーバーサンプルから、回答ベクトル vec に近い回答者の属性構成を推定する（集計スナップショット用）
+    属性軸ごとに各水準の抽出済みベクトルを候補として近い n 件を取り、抽出率の逆数（seen / filled）で
+    重み付けして水準ごとの割合を求めます。評価行列も近傍インデックスも使いません。
+
+    Returns:
+        dict: {axis: pd.Series(水準 → 割合 %)}（サンプルのない軸は含まない）
+    """
+    overall = reservoir.sample(OVERALL)
+    fill = np.nanmean(overall, axis=0) if len(overall) else np.full(len(vec), 3.5)
+    fill = np.where(np.isnan(fill), 3.5, fill)
+    x = np.where(np.isnan(vec), fill, vec)
+    shares = {}
+    for axis in axes:
+        levels = reservoir.segments(axis)
+        samples = [reservoir.sample((axis, lv)) for lv in levels]
+        if not levels or sum(len(X) for X in samples) == 0:
+            continue
+        X = np.concatenate(samples)
+        X = np.where(np.isnan(X), fill[None, :], X)
+        labels = np.repeat(levels, [len(S) for S in samples])
+        weights = np.repeat(
+            [reservoir.seen[(axis, lv)] / max(reservoir.filled[(axis, lv)], 1) for lv in levels],
+            [len(S) for S in samples],
+        )
+        d = ((X - x[None, :]) ** 2).sum(axis=1)
+        k = min(n, len(d))
+        top = np.argpartition(d, k - 1)[:k]
+        share = pd.Series(weights[top]).groupby(labels[top]).sum()
+        shares[axis] = share / share.sum() * 100
+    return shares
+
+
+# -------------------------------------------------------
+# 適応型出題（段階反応モデル）
+# -------------------------------------------------------
+@st.cache_resource(ttl=600, show_spinner=False)
+def get_irt_model():
+    """
+    適応型出題に使う段階反応モデルを返す
+    オフライン校正 (python -m utils.calibrate) の保存済みパラメータだけを使います。
+    推定は全回答を何度も走査するため、リクエストの中では行いません。
+
+    Returns:
+        GradedResponseModel | None: 校正前（保存済みパラメータがない）なら None（全問出題にする）
+    """
+    return _stored_irt_model()
+
+
+def _stored_irt_model():
+    """オフライン校正で保存済みのパラメータのモデル（なければ None）"""
+    params = get_irt_params()
+    if params.empty:
+        return None
+    try:
+        return GradedResponseModel.from_frame(params)
+    except Exception as e:
+        logger.warning("項目パラメータ読み込みエラー: %s", e)
+        return None
+
+
+def get_item_quality(source=None):
+    """
+    シナリオごとの設問の品質（Page 3 用）
+
+    項目-合計相関・難易度・α は共有のシナリオ対統計量から毎回求め（回答送信で更新済み）、
+    識別力と位置はオフライン校正の保存済みパラメータがあるときだけ加えます（ページ内では推定しない）。
+    集計スナップショットまたはスケッチ（cross_moments と scenario_ids を持つもの）を渡すと
+    その統計量だけを使い、評価行列は読み込みません。
+
+    Returns:
+        tuple: (DataFrame, Cronbach の α)。回答データがなければ (空の DataFrame, NaN)
+    """
+    if source is not None:
+        if source.cross_moments.n.sum() == 0:
+            return pd.DataFrame(), float("nan")
+        stats, alpha = item_statistics(source.cross_moments, source.scenario_ids)
+    else:
+        population = load_population()
+        if len(population.user_ids) == 0:
+            return pd.DataFrame(), float("nan")
+        stats, alpha = item_statistics(get_cross_moments(), population.scenario_ids)
+    model = _stored_irt_model()
+    if model is not None:
+        stats = stats.merge(model.to_frame()[['scenario_id', 'discrimination', 'location']], on='scenario_id', how='left')
+    return stats, alpha
+
+
+# -------------------------------------------------------
+# 層別リザーバーサンプル（個々の回答者が必要なグラフ用）
+# -------------------------------------------------------
+RESERVOIR_CAPACITY = 500
+
+
+def get_reservoir():
+    """
+    全体および属性軸 × 水準ごとに最大 RESERVOIR_CAPACITY 人を一様抽出した回答ベクトル
+    回答送信のたびに逐次更新されます。
+
+    Returns:
+        StratifiedReservoir
+    """
+    population = load_population()
+    return _reservoir(population.loaded_at, population)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _reservoir(loaded_at, _population):
+    return build_reservoir(_population)
+
+
+def build_reservoir(population):
+    """評価行列から層別リザーバーサンプルを構築する"""
+    reservoir = StratifiedReservoir(len(population.scenario_ids), capacity=RESERVOIR_CAPACITY)
+    # 構築時は行順の偏りを避けるため並べ替えてから投入する
+    order = np.random.default_rng(0).permutation(len(population.user_ids))
+    X, attrs = population.X[order], population.attrs.iloc[order]
+    reservoir.add(OVERALL, X)
+    for axis in attrs.columns:
+        col = attrs[axis].fillna("不明").astype(str).to_numpy()
+        for level in np.unique(col):
+            reservoir.add((axis, level), X[col == level])
+    return reservoir
+
+
+# -------------------------------------------------------
+# 近似集計（スケッチ）
+# -------------------------------------------------------
+def _aggregate_settings():
+    try:
+        return dict(st.secrets.get("aggregates", {}))
+    except Exception:
+        return {}
+
+
+def get_aggregate_mode():
+    """
+    集計モード。st.secrets の [aggregates] mode = "sketch" で近似集計、
+    mode = "snapshot" でバックグラウンドワーカー（python -m utils.worker）の集計スナップショットに切り替える
+
+    Returns:
+        str: "exact" | "sketch" | "snapshot"
+    """
+    mode = _aggregate_settings().get("mode")
+    return mode if mode in ("sketch", "snapshot") else "exact"
+
+
+def _sketch_path():
+    return _aggregate_settings().get("sketch_path", os.path.join("data", "sketches.npz"))
+
+
+_sketch_lock = threading.Lock()
+
+
+@contextmanager
+def _sketch_file_lock(path):
+    """
+    スケッチファイルの読み込み → 反映 → 書き込みを直列化するロック
+    同じプロセスのスレッド間はスレッドロック、プロセス（レプリカ）間は {path}.lock の flock で排他します。
+    """
+    with _sketch_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_sketch_file(path):
+    """保存済みのスケッチ（なければ None）"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    store = SketchStore.from_bytes(data)
+    store.version = os.stat(path).st_mtime_ns
+    return store
+
+
+def _write_sketch_file(store, path):
+    """スケッチを書き手ごとの一時ファイル経由で置き換え保存する（読み手が書きかけを読まないように）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(store.to_bytes())
+    os.replace(tmp, path)
+    store.version = os.stat(path).st_mtime_ns
+
+
+def _build_sketch_store():
+    """評価行列からスケッチを構築する（ファイルがないときの初期化用）"""
+    population = load_population()
+    store = SketchStore(population.scenario_ids, cell_axes=FILTER_COLUMNS)
+    store.update_matrix(population.user_ids, population.attrs, population.X)
+    store.is_demo = population.is_demo
+    return store
+
+
+def save_sketch_store(store):
+    """
+    スケッチを保存する（ファイルがまだない場合のみ）
+    他のプロセスが先に保存していればそちらを優先し、上書きしません。
+    以降の回答は record_sketch_submission() でファイル上のスケッチへ直接反映します。
+
+    Returns:
+        SketchStore: 保存されているスケッチ
+    """
+    path = _sketch_path()
+    with _sketch_file_lock(path):
+        existing = _read_sketch_file(path)
+        if existing is not None:
+            return existing
+        _write_sketch_file(store, path)
+        return store
+
+
+def get_sketch_store():
+    """
+    保存済みのスケッチ（なければ評価行列から構築して保存する）
+    ファイルの更新時刻を確認するだけで、他のプロセスが回答を反映したときだけ読み直します。
+    保存済みの場合は全回答データを読み込まずに済みます。
+
+    Returns:
+        SketchStore: version にファイルの更新時刻（未保存のデモデータなら None）
+    """
+    path = _sketch_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime is not None:
+        try:
+            store = _load_sketch_store(path, mtime)
+            if store.cell_axes:
+                return store
+            # 絞り込み用のセルを持たない以前の形式のファイルは、評価行列から作り直す
+            return _upgrade_sketch_file(path)
+        except Exception as e:
+            logger.warning("スケッチ読み込みエラー（再構築します）: %s", e)
+    return _bootstrap_sketch_store(path)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_sketch_store(path, mtime):
+    with open(path, "rb") as f:
+        store = SketchStore.from_bytes(f.read())
+    store.version = mtime
+    return store
+
+
+@st.cache_resource(ttl=600, show_spinner=False)
+def _bootstrap_sketch_store(path):
+    store = _build_sketch_store()
+    if store.is_demo:
+        return store
+    return save_sketch_store(store)
+
+
+def _upgrade_sketch_file(path):
+    with _sketch_file_lock(path):
+        store = _read_sketch_file(path)
+        if store is not None and store.cell_axes:
+            return store
+        store = _build_sketch_store()
+        if not store.is_demo:
+            _write_sketch_file(store, path)
+        return store
+
+
+def record_sketch_submission(user_id, attrs, responses):
+    """
+    新規回答をファイル上のスケッチへ反映する
+    ロックを取ってファイルを読み直し、1 人分を加えて書き戻すため、
+    複数のプロセス（レプリカ）からの反映が互いに上書きされません。
+    """
+    path = _sketch_path()
+    with _sketch_file_lock(path):
+        store = _read_sketch_file(path)
+        if store is None:
+            store = _build_sketch_store()
+            if store.is_demo:
+                return
+        store.update(user_id, attrs, responses)
+        _write_sketch_file(store, path)
+
+
+# -------------------------------------------------------
+# 集計スナップショット（utils.worker が作成）
+# -------------------------------------------------------
+def get_snapshot_path():
+    return _aggregate_settings().get("snapshot_path", os.path.join("data", "aggregates.npz"))
+
+
+def get_snapshot():
+    """
+    完成済みの最新の集計スナップショット
+    ファイルの更新時刻を確認するだけで、ワーカーが置き換えたときだけ読み直します。
+
+    Returns:
+        AggregateSnapshot | None: まだ作成されていない・読み込めない場合は None
+    """
+    path = get_snapshot_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        return _load_snapshot(path, mtime)
+    except Exception as e:
+        logger.warning("集計スナップショット読み込みエラー: %s", e)
+        return None
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_snapshot(path, mtime):
+    return read_snapshot(path)
+
+
+# -------------------------------------------------------
+# 回答送信時のフック
+# -------------------------------------------------------
+def observe_submission(responses_dict, user_id=None, attributes=None):
+    """
+    新規回答 {scenario_id: rating} を共有の集計キューブ・集計モデル・近傍インデックスへ反映する
+    attributes は register_user に渡した属性で、近似集計モードのスケッチ更新に使います。
+    評価行列から作るモデルを更新するのは直接集計モードだけで、近似集計モードではスケッチだけを、
+    集計スナップショットモードでは何も更新しません（送信のたびに全回答を読み込まないように。
+    スナップショットはワーカーが作り直す）。
+    送信処理を止めないよう、失敗しても例外は外に出しません。
+    """
+    global _submission_count
+    attrs = {_ATTRIBUTE_ALIASES.get(k, k): v for k, v in (attributes or {}).items()}
+    mode = get_aggregate_mode()
+    if mode == "sketch" and user_id is not None:
+        try:
+            record_sketch_submission(user_id, attrs, responses_dict)
+        except Exception as e:
+            logger.warning("スケッチ更新エラー: %s", e)
+    if mode != "exact":
+        return
+    try:
+        population = load_population()
+        vec = population.vector_from_responses(responses_dict)
+        _submission_count += 1
+        get_cross_moments().update(vec)
+        # キューブにない水準（新しい属性値）の回答は、次に評価行列を読み込み直したときに反映される
+        for cube in list(get_axis_cubes().values()) + [get_filter_cube(), get_raking_cube()]:
+            cube.add(vec, attrs)
+        model = get_profile_model()
+        if model is not None:
+            model.partial_fit(vec)
+        index = get_neighbor_index()
+        if index is not None and user_id is not None:
+            index.add(vec, user_id)
+        reservoir = get_reservoir()
+        for key in [OVERALL] + [(axis, "不明" if v is None else str(v)) for axis, v in attrs.items()]:
+            reservoir.add(key, vec)
+    except Exception as e:
+        logger.warning("集計モデル更新エラー: %s", e)
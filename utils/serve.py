@@ -0,0 +1,39 @@
+"""
+ウォームアップ付きの起動スクリプト（streamlit run の代わりに使う）
+
+    python -m utils.serve [Home.py] [streamlit run のオプション...]
+
+Streamlit のサーバーと同じプロセスで、ランタイムが作られるのを待ってから
+共有キャッシュのウォームアップ（utils.warmup）をバックグラウンドのスレッドで始めます。
+最初の訪問者のスクリプト実行を待たずに始まるため、readiness probe（python -m utils.warmup --status）が
+準備完了を返してからトラフィックを流せば、初回表示がウォームアップと競合しません。
+"""
+import sys
+import threading
+import time
+
+from streamlit import runtime
+from streamlit.web import cli
+
+from utils.warmup import reset_status, start_warmup
+
+
+def _warm_when_runtime_ready():
+    # st.cache_data はランタイムのキャッシュ置き場を使うため、ランタイムの生成後に始める
+    while not runtime.exists():
+        time.sleep(0.1)
+    start_warmup()
+
+
+def main():
+    args = sys.argv[1:]
+    script = args.pop(0) if args and args[0].endswith(".py") else "Home.py"
+    # 前回の起動で残った状態ファイルを、このプロセスの pending で置き換えてから始める
+    reset_status()
+    threading.Thread(target=_warm_when_runtime_ready, name="cache-warmup-starter", daemon=True).start()
+    sys.argv = ["streamlit", "run", script, *args]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
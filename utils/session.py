@@ -1,12 +1,95 @@
 import streamlit as st
+import hashlib
+import re
+import secrets
 import uuid
+from utils.session_store import SESSION_TTL, get_session_store
+
+# 外部のセッションストアに保存するキー（別のレプリカに再接続しても画面遷移を続けられるように）
+# 保存先のキーは cookie の再開用トークンのハッシュなので、user_id（回答結果の閲覧権限）も
+# そのトークンを持つブラウザからしか復元できない
+PERSISTED_KEYS = (
+    "agreed_to_research", "user_id", "user_attributes_temp", "diagnosis_started",
+    "temp_responses", "scenario_order", "questionnaire_page", "show_completion_screen",
+    "visited_page2", "visited_page3",
+)
+
+# 再開用トークンを持つ cookie（URL には載せない）
+RESUME_COOKIE = "pwh_resume"
+_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{32,64}$")
+
+def _resume_token_from_cookie():
+    """ブラウザの cookie に残した再開用トークン（再読み込み・再接続後の復帰用）"""
+    try:
+        value = st.context.cookies.get(RESUME_COOKIE)
+    except Exception:
+        return None
+    return value if isinstance(value, str) and _TOKEN_PATTERN.match(value) else None
+
+def _set_resume_cookie(token):
+    """再開用トークンを cookie に保存する（サーバーからは設定できないため、ページ内のスクリプトで書き込む）"""
+    import streamlit.components.v1 as components
+    components.html(
+        "<script>window.parent.document.cookie = "
+        f"'{RESUME_COOKIE}={token}; Max-Age={SESSION_TTL}; Path=/; SameSite=Strict'"
+        " + (window.parent.location.protocol === 'https:' ? '; Secure' : '');</script>",
+        height=0,
+    )
+
+def _session_id_for(token):
+    """再開用トークンから導いたセッションID（ストア・下書き・users テーブルにはトークンそのものを残さない）"""
+    return str(uuid.UUID(bytes=hashlib.sha256(token.encode("ascii")).digest()[:16]))
 
 def init_session():
     """
     セッションIDの発行と管理
+    再読み込みや再接続でセッションが切れても続きから再開できるよう、ランダムな再開用トークンを
+    cookie に残し、そのハッシュをセッションIDとして使う（URL のクエリパラメータには載せない）。
+    セッションストアが設定されていれば、新しいセッションでは保存済みの状態を復元し、
+    以降は各ページの実行開始時に前回の実行で変わった状態を保存する。
     """
     if "session_id" not in st.session_state:
-        st.session_state.session_id = str(uuid.uuid4())
-    
-    
-    return st.session_state.session_id
\ No newline at end of file
+        token = _resume_token_from_cookie()
+        if token is None:
+            token = secrets.token_urlsafe(32)
+            st.session_state._resume_cookie_pending = token
+        st.session_state.session_id = _session_id_for(token)
+
+    # 新しく発行したトークンは、このセッションの最初の実行で 1 回だけ cookie に書き込む
+    pending = st.session_state.pop("_resume_cookie_pending", None)
+    if pending is not None:
+        _set_resume_cookie(pending)
+
+    # 以前の版で URL に残したセッションIDは使わずに消す（共有されたリンクから状態を引き継がない）
+    try:
+        if "sid" in st.query_params:
+            del st.query_params["sid"]
+    except Exception:
+        pass
+
+    store = get_session_store()
+    if store is not None:
+        if not st.session_state.get("_session_restored"):
+            st.session_state._session_restored = True
+            # 別のレプリカで進んだ状態を取りこぼさないよう、キャッシュを通さずに読む
+            saved = store.load(st.session_state.session_id, fresh=True) or {}
+            for key, value in saved.items():
+                if key in PERSISTED_KEYS and key not in st.session_state:
+                    st.session_state[key] = value
+        persist_session()
+
+    return st.session_state.session_id
+
+def persist_session(deferred=False):
+    """
+    画面遷移に必要なキーをセッションストアへ保存する（ストア未設定・変更なしなら何もしない）
+    deferred=True なら保留バッファに置くだけで戻り、書き込みはバックグラウンドでまとめて行う（設問ごとの回答用）
+    """
+    store = get_session_store()
+    if store is None or "session_id" not in st.session_state:
+        return
+    state = {k: st.session_state[k] for k in PERSISTED_KEYS if k in st.session_state}
+    if deferred:
+        store.save_later(st.session_state.session_id, state)
+    else:
+        store.save(st.session_state.session_id, state)
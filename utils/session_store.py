@@ -0,0 +1,334 @@
+"""
+サーバー側のセッション状態ストア
+
+st.session_state はプロセス内のメモリにしかないため、別のレプリカに再接続すると
+同意フラグや回答途中の状態が失われます。ここでは画面遷移に必要なキーだけを
+session_id ごとに外部ストアへ保存し、どのレプリカからでも復元できるようにします。
+
+- バックエンド: SQLite / ファイル（1 セッション 1 ファイル）/ なし（従来どおりメモリのみ）
+  st.secrets の [session_store] backend = "sqlite" | "file" | "none" で切り替えます。
+- 直列化: int キーの dict も失わないよう型を付けた JSON を zlib で圧縮します。
+- 読み込みは短い TTL のプロセス内キャッシュを通し（read-through）、書き込みは
+  キャッシュとストアの両方へ反映します（write-through）。
+  新しいセッションの復元時はキャッシュを通さずに読み直します（別のレプリカで進んだ状態を取りこぼさないように）。
+- 設問ごとの回答のような頻繁な保存は save_later() で保留バッファに置き、バックグラウンドのスレッドが
+  一定間隔でまとめて書き込みます（下書きストアと同じく、回答操作の待ち時間にストアの書き込みを含めない）。
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import atexit
+import zlib
+from collections import OrderedDict
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# キャッシュの有効期間（秒）と件数の上限
+CACHE_TTL = 10.0
+CACHE_MAX_ENTRIES = 4096
+# これより古いセッションは読み込まず、ストアから削除する
+SESSION_TTL = 7 * 24 * 3600
+# save_later() の保留分をまとめて書き込む間隔（秒）
+FLUSH_INTERVAL = 2.0
+
+
+# -------------------------------------------------------
+# 直列化
+# -------------------------------------------------------
+def _pack(value):
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value):
+            return {k: _pack(v) for k, v in value.items()}
+        # int キーなどは [キー, 値] の組の列として持つ
+        return {"__items__": [[k, _pack(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_pack(v) for v in value]
+    if hasattr(value, "item"):  # numpy のスカラー
+        return value.item()
+    return value
+
+
+def _unpack(value):
+    if isinstance(value, dict):
+        if set(value) == {"__items__"}:
+            return {k: _unpack(v) for k, v in value["__items__"]}
+        return {k: _unpack(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unpack(v) for v in value]
+    return value
+
+
+def encode_state(state):
+    """状態 dict を圧縮したバイト列にする"""
+    return zlib.compress(json.dumps(_pack(state), ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_state(data):
+    return _unpack(json.loads(zlib.decompress(data).decode("utf-8")))
+
+
+# -------------------------------------------------------
+# バックエンド
+# -------------------------------------------------------
+class SessionStore:
+    """バックエンドの共通インターフェース（バイト列の読み書き）"""
+
+    def read(self, session_id):
+        raise NotImplementedError
+
+    def write(self, session_id, data):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """プロセス内の dict（単一プロセス用・テスト用）"""
+
+    def __init__(self):
+        self._items = {}
+
+    def read(self, session_id):
+        return self._items.get(session_id)
+
+    def write(self, session_id, data):
+        self._items[session_id] = data
+
+    def delete(self, session_id):
+        self._items.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """1 テーブルに session_id → 圧縮済み状態を持つ。同じファイルを共有するプロセス間で使える"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, payload BLOB, updated_at REAL)"
+            )
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - SESSION_TTL,))
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def read(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, time.time() - SESSION_TTL),
+            ).fetchone()
+        return row[0] if row else None
+
+    def write(self, session_id, data):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, payload, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at",
+                (session_id, data, time.time()),
+            )
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+class FileSessionStore(SessionStore):
+    """ディレクトリに 1 セッション 1 ファイル（共有ボリューム向け）。一時ファイル経由で置き換える"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.bin")
+
+    def read(self, session_id):
+        path = self._path(session_id)
+        try:
+            if time.time() - os.path.getmtime(path) > SESSION_TTL:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, session_id, data):
+        path = self._path(session_id)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def delete(self, session_id):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+# -------------------------------------------------------
+# キャッシュ付きの窓口
+# -------------------------------------------------------
+class CachedSessionStore:
+    """
+    バックエンドの前段に置く TTL 付き LRU キャッシュ
+    キャッシュにはバイト列を持ち、取り出すたびに復元するので呼び出し側で変更しても影響しません。
+    """
+
+    def __init__(self, backend, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, flush_interval=FLUSH_INTERVAL):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _remember(self, session_id, data):
+        with self._lock:
+            self._cache[session_id] = (data, time.monotonic())
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def load(self, session_id, fresh=False):
+        """
+        保存済みの状態 dict を返す。なければ None
+        fresh=True ならキャッシュを使わずストアから読み直し、キャッシュも置き換えます。
+        別のレプリカを経由して戻ってきたセッション（A → B → A）では、このプロセスのキャッシュが
+        B で保存された状態より古いことがあるため、復元時は fresh=True で読みます。
+        """
+        with self._lock:
+            pending = self._pending.get(session_id)
+            item = self._cache.get(session_id)
+        if pending is not None:
+            # このプロセスでまだ書き込んでいない保留分が最新
+            return decode_state(pending)
+        if not fresh and item is not None and time.monotonic() - item[1] < self.ttl:
+            self.hits += 1
+            data = item[0]
+        else:
+            self.misses += 1
+            try:
+                data = self.backend.read(session_id)
+            except Exception as e:
+                logger.warning("セッション読み込みエラー: %s", e)
+                return None
+            self._remember(session_id, data)
+        return decode_state(data) if data is not None else None
+
+    def save(self, session_id, state):
+        """
+        状態を保存する。キャッシュ上の最新の内容と同じなら書き込まない
+        （キャッシュは復元時に fresh=True で読み直しているため、他のレプリカの書き込みより古くならない）
+        """
+        data = encode_state(state)
+        with self._lock:
+            self._pending.pop(session_id, None)
+            item = self._cache.get(session_id)
+        if item is not None and item[0] == data:
+            return False
+        return self._write(session_id, data)
+
+    def save_later(self, session_id, state):
+        """
+        状態を保留バッファに置いてすぐに戻る（書き込みはバックグラウンドのスレッドがまとめて行う）
+        同じセッションの古い保留分は上書きします。
+
+        Returns:
+            bool: 保留したかどうか（キャッシュ上の最新の内容と同じなら False）
+        """
+        data = encode_state(state)
+        with self._lock:
+            item = self._cache.get(session_id)
+            if item is not None and item[0] == data:
+                self._pending.pop(session_id, None)
+                return False
+            self._pending[session_id] = data
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="session-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        self._wakeup.set()
+        return True
+
+    def flush(self):
+        """保留中の状態をストアへ書き込む"""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        for session_id, data in batch.items():
+            if not self._write(session_id, data):
+                # 書けなかった分は、その後に新しい保留が入っていなければ戻して次回に回す
+                with self._lock:
+                    self._pending.setdefault(session_id, data)
+        return len(batch)
+
+    def _write(self, session_id, data):
+        try:
+            self.backend.write(session_id, data)
+        except Exception as e:
+            logger.warning("セッション保存エラー: %s", e)
+            return False
+        self._remember(session_id, data)
+        return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # 最初の保留から flush_interval の間に届いた分をまとめて書く
+            time.sleep(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._cache.pop(session_id, None)
+            self._pending.pop(session_id, None)
+        try:
+            self.backend.delete(session_id)
+        except Exception as e:
+            logger.warning("セッション削除エラー: %s", e)
+
+
+def _store_settings():
+    try:
+        return dict(st.secrets.get("session_store", {}))
+    except Exception:
+        return {}
+
+
+def create_backend(settings):
+    """設定 dict からバックエンドを作る。backend が未指定・"none" なら None"""
+    backend = settings.get("backend", "none")
+    if backend == "sqlite":
+        return SQLiteSessionStore(settings.get("path", os.path.join("data", "sessions.sqlite")))
+    if backend == "file":
+        return FileSessionStore(settings.get("path", os.path.join("data", "sessions")))
+    if backend == "memory":
+        return MemorySessionStore()
+    return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    """
+    プロセス内で共有するセッションストア
+
+    Returns:
+        CachedSessionStore | None: 外部ストアを使わない設定なら None
+    """
+    backend = create_backend(_store_settings())
+    return CachedSessionStore(backend) if backend is not None else None
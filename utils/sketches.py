@@ -0,0 +1,352 @@
+"""
+スケッチによる近似集計レイヤー
+
+全回答データを各プロセスに読み込まなくても Page 3 を描画できるよう、
+セグメント（属性軸 × 水準）ごとに以下の固定サイズ・マージ可能な状態を保持します。
+
+- HyperLogLog: 分析対象人数（異なり数）。p=12 で 4KB、相対標準誤差 1.04/√4096 ≈ 1.6%
+- 分位点スケッチ: 回答者ごとの平均スコアの分位点。[1, 6] を 250 ビンに分割し、誤差は ±0.01 以内
+- 6 段階ヒストグラム: シナリオ × 評価の件数。評価は離散値のため誤差なし
+- 絞り込み用の軸（役職 × 勤続年数 × 業界 × 職種）の組み合わせごとの 6 段階ヒストグラム（判断傾向マップ用、誤差なし）
+- シナリオ間相関のための累積クロス積（CrossMoments、誤差なし）
+
+個々の回答者が必要な集計（プロファイル構成比など）には、セグメントごとに一定人数を
+一様抽出した層別リザーバーサンプル (StratifiedReservoir) を使います。
+
+いずれも回答の書き込み時に更新し、合算（マージ）で複数プロセス・期間の状態を統合できます。
+"""
+import hashlib
+import io
+import json
+import threading
+
+import numpy as np
+
+from utils.aggregates import N_BINS, CrossMoments, HistogramCube
+
+HLL_PRECISION = 12
+QUANTILE_BINS = 250
+QUANTILE_RANGE = (1.0, 6.0)
+OVERALL = ("all", "all")
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def hash64(ids):
+    """ID 列を 64bit ハッシュにする（整数は splitmix64 をベクトル化、それ以外は blake2b）"""
+    ids = np.atleast_1d(np.asarray(ids))
+    if ids.dtype.kind in "iu":
+        z = ids.astype(np.uint64)
+    else:
+        z = np.array([int.from_bytes(hashlib.blake2b(str(v).encode(), digest_size=8).digest(), "little") for v in ids], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        z = (z + np.uint64(0x9E3779B97F4A7C15)) & _MASK64
+        z = ((z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)) & _MASK64
+        z = ((z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)) & _MASK64
+    return z ^ (z >> np.uint64(31))
+
+
+class HyperLogLog:
+    """異なり数のスケッチ（レジスタ 2^p 個、マージは要素ごとの最大値）"""
+
+    def __init__(self, p=HLL_PRECISION, registers=None):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8) if registers is None else registers
+
+    def add(self, ids):
+        if len(np.atleast_1d(ids)) == 0:
+            return
+        self.add_hashes(hash64(ids))
+
+    def add_hashes(self, h):
+        """hash64() 済みの値を加える（同じ ID 列を複数のスケッチに入れる場合に再計算しない）"""
+        if len(h) == 0:
+            return
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest_bits = 64 - self.p
+        rest = (h & np.uint64((1 << rest_bits) - 1)).astype(np.float64)  # 52bit 以下なので float64 で正確
+        # rho = 残りビットの先頭から最初の 1 までの位置
+        rho = np.where(rest > 0, rest_bits - np.floor(np.log2(np.maximum(rest, 1))), rest_bits + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rho)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(np.float64))
+        zeros = int((self.registers == 0).sum())
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * np.log(m / zeros)  # 小さい値は線形カウンティング
+        return float(estimate)
+
+
+class QuantileSketch:
+    """
+    値域が既知の値に対する固定ビンの分位点スケッチ
+    マージはビンの加算で、分位点の誤差はビン幅の半分 ((hi - lo) / bins / 2) 以内です。
+    """
+
+    def __init__(self, lo=QUANTILE_RANGE[0], hi=QUANTILE_RANGE[1], n_bins=QUANTILE_BINS, counts=None):
+        self.lo, self.hi = lo, hi
+        self.counts = np.zeros(n_bins, dtype=np.int64) if counts is None else counts
+
+    @property
+    def error_bound(self):
+        return (self.hi - self.lo) / len(self.counts) / 2
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        pos = (np.clip(values, self.lo, self.hi) - self.lo) / (self.hi - self.lo) * len(self.counts)
+        self.counts += np.bincount(np.minimum(pos.astype(np.int64), len(self.counts) - 1), minlength=len(self.counts))
+
+    def merge(self, other):
+        self.counts += other.counts
+
+    def quantile(self, q):
+        total = self.counts.sum()
+        if total == 0:
+            return float("nan")
+        b = int(np.searchsorted(np.cumsum(self.counts), q * total, side="left"))
+        width = (self.hi - self.lo) / len(self.counts)
+        return float(self.lo + (min(b, len(self.counts) - 1) + 0.5) * width)
+
+
+class SketchStore:
+    """
+    セグメント（属性軸 × 水準、および全体）ごとのスケッチ一式
+
+    update() で 1 人分の回答を書き込み時に反映し、to_bytes() / from_bytes() で
+    数百 KB のバイト列として保存・共有できます。
+    cell_axes を指定すると、その軸の水準の組み合わせ（セル）ごとのヒストグラムも保持し、
+    filter_cube() で絞り込み用のキューブとして取り出せます（大きさは回答者数によらず、セルの数で決まる）。
+    """
+
+    def __init__(self, scenario_ids, cell_axes=()):
+        self.scenario_ids = np.asarray(scenario_ids, dtype=np.int64)
+        self._pos = {int(s): j for j, s in enumerate(self.scenario_ids)}
+        self.hll = {}
+        self.quantiles = {}
+        self.hists = {}
+        self.cell_axes = list(cell_axes)
+        self.cells = {}       # 水準の組み合わせ → (S, 6)
+        self.cell_users = {}  # 水準の組み合わせ → 人数
+        self.cross_moments = CrossMoments(len(self.scenario_ids))
+        # デモデータから作ったストアか（デモデータのストアは保存しない）
+        self.is_demo = False
+        # 読み込んだファイルの更新時刻（図のキャッシュキー用。未保存なら None）
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _segment(self, key):
+        if key not in self.hll:
+            self.hll[key] = HyperLogLog()
+            self.quantiles[key] = QuantileSketch()
+            self.hists[key] = np.zeros((len(self.scenario_ids), N_BINS), dtype=np.int64)
+        return self.hll[key], self.quantiles[key], self.hists[key]
+
+    def segments(self, axis):
+        """指定した軸の水準一覧"""
+        return sorted(level for a, level in self.hll if a == axis)
+
+    def users(self, key=OVERALL):
+        """セグメントの推定人数（HyperLogLog）"""
+        return self.hll[key].count() if key in self.hll else 0.0
+
+    def counts(self, key=OVERALL):
+        """セグメントのシナリオ × 評価ヒストグラム (S, 6)"""
+        return self.hists.get(key, np.zeros((len(self.scenario_ids), N_BINS), dtype=np.int64))
+
+    def axis_cube(self, axis):
+        """
+        軸ごとのヒストグラムを HistogramCube にする（η² などの既存の集計関数にそのまま渡せる）
+        users は HyperLogLog の推定人数です。
+        """
+        levels = self.segments(axis)
+        counts = np.stack([self.hists[(axis, lv)] for lv in levels]) if levels else np.zeros((0, len(self.scenario_ids), N_BINS), np.int64)
+        return HistogramCube(
+            axes=[axis], levels={axis: levels}, scenario_ids=self.scenario_ids, counts=counts,
+            users=np.array([round(self.users((axis, lv))) for lv in levels], dtype=np.int64),
+        )
+
+    def filter_cube(self):
+        """セルごとのヒストグラムを cell_axes の HistogramCube にする（判断傾向マップの絞り込みに使う）"""
+        with self._lock:
+            keys = list(self.cells)
+            levels = {axis: sorted({key[i] for key in keys}) for i, axis in enumerate(self.cell_axes)}
+            shape = tuple(len(levels[axis]) for axis in self.cell_axes)
+            counts = np.zeros(shape + (len(self.scenario_ids), N_BINS), dtype=np.int64)
+            users = np.zeros(shape, dtype=np.int64)
+            for key in keys:
+                idx = tuple(levels[axis].index(value) for axis, value in zip(self.cell_axes, key))
+                counts[idx] += self.cells[key]
+                users[idx] += self.cell_users[key]
+        return HistogramCube(axes=list(self.cell_axes), levels=levels, scenario_ids=self.scenario_ids, counts=counts, users=users)
+
+    def update(self, user_id, attrs, responses):
+        """1 人分の回答 {scenario_id: rating} と属性 {axis: 値} を反映する"""
+        ratings = [(self._pos[int(s)], int(r)) for s, r in responses.items() if r is not None and int(s) in self._pos]
+        if not ratings:
+            return
+        cols, values = np.array(ratings).T
+        user_mean = float(np.mean(values))
+        keys = [OVERALL] + [(axis, "不明" if value is None else str(value)) for axis, value in attrs.items()]
+        cell = tuple("不明" if attrs.get(axis) is None else str(attrs[axis]) for axis in self.cell_axes)
+        vec = np.full(len(self.scenario_ids), np.nan)
+        vec[cols] = values
+        with self._lock:
+            for key in keys:
+                hll, quant, hist = self._segment(key)
+                hll.add([user_id])
+                quant.add([user_mean])
+                np.add.at(hist, (cols, np.clip(values, 1, N_BINS) - 1), 1)
+            if self.cell_axes:
+                hist = self.cells.setdefault(cell, np.zeros((len(self.scenario_ids), N_BINS), dtype=np.int64))
+                np.add.at(hist, (cols, np.clip(values, 1, N_BINS) - 1), 1)
+                self.cell_users[cell] = self.cell_users.get(cell, 0) + 1
+        self.cross_moments.update(vec)
+
+    def update_matrix(self, user_ids, attrs, X):
+        """評価行列 (ユーザー × シナリオ) と属性 DataFrame からまとめて反映する（初期構築用）"""
+        from utils.aggregates import build_cube
+
+        hashes = hash64(user_ids) if len(user_ids) else np.array([], dtype=np.uint64)
+        with np.errstate(invalid="ignore"):
+            user_means = np.nanmean(X, axis=1) if X.size else np.array([])
+        groups = [(OVERALL, np.ones(len(hashes), dtype=bool), build_cube(X, attrs, [], self.scenario_ids).counts)]
+        for axis in attrs.columns:
+            col = attrs[axis].fillna("不明").astype(str).to_numpy()
+            cube = build_cube(X, attrs, [axis], self.scenario_ids)
+            for j, level in enumerate(cube.levels[axis]):
+                groups.append(((axis, level), col == level, cube.counts[j]))
+        cell_cube = build_cube(X, attrs, self.cell_axes, self.scenario_ids) if self.cell_axes else None
+        moments = CrossMoments.from_matrix(X)
+        with self._lock:
+            for key, mask, counts in groups:
+                hll, quant, hist = self._segment(key)
+                hll.add_hashes(hashes[mask])
+                quant.add(user_means[mask])
+                hist += counts
+            if cell_cube is not None:
+                for idx in zip(*np.nonzero(cell_cube.users)):
+                    cell = tuple(cell_cube.levels[axis][i] for axis, i in zip(cell_cube.axes, idx))
+                    self.cells[cell] = self.cells.get(cell, 0) + cell_cube.counts[idx]
+                    self.cell_users[cell] = self.cell_users.get(cell, 0) + int(cell_cube.users[idx])
+        self.cross_moments.merge(moments)
+
+    def merge(self, other):
+        """別のストア（他プロセス・他期間）の状態を合算する"""
+        with self._lock:
+            for key in other.hll:
+                hll, quant, hist = self._segment(key)
+                hll.merge(other.hll[key])
+                quant.merge(other.quantiles[key])
+                hist += other.hists[key]
+            self.cell_axes = self.cell_axes or list(other.cell_axes)
+            for cell, counts in other.cells.items():
+                self.cells[cell] = self.cells.get(cell, 0) + counts
+                self.cell_users[cell] = self.cell_users.get(cell, 0) + other.cell_users[cell]
+        self.cross_moments.merge(other.cross_moments)
+
+    # -------------------------------------------------------
+    # 保存・復元
+    # -------------------------------------------------------
+    def to_bytes(self):
+        keys = list(self.hll)
+        cells = list(self.cells)
+        cell_index = {"axes": self.cell_axes, "cells": cells}
+        buf = io.BytesIO()
+        np.savez_compressed(
+            buf,
+            index=np.frombuffer(json.dumps(keys, ensure_ascii=False).encode(), dtype=np.uint8),
+            cell_index=np.frombuffer(json.dumps(cell_index, ensure_ascii=False).encode(), dtype=np.uint8),
+            cell_hists=np.stack([self.cells[c] for c in cells]) if cells else np.zeros((0, len(self.scenario_ids), N_BINS), np.int64),
+            cell_users=np.array([self.cell_users[c] for c in cells], dtype=np.int64),
+            moments=np.stack([self.cross_moments.n, self.cross_moments.sum_x, self.cross_moments.sum_xx, self.cross_moments.sum_xy]),
+            scenario_ids=self.scenario_ids,
+            hll=np.stack([self.hll[k].registers for k in keys]) if keys else np.zeros((0, 1 << HLL_PRECISION), np.uint8),
+            quantiles=np.stack([self.quantiles[k].counts for k in keys]) if keys else np.zeros((0, QUANTILE_BINS), np.int64),
+            hists=np.stack([self.hists[k] for k in keys]) if keys else np.zeros((0, len(self.scenario_ids), N_BINS), np.int64),
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as npz:
+            store = cls(npz["scenario_ids"])
+            keys = [tuple(k) for k in json.loads(npz["index"].tobytes().decode())]
+            for i, key in enumerate(keys):
+                store.hll[key] = HyperLogLog(registers=npz["hll"][i].copy())
+                store.quantiles[key] = QuantileSketch(counts=npz["quantiles"][i].copy())
+                store.hists[key] = npz["hists"][i].copy()
+            # 絞り込み用のセルとクロス積は後から追加した項目（古いファイルにはない）
+            if "cell_index" in npz.files:
+                cell_index = json.loads(npz["cell_index"].tobytes().decode())
+                store.cell_axes = cell_index["axes"]
+                for i, cell in enumerate(tuple(c) for c in cell_index["cells"]):
+                    store.cells[cell] = npz["cell_hists"][i].copy()
+                    store.cell_users[cell] = int(npz["cell_users"][i])
+            if "moments" in npz.files:
+                moments = npz["moments"]
+                store.cross_moments.n, store.cross_moments.sum_x = moments[0].copy(), moments[1].copy()
+                store.cross_moments.sum_xx, store.cross_moments.sum_xy = moments[2].copy(), moments[3].copy()
+        return store
+
+
+class StratifiedReservoir:
+    """
+    層（セグメント）ごとに最大 capacity 人の回答ベクトルを一様抽出で保持する（Algorithm R）
+
+    回答ベクトルは全シナリオ分を持つため、シナリオ × セグメントごとの生の評価も
+    このサンプルから取り出せます。回答者が何人に増えても保持量と集計コストは一定です。
+    """
+
+    def __init__(self, n_scenarios, capacity=500, seed=0):
+        self.n_scenarios = n_scenarios
+        self.capacity = capacity
+        self.samples = {}
+        self.filled = {}
+        self.seen = {}
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def _stratum(self, key):
+        if key not in self.samples:
+            self.samples[key] = np.full((self.capacity, self.n_scenarios), np.nan, dtype=np.float32)
+            self.filled[key] = 0
+            self.seen[key] = 0
+        return self.samples[key]
+
+    def add(self, key, X):
+        """層 key に回答ベクトル（1 行または複数行）を加える"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        with self._lock:
+            buf = self._stratum(key)
+            seen, filled = self.seen[key], self.filled[key]
+            # 空きがある間はそのまま追加
+            n_fill = min(self.capacity - filled, len(X))
+            buf[filled:filled + n_fill] = X[:n_fill]
+            filled += n_fill
+            seen += n_fill
+            rest = X[n_fill:]
+            if len(rest):
+                # t 番目の行は確率 capacity / t で既存の 1 行と置き換える
+                t = seen + 1 + np.arange(len(rest))
+                slots = (self._rng.random(len(rest)) * t).astype(np.int64)
+                for i in np.flatnonzero(slots < self.capacity):
+                    buf[slots[i]] = rest[i]
+                seen += len(rest)
+            self.seen[key], self.filled[key] = seen, filled
+
+    def sample(self, key):
+        """層 key の抽出済み回答ベクトル (n <= capacity, シナリオ数)"""
+        if key not in self.samples:
+            return np.empty((0, self.n_scenarios), dtype=np.float32)
+        return self.samples[key][:self.filled[key]]
+
+    def segments(self, axis):
+        return sorted(level for a, level in self.samples if a == axis)
@@ -0,0 +1,177 @@
+"""
+集計スナップショット（Page 3 の全体集計の完成済み結果）
+
+バックグラウンドワーカー（python -m utils.worker）が全回答から
+- シナリオ × 評価のヒストグラムと、シナリオ別の平均・中央値・最頻値・SD・N
+- 属性軸ごと・絞り込み用・重み付け用の集計キューブ
+- KPI、シナリオ間の累積クロス積、認識プロファイルのモデルと層別リザーバーサンプル
+を計算し、1 つのファイルにまとめて書き出します。
+ページは完成済みのファイルを読むだけなので、表示にかかる時間が回答者数に依存しません。
+Streamlit に依存しないため、ベンチマークやバッチ処理からも利用できます。
+"""
+import io
+import json
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from utils.aggregates import CrossMoments, HistogramCube
+from utils.clustering import ProfileModel
+from utils.sketches import StratifiedReservoir
+
+# ファイル形式の版（互換性のない変更をしたら上げる。古い形式は読み込まずワーカーに作り直させる）
+SNAPSHOT_FORMAT = 1
+_STATS_COLUMNS = ['avg', 'median', 'mode', 'std', 'count']
+
+
+@dataclass
+class AggregateSnapshot:
+    """
+    ある時点の全回答から作った集計一式
+
+    scenario_counts は全回答者のシナリオ × 評価ヒストグラム (S, 6)、
+    scenario_stats はそこから求めたシナリオ別の統計量（index=scenario_id）です。
+    source_version は作成時の回答データとシナリオカタログの版で、ワーカーはこれが変わったときだけ作り直します。
+    """
+    scenario_ids: np.ndarray
+    scenario_types: np.ndarray
+    n_users: int
+    scenario_counts: np.ndarray
+    scenario_stats: pd.DataFrame
+    kpi: dict
+    axis_cubes: dict
+    filter_cube: HistogramCube
+    raking_cube: HistogramCube
+    cross_moments: CrossMoments
+    reservoir: StratifiedReservoir
+    profile_model: ProfileModel = None
+    is_demo: bool = False
+    source_version: str = ""
+    built_at: float = 0.0
+    timings: dict = field(default_factory=dict)
+
+    # -------------------------------------------------------
+    # 保存・復元
+    # -------------------------------------------------------
+    def to_bytes(self):
+        arrays = {
+            "scenario_ids": np.asarray(self.scenario_ids, dtype=np.int64),
+            "scenario_types": np.asarray(self.scenario_types, dtype=str),
+            "scenario_counts": self.scenario_counts,
+        }
+        meta = {
+            "format": SNAPSHOT_FORMAT,
+            "n_users": int(self.n_users),
+            "kpi": self.kpi,
+            "is_demo": bool(self.is_demo),
+            "source_version": self.source_version,
+            "built_at": self.built_at,
+            "timings": self.timings,
+            "cubes": [],
+        }
+        for col in _STATS_COLUMNS:
+            arrays[f"stats_{col}"] = self.scenario_stats[col].to_numpy(dtype=np.float64)
+
+        cubes = [("axis", cube) for cube in self.axis_cubes.values()]
+        cubes += [("filter", self.filter_cube), ("raking", self.raking_cube)]
+        for i, (role, cube) in enumerate(cubes):
+            meta["cubes"].append({"role": role, "axes": cube.axes, "levels": cube.levels})
+            arrays[f"cube{i}_counts"] = cube.counts
+            arrays[f"cube{i}_users"] = cube.users
+
+        moments = self.cross_moments
+        arrays.update(moments_n=moments.n, moments_sum_x=moments.sum_x, moments_sum_xx=moments.sum_xx, moments_sum_xy=moments.sum_xy)
+
+        reservoir = self.reservoir
+        keys = list(reservoir.samples)
+        meta["reservoir"] = {"capacity": reservoir.capacity, "keys": keys}
+        arrays.update(
+            reservoir_samples=(
+                np.stack([reservoir.samples[k] for k in keys]) if keys
+                else np.zeros((0, reservoir.capacity, reservoir.n_scenarios), np.float32)
+            ),
+            reservoir_filled=np.array([reservoir.filled[k] for k in keys], dtype=np.int64),
+            reservoir_seen=np.array([reservoir.seen[k] for k in keys], dtype=np.int64),
+        )
+
+        if self.profile_model is not None:
+            arrays.update(
+                profile_centers=self.profile_model.centers, profile_counts=self.profile_model.counts,
+                profile_fill_values=self.profile_model.fill_values,
+            )
+
+        buf = io.BytesIO()
+        np.savez_compressed(buf, meta=np.frombuffer(json.dumps(meta, ensure_ascii=False).encode(), dtype=np.uint8), **arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as npz:
+            meta = json.loads(npz["meta"].tobytes().decode())
+            if meta.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"スナップショットの形式が異なります: {meta.get('format')}")
+            scenario_ids = npz["scenario_ids"]
+
+            axis_cubes, filter_cube, raking_cube = {}, None, None
+            for i, m in enumerate(meta["cubes"]):
+                cube = HistogramCube(
+                    axes=m["axes"], levels=m["levels"], scenario_ids=scenario_ids,
+                    counts=npz[f"cube{i}_counts"], users=npz[f"cube{i}_users"],
+                )
+                if m["role"] == "axis":
+                    axis_cubes[cube.axes[0]] = cube
+                elif m["role"] == "filter":
+                    filter_cube = cube
+                else:
+                    raking_cube = cube
+
+            moments = CrossMoments(len(scenario_ids))
+            moments.n, moments.sum_x = npz["moments_n"], npz["moments_sum_x"]
+            moments.sum_xx, moments.sum_xy = npz["moments_sum_xx"], npz["moments_sum_xy"]
+
+            reservoir = StratifiedReservoir(len(scenario_ids), capacity=meta["reservoir"]["capacity"])
+            for i, key in enumerate(tuple(k) for k in meta["reservoir"]["keys"]):
+                reservoir.samples[key] = npz["reservoir_samples"][i]
+                reservoir.filled[key] = int(npz["reservoir_filled"][i])
+                reservoir.seen[key] = int(npz["reservoir_seen"][i])
+
+            profile_model = (
+                ProfileModel(npz["profile_centers"], npz["profile_counts"], npz["profile_fill_values"])
+                if "profile_centers" in npz.files else None
+            )
+            stats = pd.DataFrame(
+                {col: npz[f"stats_{col}"] for col in _STATS_COLUMNS},
+                index=pd.Index(scenario_ids.astype(int), name='scenario_id'),
+            )
+            return cls(
+                scenario_ids=scenario_ids, scenario_types=npz["scenario_types"].astype(object),
+                n_users=meta["n_users"], scenario_counts=npz["scenario_counts"], scenario_stats=stats,
+                kpi=meta["kpi"], axis_cubes=axis_cubes, filter_cube=filter_cube, raking_cube=raking_cube,
+                cross_moments=moments, reservoir=reservoir, profile_model=profile_model,
+                is_demo=meta["is_demo"], source_version=meta["source_version"], built_at=meta["built_at"],
+                timings=meta.get("timings", {}),
+            )
+
+
+def write_snapshot(snapshot, path):
+    """スナップショットを一時ファイル経由で置き換え保存する（読み手が書きかけを読まないように）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(snapshot.to_bytes())
+    os.replace(tmp, path)
+
+
+def read_snapshot(path):
+    """
+    Returns:
+        AggregateSnapshot | None: ファイルがなければ None（形式が異なる・壊れている場合は例外）
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return AggregateSnapshot.from_bytes(data)
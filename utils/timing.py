@@ -0,0 +1,39 @@
+"""
+描画区間の処理時間の計測
+
+フラグメントなどの区間ごとの処理時間を st.session_state["section_timings"] に記録し、
+DEBUG ログにも出力します（benchmarks/bench_page_reruns.py が参照します）。
+"""
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+TIMINGS_KEY = "section_timings"
+
+
+@contextmanager
+def section_timer(name):
+    """with ブロックの処理時間 (ms) を name で記録する"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - t0) * 1e3
+        st.session_state.setdefault(TIMINGS_KEY, {})[name] = elapsed
+        logger.debug("%s: %.1fms", name, elapsed)
+
+
+def timed(name):
+    """関数の処理時間を記録するデコレーター（@st.fragment の内側に付ける）"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with section_timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,301 @@
+"""
+起動時のキャッシュのウォームアップ
+
+デプロイや再起動の直後は、最初の訪問者が Supabase クライアントの読み込み・シナリオ一覧の取得・
+分析用ビューの全件取得・集計キューブの構築をすべて待つことになります。
+起動スクリプト（python -m utils.serve）が Streamlit のサーバーと同じプロセスで、最初の訪問者を待たずに
+バックグラウンドのスレッドでこれらを順に実行し、共有キャッシュを埋めておきます。
+
+- 段階ごとの所要時間と準備状況は get_warmup_status() と状態ファイル（既定 data/warmup.json）で確認できます。
+  コンテナの readiness probe には `python -m utils.warmup --status`（準備完了なら終了コード 0）を使えます。
+  状態ファイルは起動時に作り直し、書き込んだプロセスが終了している（または PID が再利用された）ファイルは
+  準備完了とみなしません。
+- `python -m utils.warmup` は同じ処理をその場で実行し、段階ごとの時間を表示します（計測用）。
+- st.secrets の [warmup] enabled = false で無効化、status_path で状態ファイルの場所を変更できます。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+
+def _warmup_settings():
+    try:
+        return dict(st.secrets.get("warmup", {}))
+    except Exception:
+        return {}
+
+
+def _status_path():
+    return _warmup_settings().get("status_path", os.path.join("data", "warmup.json"))
+
+
+# -------------------------------------------------------
+# 段階
+# -------------------------------------------------------
+# 重いモジュールはスレッド内で読み込む（読み込み自体もウォームアップの対象）
+def _warm_connection():
+    # 起動スクリプトから始めた場合は、ここが utils.db（Supabase クライアントの読み込みと生成）の最初の import になる
+    from utils.db import init_connection
+    init_connection()
+
+
+def _warm_catalog():
+    from utils.db import get_all_scenarios
+    get_all_scenarios()
+
+
+def _warm_scenario_stats():
+    from utils.db import get_global_averages_stats
+    get_global_averages_stats()
+
+
+def _warm_rating_matrix():
+    from utils import population
+    if population.get_aggregate_mode() != "exact":
+        # 近似集計・スナップショットモードでは評価行列を起動時に読み込まない（必要になったページが読む）
+        return
+    population.load_population()
+
+
+def _warm_aggregates():
+    from utils import population
+    if population.get_aggregate_mode() == "snapshot" and population.get_snapshot() is not None:
+        # 集計はワーカーが作成済み（Page 3 はスナップショットだけを読む）
+        return
+    if population.get_aggregate_mode() == "sketch":
+        # Page 3 は保存済みのスケッチだけを読む
+        population.get_sketch_store()
+        return
+    population.get_axis_cubes()
+    population.get_filter_cube()
+    population.get_raking_cube()
+    population.get_cross_moments()
+
+
+def _warm_models():
+    from utils import population
+    if population.get_aggregate_mode() != "exact":
+        return
+    population.get_profile_model()
+    population.get_neighbor_index()
+    population.get_reservoir()
+
+
+def _warm_demo_data():
+    from utils.db import generate_demo_data
+    generate_demo_data()
+
+
+STAGES = (
+    ("connection", _warm_connection),
+    ("catalog", _warm_catalog),
+    ("scenario_stats", _warm_scenario_stats),
+    ("rating_matrix", _warm_rating_matrix),
+    ("aggregates", _warm_aggregates),
+    ("models", _warm_models),
+    ("demo_data", _warm_demo_data),
+)
+
+
+# -------------------------------------------------------
+# 準備状況
+# -------------------------------------------------------
+def _process_started_at(pid):
+    """プロセスの開始時刻（UNIX 時刻）。/proc がなければ None"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as f:
+            # comm（括弧内）に空白が含まれ得るため、最後の ")" 以降を分割する（starttime は 22 番目の項目）
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat", encoding="utf-8") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except (OSError, TypeError):
+        return False
+    return True
+
+
+def is_current(status):
+    """
+    状態ファイルの内容が、今も動いているサーバープロセスの今回の起動のものか
+
+    書き込んだプロセスが終了している場合や、PID が別のプロセスに再利用されている
+    （そのプロセスの開始時刻より前に書かれた）場合は False を返します。
+    """
+    pid = status.get("pid")
+    if not isinstance(pid, int) or not _pid_alive(pid):
+        return False
+    started = _process_started_at(pid)
+    if started is None:
+        return True
+    recorded = status.get("process_started_at")
+    if recorded is not None and abs(recorded - started) > 1.0:
+        return False
+    return (status.get("started_at") or started) >= started - 1.0
+
+
+class WarmupStatus:
+    """
+    ウォームアップの進み具合
+    state は "pending" → "running" → "ready"（失敗した段階があれば "failed"）と変わります。
+    [warmup] enabled = false の場合は "disabled" です（probe では準備完了として扱う）。
+    """
+
+    def __init__(self):
+        self.state = "pending"
+        self.stages = {}   # 段階名 → 秒
+        self.errors = {}   # 段階名 → エラーメッセージ
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state in ("ready", "disabled")
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "stages": dict(self.stages),
+                "errors": dict(self.errors),
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "pid": os.getpid(),
+                "process_started_at": _process_started_at(os.getpid()),
+            }
+
+
+def _write_status(status, path):
+    """状態ファイルを一時ファイル経由で置き換える（probe が書きかけを読まないように）"""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(status.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.warning("ウォームアップ状態の書き込みエラー: %s", e)
+
+
+def run_warmup(status=None, stages=STAGES, status_path=None):
+    """
+    段階を順に実行する（失敗した段階があっても残りは続ける）
+
+    Returns:
+        WarmupStatus
+    """
+    status = status or WarmupStatus()
+    status_path = status_path or _status_path()
+    with status._lock:
+        status.state = "running"
+        status.started_at = time.time()
+    _write_status(status, status_path)
+
+    for name, warm in stages:
+        t0 = time.perf_counter()
+        try:
+            warm()
+        except Exception as e:
+            logger.warning("ウォームアップ %s でエラー: %s", name, e)
+            with status._lock:
+                status.errors[name] = str(e)
+        elapsed = time.perf_counter() - t0
+        with status._lock:
+            status.stages[name] = elapsed
+        logger.info("ウォームアップ %s: %.2fs", name, elapsed)
+        _write_status(status, status_path)
+
+    with status._lock:
+        status.state = "failed" if status.errors else "ready"
+        status.finished_at = time.time()
+    _write_status(status, status_path)
+    logger.info("ウォームアップ完了 (%s): %.2fs", status.state, status.finished_at - status.started_at)
+    return status
+
+
+# プロセス内で 1 つだけ
+_status = WarmupStatus()
+_start_lock = threading.Lock()
+
+
+def get_warmup_status():
+    return _status
+
+
+def reset_status():
+    """
+    このプロセスの状態（pending）で状態ファイルを置き換える
+    前回の起動で残った "ready" を、今回のウォームアップが終わる前に probe が読まないようにします。
+    """
+    _write_status(_status, _status_path())
+
+
+def start_warmup():
+    """
+    プロセスで最初に呼ばれたときだけ、バックグラウンドのスレッドでウォームアップを始める
+    2 回目以降は何もせず、すぐに戻ります。起動スクリプト（utils.serve）がサーバーの起動時に呼びます。
+
+    Returns:
+        WarmupStatus | None: 無効化されていれば None
+    """
+    if str(_warmup_settings().get("enabled", True)).lower() in ("false", "0"):
+        with _status._lock:
+            _status.state = "disabled"
+        _write_status(_status, _status_path())
+        return None
+    with _start_lock:
+        if _status.state != "pending":
+            return _status
+        _status.state = "running"
+    threading.Thread(target=run_warmup, args=(_status,), name="cache-warmup", daemon=True).start()
+    return _status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--status", action="store_true",
+        help="状態ファイルを表示し、動作中のサーバーの準備が完了していれば 0、それ以外は 1 で終了する",
+    )
+    args = parser.parse_args()
+
+    if args.status:
+        try:
+            with open(_status_path(), encoding="utf-8") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            print("warmup: no status")
+            sys.exit(1)
+        print(json.dumps(status, ensure_ascii=False, indent=2))
+        if not is_current(status):
+            print("warmup: stale status (process not running)")
+            sys.exit(1)
+        sys.exit(0 if status.get("state") in ("ready", "disabled") else 1)
+
+    status = run_warmup()
+    for name, elapsed in status.stages.items():
+        print(f"{name:15s}: {elapsed:6.2f}s" + (f"  ({status.errors[name]})" if name in status.errors else ""))
+    print(f"{'total':15s}: {status.finished_at - status.started_at:6.2f}s -> {status.state}")
+
+
+if __name__ == "__main__":
+    main()
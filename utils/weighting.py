@@ -0,0 +1,104 @@
+"""
+事後層化ウェイト（レイキング）
+
+回答者の属性構成の偏りを補正するため、属性の組み合わせごとの回答者数（集計キューブ）に
+反復比例フィッティング (IPF) を適用し、各セルのウェイトを求めます。
+生データではなくセル単位で計算するため、回答者数によらずミリ秒で終わります。
+"""
+import numpy as np
+
+# レイキングに使う属性軸
+RAKING_COLUMNS = ['age', 'gender', 'position', 'industry']
+
+# 既定の目標分布（労働力調査などを参考にした概算値。st.secrets の [raking] で上書き可能）
+# 目標に含まれない水準（学生・不明など）は観測された構成比のまま据え置きます。
+DEFAULT_TARGETS = {
+    'age': {
+        "10代以下": 0.02, "20代": 0.16, "30代": 0.19, "40代": 0.23, "50代": 0.22, "60代以上": 0.18,
+    },
+    'gender': {
+        "男性": 0.54, "女性": 0.45, "その他・回答しない": 0.01,
+    },
+    'position': {
+        "一般社員": 0.62, "主任・係長クラス (現場リーダー)": 0.16, "課長クラス (マネジメント層)": 0.09,
+        "部長クラス (上級管理職)": 0.04, "経営層 (役員以上)": 0.03, "その他 (役職なし)": 0.06,
+    },
+    'industry': {
+        "メーカー・製造": 0.16, "建設・不動産・物流": 0.16, "IT・通信・インターネット": 0.04,
+        "金融・商社・コンサル": 0.06, "小売・飲食・サービス": 0.24, "医療・福祉・介護": 0.14,
+        "マスコミ・広告・エンタメ": 0.02, "公務員・教職員・団体": 0.09, "その他": 0.09,
+    },
+}
+
+
+def _target_marginal(observed, levels, target):
+    """
+    軸の目標周辺分布を観測と同じ水準順のベクトルにする
+    目標にない水準と、観測 0 件の水準に割り当てられた比率は残りの水準で按分します。
+    """
+    total = observed.sum()
+    if total <= 0:
+        return observed
+    share = np.array([target.get(level, np.nan) for level in levels], dtype=np.float64)
+    fixed = np.isnan(share) | (observed <= 0)
+    free_share = 1.0 - (observed[fixed].sum() / total)
+    listed = np.where(fixed, 0.0, share)
+    if listed.sum() <= 0:
+        return observed
+    return np.where(fixed, observed, listed / listed.sum() * free_share * total)
+
+
+def rake(cell_counts, axes, levels, targets, max_iter=100, tol=1e-6):
+    """
+    反復比例フィッティングでセルのウェイトを求める
+
+    Args:
+        cell_counts: 属性の組み合わせごとの回答者数（形状は各軸の水準数）
+        axes: cell_counts の軸名
+        levels: {axis: 水準ラベルのリスト}
+        targets: {axis: {水準: 目標比率}}（含まれない軸は補正しない）
+
+    Returns:
+        tuple: (weights, n_iter) weights はセルごとの「補正後人数 / 観測人数」
+    """
+    observed = np.asarray(cell_counts, dtype=np.float64)
+    fitted = observed.copy()
+    goals = []
+    for i, axis in enumerate(axes):
+        if axis in targets:
+            other = tuple(j for j in range(observed.ndim) if j != i)
+            goals.append((i, other, _target_marginal(observed.sum(axis=other), levels[axis], targets[axis])))
+
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        max_change = 0.0
+        for i, other, goal in goals:
+            current = fitted.sum(axis=other)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                factor = np.where(current > 0, goal / current, 1.0)
+            shape = [1] * fitted.ndim
+            shape[i] = -1
+            fitted *= factor.reshape(shape)
+            max_change = max(max_change, float(np.abs(factor - 1.0).max(initial=0.0)))
+        if max_change < tol:
+            break
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = np.where(observed > 0, fitted / observed, 0.0)
+    return weights, n_iter
+
+
+def apply_weights(counts, weights):
+    """
+    セル別ヒストグラム (セル..., シナリオ, 6) をウェイト付きで合算し (シナリオ, 6) にする
+    """
+    n_cell_axes = weights.ndim
+    return np.tensordot(weights, counts, axes=(tuple(range(n_cell_axes)), tuple(range(n_cell_axes))))
+
+
+def effective_sample_size(users, weights):
+    """Kish の有効標本サイズ (Σw)² / Σw²（ウェイトによる精度低下の目安）"""
+    w = np.asarray(weights, dtype=np.float64)
+    n = np.asarray(users, dtype=np.float64)
+    denom = (n * w ** 2).sum()
+    return float((n * w).sum() ** 2 / denom) if denom > 0 else 0.0
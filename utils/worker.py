@@ -0,0 +1,178 @@
+"""
+集計スナップショットのバックグラウンドワーカー
+
+    python -m utils.worker [--once] [--force] [--interval 300]
+
+Page 3 の全体集計（シナリオ別の統計量・集計キューブ・ヒストグラム・KPI など）をユーザーのリクエストの外で
+定期的に作り直し、集計スナップショット（既定 data/aggregates.npz）を一時ファイル経由で置き換えます。
+st.secrets の [aggregates] mode = "snapshot" にすると、Page 3 は完成済みのスナップショットだけを読みます。
+
+- interval 秒ごとに回答データとシナリオカタログの版（件数と最終時刻だけの軽い問い合わせ）を確認し、
+  変わっていたときだけ全回答を読み込んで作り直します。
+- 既存の回答の上書き（upsert）は版に表れないため、max_age 秒を過ぎたスナップショットは版が同じでも作り直します。
+- 直前のスナップショットが実データのものなら、取得失敗などでデモデータに切り替わっても上書きしません。
+- st.secrets の [worker] interval / max_age で間隔を、[aggregates] snapshot_path で保存先を変更できます。
+
+Streamlit とは別のプロセス（サイドカーコンテナ、systemd など）で常駐させるか、cron から --once で実行してください。
+"""
+import argparse
+import logging
+import time
+
+import streamlit as st
+
+from utils.aggregates import CrossMoments, build_cube, kpi_summary, scenario_summary
+from utils.clustering import fit_profiles
+from utils.db import get_catalog_version, get_responses_version
+from utils.population import ATTRIBUTE_COLUMNS, FILTER_COLUMNS, build_reservoir, get_snapshot_path, read_population
+from utils.snapshot import AggregateSnapshot, read_snapshot, write_snapshot
+from utils.weighting import RAKING_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300
+DEFAULT_MAX_AGE = 3600
+
+
+def _worker_settings():
+    try:
+        return dict(st.secrets.get("worker", {}))
+    except Exception:
+        return {}
+
+
+# -------------------------------------------------------
+# スナップショットの構築
+# -------------------------------------------------------
+def build_snapshot(population, source_version=""):
+    """
+    評価行列から集計スナップショットを作る（段階ごとの秒数を timings に記録する）
+
+    Returns:
+        AggregateSnapshot
+    """
+    X, attrs, scenario_ids = population.X, population.attrs, population.scenario_ids
+    timings = {}
+    t0 = time.perf_counter()
+
+    def lap(name):
+        nonlocal t0
+        now = time.perf_counter()
+        timings[name] = now - t0
+        t0 = now
+
+    axis_cubes = {
+        axis: build_cube(X, attrs, [axis], scenario_ids)
+        for axis in ATTRIBUTE_COLUMNS if axis in attrs.columns
+    }
+    filter_cube = build_cube(X, attrs, FILTER_COLUMNS, scenario_ids)
+    raking_cube = build_cube(X, attrs, RAKING_COLUMNS, scenario_ids)
+    lap("cubes")
+
+    scenario_counts = raking_cube.marginal().counts
+    scenario_stats = scenario_summary(scenario_ids, scenario_counts)
+    kpi = kpi_summary(scenario_counts, population.scenario_types)
+    lap("scenario_stats")
+
+    cross_moments = CrossMoments.from_matrix(X)
+    lap("cross_moments")
+
+    profile_model = fit_profiles(X) if len(population.user_ids) else None
+    reservoir = build_reservoir(population)
+    lap("profiles")
+
+    return AggregateSnapshot(
+        scenario_ids=scenario_ids, scenario_types=population.scenario_types, n_users=len(population.user_ids),
+        scenario_counts=scenario_counts, scenario_stats=scenario_stats, kpi=kpi,
+        axis_cubes=axis_cubes, filter_cube=filter_cube, raking_cube=raking_cube,
+        cross_moments=cross_moments, reservoir=reservoir, profile_model=profile_model,
+        is_demo=population.is_demo, source_version=source_version, built_at=time.time(), timings=timings,
+    )
+
+
+def source_version():
+    """
+    回答データとシナリオカタログの版
+
+    Returns:
+        str | None: 回答データの版が取得できなければ None
+    """
+    responses = get_responses_version()
+    return None if responses is None else f"{responses}|{get_catalog_version()}"
+
+
+def refresh(previous=None, path=None, force=False, max_age=DEFAULT_MAX_AGE):
+    """
+    必要であればスナップショットを作り直して保存する
+
+    Returns:
+        tuple: (最新の AggregateSnapshot | None, 作り直したかどうか)
+    """
+    path = path or get_snapshot_path()
+    version = source_version()
+    if previous is not None and not force:
+        fresh = time.time() - previous.built_at < max_age
+        if fresh and version is not None and version == previous.source_version:
+            return previous, False
+
+    t0 = time.perf_counter()
+    population = read_population()
+    load_seconds = time.perf_counter() - t0
+    if population.is_demo and previous is not None and not previous.is_demo:
+        logger.warning("回答データを取得できなかったため、スナップショットを更新しません")
+        return previous, False
+
+    snapshot = build_snapshot(population, source_version=version or "")
+    snapshot.timings = {"load": load_seconds, **snapshot.timings}
+    write_snapshot(snapshot, path)
+    logger.info(
+        "スナップショット更新: %s 人 x %s シナリオ%s (%.2fs) -> %s",
+        f"{snapshot.n_users:,}", len(snapshot.scenario_ids), "（デモデータ）" if snapshot.is_demo else "",
+        sum(snapshot.timings.values()), path,
+    )
+    return snapshot, True
+
+
+def _read_previous(path):
+    try:
+        return read_snapshot(path)
+    except Exception as e:
+        logger.warning("既存のスナップショットを読み込めません（作り直します）: %s", e)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="1 回だけ確認・更新して終了する")
+    parser.add_argument("--force", action="store_true", help="版が変わっていなくても作り直す")
+    parser.add_argument("--interval", type=float, help=f"確認の間隔（秒、既定 {DEFAULT_INTERVAL}）")
+    parser.add_argument("--max-age", type=float, help=f"版が同じでも作り直すまでの秒数（既定 {DEFAULT_MAX_AGE}）")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    settings = _worker_settings()
+    interval = args.interval or float(settings.get("interval", DEFAULT_INTERVAL))
+    max_age = args.max_age or float(settings.get("max_age", DEFAULT_MAX_AGE))
+    path = get_snapshot_path()
+    snapshot = _read_previous(path)
+    force = args.force
+
+    while True:
+        try:
+            snapshot, rebuilt = refresh(snapshot, path=path, force=force, max_age=max_age)
+            if args.once:
+                for name, elapsed in snapshot.timings.items():
+                    print(f"{name:15s}: {elapsed:6.2f}s")
+                print(f"{'snapshot':15s}: {snapshot.n_users:,} users -> {path}" + ("" if rebuilt else " (unchanged)"))
+        except Exception as e:
+            logger.exception("スナップショット更新エラー: %s", e)
+            if args.once:
+                raise SystemExit(1)
+        if args.once:
+            break
+        force = False
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    main()